@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark hashing of Python files by a pool of workers, see run_analyzers.
+
+A synthetic tree of files is generated and hashed once per number of workers stated, the page cache is
+warmed up by the first run. Results are printed as a table, redirect them to bench_output.txt to keep them:
+
+  python3 benchmarks/hash_files.py --workers 1,2,4,8 > bench_output.txt
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from thoth.package_extract.image import _hash_files  # noqa: E402
+from thoth.package_extract.vfs import VirtualRootfs  # noqa: E402
+
+
+def _generate_tree(path: str, files: int, min_size: int, max_size: int) -> int:
+    """Generate files of random sizes in the given directory, return their total size."""
+    rng = random.Random(42)
+    total_size = 0
+    for idx in range(files):
+        dir_path = os.path.join(path, f"pkg{idx % 100}")
+        os.makedirs(dir_path, exist_ok=True)
+        size = rng.randint(min_size, max_size)
+        with open(os.path.join(dir_path, f"module{idx}.py"), "wb") as file_:
+            file_.write(os.urandom(size))
+        total_size += size
+
+    return total_size
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--min-size", type=int, default=200)
+    parser.add_argument("--max-size", type=int, default=200 * 1024)
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-hash-files-") as path:
+        total_size = _generate_tree(path, args.files, args.min_size, args.max_size)
+        rootfs = VirtualRootfs.from_directory(path)
+        file_paths = sorted(
+            os.path.relpath(os.path.join(root, file_), path)
+            for root, _, files in os.walk(path)
+            for file_ in files
+        )
+        # Warm up the page cache.
+        _hash_files(file_paths, 1, rootfs)
+
+        print(
+            f"files={len(file_paths)} size={total_size / 1024**2:.0f}MiB cpus={os.cpu_count()}"
+        )
+        for workers in (int(item) for item in args.workers.split(",")):
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.monotonic()
+                _hash_files(file_paths, workers, rootfs)
+                best = min(best, time.monotonic() - start)
+
+            print(
+                f"workers={workers:<3} {best:7.2f}s {total_size / 1024**2 / best:8.0f} MiB/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -17,8 +17,12 @@
 
 """Shared classes and utilities across test suite."""
 
+import gzip
+import hashlib
+import io
 import json
 import os
+import tarfile
 
 
 class TestCase:
@@ -46,3 +50,58 @@ class TestCase:
             # Return results instead.
             output = handler().run(input_content)
             yield output, expected_output
+
+    @staticmethod
+    def build_layer(entries) -> bytes:
+        """Build a gzipped layer tarball, entries are tuples of name and content (bytes, "dir" or a symlink target)."""
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar_file:
+            for name, content in entries:
+                member = tarfile.TarInfo(name)
+                if content == "dir":
+                    member.type = tarfile.DIRTYPE
+                    member.mode = 0o755
+                    tar_file.addfile(member)
+                elif isinstance(content, str):
+                    member.type = tarfile.SYMTYPE
+                    member.linkname = content
+                    tar_file.addfile(member)
+                else:
+                    member.size = len(content)
+                    member.mode = 0o644
+                    tar_file.addfile(member, io.BytesIO(content))
+
+        return gzip.compress(buffer.getvalue(), mtime=0)
+
+    @classmethod
+    def build_image(cls, dir_path: str, layers) -> None:
+        """Build an image in the directory layout produced by skopeo copy to a dir: transport."""
+        os.makedirs(dir_path, exist_ok=True)
+        manifest_layers = []
+        for entries in layers:
+            blob = cls.build_layer(entries)
+            digest = hashlib.sha256(blob).hexdigest()
+            with open(os.path.join(dir_path, digest), "wb") as blob_file:
+                blob_file.write(blob)
+            manifest_layers.append(
+                {
+                    "mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+                    "size": len(blob),
+                    "digest": f"sha256:{digest}",
+                }
+            )
+
+        config = b"{}"
+        config_digest = hashlib.sha256(config).hexdigest()
+        with open(os.path.join(dir_path, config_digest), "wb") as config_file:
+            config_file.write(config)
+
+        manifest = {
+            "schemaVersion": 2,
+            "config": {"size": len(config), "digest": f"sha256:{config_digest}"},
+            "layers": manifest_layers,
+        }
+        with open(os.path.join(dir_path, "manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        with open(os.path.join(dir_path, "version"), "w") as version_file:
+            version_file.write("Directory Transport Version: 1.1\n")
@@ -0,0 +1,15 @@
+#!/bin/sh
+# Build ELF files used by tests, run in this directory; the output is written to the parent directory.
+set -e
+
+FLAGS="-O2 -nostdlib -Wl,--build-id=none -Wl,-z,noseparate-code -s"
+WORK_DIR=$(mktemp -d)
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+gcc $FLAGS -shared -fPIC -Wl,-soname,libversioned.so.1 -Wl,--version-script=libversioned.map \
+    libversioned.c -o ../libversioned.so.1
+gcc $FLAGS -shared -fPIC -Wl,-soname,libpython3.9.so.1.0 libpython.c -o "$WORK_DIR/libpython3.9.so.1.0"
+gcc $FLAGS -fPIE -pie python3.c -L"$WORK_DIR" -l:libpython3.9.so.1.0 \
+    -Wl,--enable-new-dtags,-rpath,'$ORIGIN/../lib' -o ../python3
+# An interpreter not linked against libpython, the version is stated in the binary itself.
+gcc $FLAGS -fPIE -pie python3-static.c -o ../python3-static
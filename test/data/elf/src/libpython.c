@@ -0,0 +1 @@
+int Py_Main(void) { return 0; }
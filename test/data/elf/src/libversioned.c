@@ -0,0 +1,3 @@
+int versioned_v1(void) { return 1; }
+int versioned_v2(void) { return 2; }
+__asm__(".globl LIBV_ABS_1.0\n.set LIBV_ABS_1.0, 0\n");
@@ -0,0 +1,2 @@
+const char version[] = "3.8.6";
+int _start(void) { return version[0]; }
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Generate rpm databases used by tests, run in this directory.
+
+Berkeley DB hash (Packages) and NDB (Packages.db) databases are written in the on-disk formats rpm uses,
+storing headers of the packages stated below. Headers do not state tags not read by package-extract.
+"""
+
+import struct
+
+_PACKAGES = [
+    {
+        1000: "bash",
+        1001: "5.0.17",
+        1002: "2.fc32",
+        1022: "x86_64",
+        # Requirements as tuples of name, flags and version.
+        1049: [
+            ("/bin/sh", 0x100, ""),
+            ("filesystem", 0x4 | 0x8, "3"),
+            ("libc.so.6()(64bit)", 0x4000, ""),
+            ("rpmlib(CompressedFileNames)", 0x1000000 | 0x2 | 0x8, "3.0.4-1"),
+            ("rpmlib(PayloadIsZstd)", 0x1000000 | 0x2 | 0x8, "5.4.18-1"),
+            ("bash-completion", 0x80000, ""),
+        ],
+        # Long descriptive data make the header span multiple overflow pages.
+        1005: "The GNU Bourne Again shell. " * 40,
+    },
+    {
+        1000: "python3",
+        1001: "3.8.5",
+        1002: "1.fc32",
+        1003: 1,
+        1022: "x86_64",
+        1049: [("python3-libs", 0x8, "1:3.8.5-1.fc32")],
+    },
+]
+
+_TYPE_INT32 = 4
+_TYPE_STRING = 6
+_TYPE_STRING_ARRAY = 8
+
+
+def _build_header(package):
+    """Build a header blob as stored in rpmdb (with no lead and signature)."""
+    tags = []
+    for tag, value in package.items():
+        if tag == 1049:
+            tags.append((1048, _TYPE_INT32, [flags for _, flags, _ in value]))
+            tags.append((1049, _TYPE_STRING_ARRAY, [name for name, _, _ in value]))
+            tags.append((1050, _TYPE_STRING_ARRAY, [ver for _, _, ver in value]))
+        elif isinstance(value, int):
+            tags.append((tag, _TYPE_INT32, [value]))
+        else:
+            tags.append((tag, _TYPE_STRING, value))
+
+    index = b""
+    data = b""
+    for tag, type_, value in sorted(tags):
+        if type_ == _TYPE_INT32:
+            data += b"\0" * (-len(data) % 4)
+            content, count = struct.pack(f">{len(value)}i", *value), len(value)
+        elif type_ == _TYPE_STRING:
+            content, count = value.encode() + b"\0", 1
+        else:
+            content, count = b"".join(v.encode() + b"\0" for v in value), len(value)
+        index += struct.pack(">IIII", tag, type_, len(data), count)
+        data += content
+
+    return struct.pack(">II", len(tags), len(data)) + index + data
+
+
+def _bdb_page(page_number, page_type, entries=0, hf_offset=0, next_page=0):
+    """Build a Berkeley DB page header."""
+    return struct.pack(
+        "<QIIIHHBB", 0, page_number, 0, next_page, entries, hf_offset, 1, page_type
+    )
+
+
+def generate_bdb(headers, page_size=512):
+    """Generate a Berkeley DB hash database keyed by package instance numbers, headers are stored off-page."""
+    # Page 0 is the hash metadata page, page 1 the bucket, overflow pages follow.
+    meta = struct.pack("<QIIIIBBBB", 0, 0, 0x061561, 9, page_size, 0, 8, 0, 0)
+    pages = [meta.ljust(page_size, b"\0"), None]
+
+    items = [(b"\x01" + struct.pack("<I", 0)), b"\x01" + struct.pack("<I", 3)]
+    for instance, header in enumerate(headers, start=1):
+        chunk_size = page_size - 26
+        first_page = len(pages)
+        chunks = [
+            header[idx : idx + chunk_size] for idx in range(0, len(header), chunk_size)
+        ]
+        for idx, chunk in enumerate(chunks):
+            next_page = first_page + idx + 1 if idx + 1 < len(chunks) else 0
+            page = _bdb_page(first_page + idx, 7, 1, len(chunk), next_page) + chunk
+            pages.append(page.ljust(page_size, b"\0"))
+        items.append(b"\x01" + struct.pack("<I", instance))
+        items.append(struct.pack("<B3xII", 3, first_page, len(header)))
+
+    offsets = []
+    end = page_size
+    content = bytearray(page_size)
+    for item in items:
+        end -= len(item)
+        content[end : end + len(item)] = item
+        offsets.append(end)
+    bucket = _bdb_page(1, 13, len(items), end) + struct.pack(
+        f"<{len(offsets)}H", *offsets
+    )
+    content[: len(bucket)] = bucket
+    pages[1] = bytes(content)
+    return b"".join(pages)
+
+
+def generate_ndb(headers):
+    """Generate an NDB database, a single slot page followed by blobs aligned to 16 bytes."""
+    page_size = 4096
+    slots = struct.pack("<IIII", 0x506D7052, 0, 1, 1) + b"\0" * 16
+    blobs = b""
+    for instance, header in enumerate(headers, start=1):
+        blob = struct.pack("<IIII", 0x53626C42, instance, 1, len(header)) + header
+        # The blob tail (checksum and length) is not read by package-extract.
+        blob += b"\0" * 12
+        blob += b"\0" * (-len(blob) % 16)
+        block_offset = (page_size + len(blobs)) // 16
+        slots += struct.pack(
+            "<IIII", 0x746F6C53, instance, block_offset, len(blob) // 16
+        )
+        blobs += blob
+
+    while len(slots) < page_size:
+        slots += struct.pack("<IIII", 0x746F6C53, 0, 0, 0)
+
+    return slots + blobs
+
+
+def main():
+    """Generate the databases."""
+    headers = [_build_header(package) for package in _PACKAGES]
+    with open("bdb/var/lib/rpm/Packages", "wb") as db_file:
+        db_file.write(generate_bdb(headers))
+    with open("ndb/usr/lib/sysimage/rpm/Packages.db", "wb") as db_file:
+        db_file.write(generate_ndb(headers))
+
+
+if __name__ == "__main__":
+    main()
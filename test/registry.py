@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""A container registry served from images in skopeo's dir: layout, used to test the registry client."""
+
+import http.server
+import json
+import os
+import re
+import threading
+import time
+
+
+class FakeRegistry:
+    """A registry serving images over plain HTTP on localhost, requiring bearer token authentication.
+
+    Requests served are recorded as tuples of path and Range header, token requests as tuples of path and
+    Authorization header. Blobs stated in drop_once are cut in the middle the first time they are served,
+    blobs are served with the given delay (in seconds).
+    """
+
+    def __init__(self, images, *, drop_once=(), delay=0.0) -> None:
+        """Serve the given images keyed by repository names."""
+        self.images = images
+        self.drop_once = set(drop_once)
+        self.delay = delay
+        self.requests = []
+        self.token_requests = []
+        self._lock = threading.Lock()
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._create_handler()
+        )
+        self._server.daemon_threads = True
+        self.address = f"127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> "FakeRegistry":
+        """Start serving requests in a background thread."""
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        """Stop serving requests."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count_requests(self, path: str) -> int:
+        """Count requests for the given path."""
+        return sum(1 for request_path, _ in self.requests if request_path == path)
+
+    def _create_handler(self):
+        """Create a request handler class bound to this registry."""
+        registry = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_) -> None:
+                """Do not log requests."""
+
+            def _send(self, status: int, body: bytes = b"", headers=()) -> None:
+                """Send a response with the given body."""
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:  # noqa: N802
+                """Serve tokens, manifests and blobs."""
+                if self.path.startswith("/token"):
+                    with registry._lock:
+                        registry.token_requests.append(
+                            (self.path, self.headers.get("Authorization"))
+                        )
+                    self._send(200, json.dumps({"token": "secret"}).encode())
+                    return
+
+                if self.headers.get("Authorization") != "Bearer secret":
+                    challenge = (
+                        f'Bearer realm="http://{registry.address}/token",service="fake"'
+                    )
+                    self._send(401, b"{}", [("WWW-Authenticate", challenge)])
+                    return
+
+                with registry._lock:
+                    registry.requests.append((self.path, self.headers.get("Range")))
+
+                match = re.match(r"^/v2/(.+)/(manifests|blobs)/(.+)$", self.path)
+                dir_path = registry.images.get(match.group(1)) if match else None
+                if dir_path is None:
+                    self._send(404)
+                    return
+
+                if match.group(2) == "manifests":
+                    with open(os.path.join(dir_path, "manifest.json"), "rb") as file_:
+                        content = file_.read()
+                    media_type = "application/vnd.docker.distribution.manifest.v2+json"
+                    self._send(200, content, [("Content-Type", media_type)])
+                    return
+
+                blob_path = os.path.join(dir_path, match.group(3).split(":")[-1])
+                if not os.path.isfile(blob_path):
+                    self._send(404)
+                    return
+
+                with open(blob_path, "rb") as file_:
+                    content = file_.read()
+                time.sleep(registry.delay)
+
+                range_header = self.headers.get("Range")
+                if range_header:
+                    start = int(range_header[len("bytes=") :].rstrip("-"))
+                    content_range = f"bytes {start}-{len(content) - 1}/{len(content)}"
+                    self._send(206, content[start:], [("Content-Range", content_range)])
+                    return
+
+                with registry._lock:
+                    drop = match.group(3) in registry.drop_once
+                    registry.drop_once.discard(match.group(3))
+
+                if drop:
+                    # State the full length but send a half and close the connection.
+                    self.send_response(200)
+                    self.send_header("Content-Length", str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content[: len(content) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+
+                self._send(200, content)
+
+        return _Handler
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for extraction of multiple images in one run."""
+
+from thoth.package_extract.batch import extract_images
+from thoth.package_extract.batch import read_image_list
+from thoth.package_extract.cache import LayerCache
+
+from .case import TestCase
+from .registry import FakeRegistry
+
+
+class TestReadImageList(TestCase):
+    """Test reading lists of images to extract."""
+
+    def test_read(self) -> None:
+        """Test comments and blank lines are skipped, duplicates are dropped and the order is kept."""
+        lines = [
+            "# Images to analyze.\n",
+            "quay.io/thoth/b:latest\n",
+            "\n",
+            "   \n",
+            "  quay.io/thoth/a:latest  # the base image\n",
+            "quay.io/thoth/b:latest\n",
+            "quay.io/thoth/c:latest",
+        ]
+
+        assert read_image_list(lines) == [
+            "quay.io/thoth/b:latest",
+            "quay.io/thoth/a:latest",
+            "quay.io/thoth/c:latest",
+        ]
+
+    def test_empty(self) -> None:
+        """Test no images are read from a list with comments only."""
+        assert read_image_list(["# nothing to do\n", "\n"]) == []
+
+
+class TestExtractImages(TestCase):
+    """Test extraction of multiple images served by a local registry."""
+
+    def test_extract_images(self, tmp_path) -> None:
+        """Test all the images are extracted, failing images are reported without affecting the others."""
+        base_layer = [
+            ("etc", "dir"),
+            ("etc/os-release", b'ID="fedora"\nVERSION_ID="32"\n'),
+        ]
+        self.build_image(str(tmp_path / "a"), [base_layer])
+        self.build_image(str(tmp_path / "b"), [base_layer, [("opt", "dir")]])
+
+        with FakeRegistry(
+            {"thoth/a": str(tmp_path / "a"), "thoth/b": str(tmp_path / "b")}
+        ) as registry:
+            images = [
+                f"{registry.address}/thoth/a:latest",
+                f"{registry.address}/thoth/missing:latest",
+                f"{registry.address}/thoth/b:latest",
+            ]
+            results = {
+                batch_result.image: batch_result
+                for batch_result in extract_images(
+                    images,
+                    parallelism=2,
+                    native_registry=True,
+                    plain_http=True,
+                    analyzers=["operating-system"],
+                    layer_cache=LayerCache(str(tmp_path / "layer-cache")),
+                )
+            }
+
+        assert set(results) == set(images)
+        for image in (images[0], images[2]):
+            assert results[image].error is None
+            assert results[image].result["operating-system"] == {
+                "id": "fedora",
+                "version_id": "32",
+            }
+
+        failed = results[images[1]]
+        assert failed.result is None
+        assert failed.error
+        assert failed.to_dict() == {
+            "image": images[1],
+            "duration": failed.duration,
+            "error": failed.error,
+        }
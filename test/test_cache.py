@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for persistent caches shared across image scans."""
+
+import hashlib
+import os
+
+from thoth.package_extract.cache import AnalysisCache
+from thoth.package_extract.cache import BlobCache
+from thoth.package_extract.cache import LayerCache
+from thoth.package_extract.cache import SymbolCache
+from thoth.package_extract.cache import get_chain_ids
+from thoth.package_extract.image import construct_rootfs
+from thoth.package_extract.image import construct_virtual_rootfs
+from thoth.package_extract.image import get_image_layers
+
+from .case import TestCase
+
+
+def _populate(content: str, tree_path: str) -> dict:
+    """Populate a layer tree with a single file."""
+    with open(os.path.join(tree_path, "file"), "w") as file_:
+        file_.write(content)
+    return {"digests": {}}
+
+
+class TestLayerCache(TestCase):
+    """Test the layer cache."""
+
+    def test_evict_unpinned(self, tmp_path) -> None:
+        """Test layers not used by any job are evicted once the cache exceeds its size limit."""
+        layer_cache = LayerCache(str(tmp_path), max_size=0)
+        layer_cache.store("a", lambda tree_path: _populate("a", tree_path))
+        layer_cache.store("b", lambda tree_path: _populate("b", tree_path))
+
+        assert layer_cache.get("a") is None
+        assert layer_cache.get("b") is not None
+
+    def test_pinned_not_evicted(self, tmp_path) -> None:
+        """Test layers used by a job are kept until the job finishes."""
+        layer_cache = LayerCache(str(tmp_path), max_size=0)
+        with layer_cache.leased() as job_layer_cache:
+            tree_path, _ = job_layer_cache.store(
+                "a", lambda tree_path: _populate("a", tree_path)
+            )
+            # Another job storing a layer triggers eviction.
+            with layer_cache.leased() as other_layer_cache:
+                other_layer_cache.store(
+                    "b", lambda tree_path: _populate("b", tree_path)
+                )
+
+            with open(os.path.join(tree_path, "file")) as file_:
+                assert file_.read() == "a"
+
+        layer_cache.evict()
+        assert layer_cache.get("a") is None
+        assert layer_cache.get("b") is None
+
+    def test_evicted_pin_files_removed(self, tmp_path) -> None:
+        """Test pin files of evicted layers are removed."""
+        layer_cache = LayerCache(str(tmp_path), max_size=0)
+        for digest in ("a", "b", "c"):
+            with layer_cache.leased() as job_layer_cache:
+                job_layer_cache.store(
+                    digest, lambda tree_path: _populate(digest, tree_path)
+                )
+
+        assert os.listdir(str(tmp_path / ".pins")) == ["c"]
+
+    def test_remove_pinned(self, tmp_path) -> None:
+        """Test layers pinned by other jobs are not removed, layers pinned only by the job removing them are."""
+        layer_cache = LayerCache(str(tmp_path))
+        with layer_cache.leased() as job_layer_cache:
+            job_layer_cache.store("a", lambda tree_path: _populate("a", tree_path))
+            with layer_cache.leased() as other_layer_cache:
+                assert other_layer_cache.get("a") is not None
+                assert not job_layer_cache.remove("a")
+                assert job_layer_cache.get("a") is not None
+
+            assert job_layer_cache.remove("a")
+
+        assert layer_cache.get("a") is None
+        assert os.listdir(str(tmp_path / ".pins")) == []
+
+    def test_pinned_layer_without_digests(self, tmp_path) -> None:
+        """Test layers stored without file digests and used by other jobs are extracted without the cache."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, [[("usr", "dir"), ("usr/a.py", b"a\n")]])
+        (layer_digest,) = get_image_layers(image_path)
+
+        layer_cache = LayerCache(str(tmp_path / "layer-cache"))
+        with layer_cache.leased() as other_layer_cache:
+            other_layer_cache.store(layer_digest, lambda tree_path: {})
+
+            rootfs_path = str(tmp_path / "rootfs")
+            with layer_cache.leased() as job_layer_cache:
+                construct_rootfs(
+                    image_path, rootfs_path, layer_cache=job_layer_cache, workers=1
+                )
+
+            with open(os.path.join(rootfs_path, "usr", "a.py")) as file_:
+                assert file_.read() == "a\n"
+            assert other_layer_cache.get(layer_digest) == (
+                str(tmp_path / "layer-cache" / layer_digest / "rootfs"),
+                {},
+            )
+
+        # Once not used, the layer is replaced by one with file digests.
+        with layer_cache.leased() as job_layer_cache:
+            construct_rootfs(
+                image_path,
+                str(tmp_path / "rootfs-cached"),
+                layer_cache=job_layer_cache,
+                workers=1,
+            )
+        assert "digests" in layer_cache.get(layer_digest)[1]
+
+    def test_virtual_rootfs_small_cache(self, tmp_path) -> None:
+        """Test trees of layers indexed in virtual rootfs stay available even if the cache is too small."""
+        image_path = str(tmp_path / "image")
+        self.build_image(
+            image_path,
+            [
+                [("usr", "dir"), ("usr/a.py", b"a\n")],
+                [("usr/b.py", b"b\n")],
+                [("usr/c.py", b"c\n")],
+            ],
+        )
+
+        layer_cache = LayerCache(str(tmp_path / "layer-cache"), max_size=1)
+        with layer_cache.leased() as job_layer_cache:
+            rootfs = construct_virtual_rootfs(
+                image_path, layer_cache=job_layer_cache, workers=1
+            )
+            assert rootfs.read_bytes("usr/a.py") == b"a\n"
+            assert rootfs.read_bytes("usr/b.py") == b"b\n"
+            assert rootfs.read_bytes("usr/c.py") == b"c\n"
+
+
+class TestBlobCache(TestCase):
+    """Test the blob cache."""
+
+    @staticmethod
+    def _store(blob_cache: BlobCache, digest: str, tmp_path) -> None:
+        """Store a blob with the given digest, the blob is stored under its lock as when pulling images."""
+        blob_path = str(tmp_path / f"blob-{digest}")
+        with open(blob_path, "w") as blob_file:
+            blob_file.write(digest)
+
+        with blob_cache.lock(digest):
+            blob_cache.store(digest, blob_path)
+
+    def test_evicted_lock_files_removed(self, tmp_path) -> None:
+        """Test lock files of evicted entries are removed."""
+        blob_cache = BlobCache(str(tmp_path / "blobs"), max_size=0)
+        self._store(blob_cache, "a", tmp_path)
+        self._store(blob_cache, "b", tmp_path)
+        self._store(blob_cache, "c", tmp_path)
+
+        assert os.listdir(str(tmp_path / "blobs" / ".locks")) == ["c"]
+
+    def test_removed_lock_files_removed(self, tmp_path) -> None:
+        """Test lock files of removed entries are removed."""
+        blob_cache = BlobCache(str(tmp_path / "blobs"))
+        self._store(blob_cache, "a", tmp_path)
+
+        blob_cache.remove("a")
+
+        assert os.listdir(str(tmp_path / "blobs" / ".locks")) == []
+
+    def test_held_lock_files_kept(self, tmp_path) -> None:
+        """Test lock files held by others are kept until they are released."""
+        blob_cache = BlobCache(str(tmp_path / "blobs"), max_size=0)
+        with blob_cache.lock("a"):
+            self._store(blob_cache, "b", tmp_path)
+            assert sorted(os.listdir(str(tmp_path / "blobs" / ".locks"))) == ["a", "b"]
+
+        self._store(blob_cache, "c", tmp_path)
+        assert os.listdir(str(tmp_path / "blobs" / ".locks")) == ["c"]
+
+
+class TestAnalysisCache(TestCase):
+    """Test the analysis cache."""
+
+    def test_get_chain_ids(self) -> None:
+        """Test identifiers of layer chains describe the whole stack of layers, not just the top layer."""
+        chain_ids = get_chain_ids(["a", "b", "c"])
+
+        assert chain_ids[0] == "a"
+        assert chain_ids[1] == hashlib.sha256(b"a b").hexdigest()
+        assert chain_ids[2] == hashlib.sha256(f"{chain_ids[1]} c".encode()).hexdigest()
+        assert get_chain_ids(["x", "b"])[1] != chain_ids[1]
+        assert get_chain_ids([]) == []
+
+    def test_get_longest_prefix(self, tmp_path) -> None:
+        """Test results stored for a lower stack of layers are found for an image built on top of it."""
+        analysis_cache = AnalysisCache(str(tmp_path))
+        analysis_cache.store(["a"], {"layers": 1})
+        analysis_cache.store(["a", "b"], {"layers": 2})
+
+        assert analysis_cache.get_longest_prefix(["a", "b", "c", "d"]) == (
+            2,
+            {"layers": 2},
+        )
+        assert analysis_cache.get_longest_prefix(["a", "c", "d"]) == (
+            1,
+            {"layers": 1},
+        )
+        assert analysis_cache.get_longest_prefix(["a", "b"]) == (2, {"layers": 2})
+
+    def test_get_longest_prefix_other_base(self, tmp_path) -> None:
+        """Test results are not found for the same layers stacked on a different base layer."""
+        analysis_cache = AnalysisCache(str(tmp_path))
+        analysis_cache.store(["a", "b"], {"layers": 2})
+
+        assert analysis_cache.get(["x", "b"]) is None
+        assert analysis_cache.get_longest_prefix(["x", "b", "c"]) == (0, None)
+        assert analysis_cache.get_longest_prefix([]) == (0, None)
+
+
+class TestSymbolCache(TestCase):
+    """Test the symbol cache."""
+
+    _DIGEST_A = hashlib.sha256(b"a").hexdigest()
+    _DIGEST_B = hashlib.sha256(b"b").hexdigest()
+
+    def test_get_many(self, tmp_path) -> None:
+        """Test symbols are found for stored digests, digests not stored are not stated."""
+        symbol_cache = SymbolCache(str(tmp_path))
+        symbol_cache.store({self._DIGEST_A: {"GLIBC_2.2.5", "GLIBC_2.3"}})
+
+        assert symbol_cache.get_many([self._DIGEST_A, self._DIGEST_B]) == {
+            self._DIGEST_A: ["GLIBC_2.2.5", "GLIBC_2.3"],
+        }
+        assert symbol_cache.get_many([]) == {}
+
+    def test_no_symbols(self, tmp_path) -> None:
+        """Test shared objects exporting no symbols are cached as well."""
+        symbol_cache = SymbolCache(str(tmp_path))
+        symbol_cache.store({self._DIGEST_A: []})
+
+        assert symbol_cache.get_many([self._DIGEST_A]) == {self._DIGEST_A: []}
+
+    def test_shared(self, tmp_path) -> None:
+        """Test entries are shared by caches using the same directory."""
+        SymbolCache(str(tmp_path)).store({self._DIGEST_A: ["LIBV_1.0"]})
+
+        assert SymbolCache(str(tmp_path)).get_many([self._DIGEST_A]) == {
+            self._DIGEST_A: ["LIBV_1.0"]
+        }
+
+    def test_evict(self, tmp_path) -> None:
+        """Test least recently used entries are evicted once the cache exceeds its size limit."""
+        entry_size = len(self._DIGEST_A) // 2 + len("LIBV_1.0")
+        symbol_cache = SymbolCache(str(tmp_path), max_size=entry_size)
+        symbol_cache.store({self._DIGEST_A: ["LIBV_1.0"]})
+        symbol_cache.store({self._DIGEST_B: ["LIBV_1.0"]})
+
+        assert symbol_cache.get_many([self._DIGEST_A, self._DIGEST_B]) == {
+            self._DIGEST_B: ["LIBV_1.0"]
+        }
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for extraction of images end to end."""
+
+import os
+import shutil
+
+from thoth.package_extract import core
+from thoth.package_extract.core import extract_image
+
+from .case import TestCase
+
+
+class TestExtractImage(TestCase):
+    """Test extraction of images, downloading is replaced by copying images built by tests."""
+
+    @staticmethod
+    def _read_data(*path: str) -> bytes:
+        """Read a file from the test data directory."""
+        with open(os.path.join(TestCase.DATA_DIR, *path), "rb") as data_file:
+            return data_file.read()
+
+    @staticmethod
+    def _extract(monkeypatch, image_path: str, **kwargs) -> dict:
+        """Extract the image built in the given directory."""
+
+        def download_image(image_name, dir_path, **_) -> None:
+            shutil.copytree(image_path, dir_path, dirs_exist_ok=True)
+
+        monkeypatch.setattr(core, "download_image", download_image)
+        return extract_image("quay.io/thoth/image:latest", **kwargs)
+
+    def test_selected_analyzers_complete(self, tmp_path, monkeypatch) -> None:
+        """Test selecting analyzers does not restrict files they see, libraries in ld.so.conf paths are found."""
+        image_path = str(tmp_path / "image")
+        self.build_image(
+            image_path,
+            [
+                [
+                    ("etc", "dir"),
+                    ("etc/ld.so.conf", b"/opt/lib"),
+                    ("opt", "dir"),
+                    ("opt/lib", "dir"),
+                    (
+                        "opt/lib/libversioned.so.1",
+                        self._read_data("elf", "libversioned.so.1"),
+                    ),
+                ]
+            ],
+        )
+
+        result = self._extract(monkeypatch, image_path, analyzers=["system-symbols"])
+        assert set(result) == {"system-symbols", "layers", "image_size"}
+        assert sorted(result["system-symbols"]["/opt/lib/libversioned.so.1"]) == [
+            "LIBV_1.0",
+            "LIBV_2.0",
+            "LIBV_ABS_1.0",
+        ]
+
+        result = self._extract(
+            monkeypatch,
+            image_path,
+            analyzers=["system-symbols"],
+            selective_extraction=True,
+        )
+        assert result["system-symbols"] == {}
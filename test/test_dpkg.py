@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for reading the dpkg status database."""
+
+import os
+
+from thoth.package_extract.dpkg import parse_control
+from thoth.package_extract.dpkg import read_dpkg_status
+
+from .case import TestCase
+
+
+class TestDpkg(TestCase):
+    """Test reading packages installed by dpkg."""
+
+    _DPKG_DIR = os.path.join(TestCase.DATA_DIR, "dpkg")
+
+    def test_parse_control(self) -> None:
+        """Test continuation lines are joined, stanzas are separated by empty lines."""
+        stanzas = list(
+            parse_control(
+                [
+                    "Package: foo\n",
+                    "Description: A package\n",
+                    " with a long description.\n",
+                    "\n",
+                    "\n",
+                    "Package: bar\n",
+                ]
+            )
+        )
+        assert stanzas == [
+            {
+                "Package": "foo",
+                "Description": "A package\nwith a long description.",
+            },
+            {"Package": "bar"},
+        ]
+
+    def test_status(self) -> None:
+        """Test only installed packages are read from the status file."""
+        stanzas = read_dpkg_status(os.path.join(self._DPKG_DIR, "debian"))
+        assert [
+            (stanza["Package"], stanza["Version"], stanza["Architecture"])
+            for stanza in stanzas
+        ] == [
+            ("base-files", "10.3+deb10u4", "amd64"),
+            ("libc6", "2.28-10", "amd64"),
+        ]
+        assert stanzas[0]["Conffiles"].startswith("\n/etc/debian_version ")
+        assert stanzas[1]["Source"] == "glibc"
+
+    def test_status_dir(self) -> None:
+        """Test packages are read from status.d used by distroless images, they are treated as installed."""
+        stanzas = read_dpkg_status(os.path.join(self._DPKG_DIR, "distroless"))
+        assert [(stanza["Package"], stanza["Version"]) for stanza in stanzas] == [
+            ("base-files", "10.3+deb10u4"),
+            ("libssl1.1", "1.1.1d-0+deb10u3"),
+        ]
+        assert stanzas[1]["Depends"] == "libc6 (>= 2.25)"
+
+    def test_no_status(self, tmp_path) -> None:
+        """Test None is returned if there is no dpkg status database."""
+        assert read_dpkg_status(str(tmp_path)) is None
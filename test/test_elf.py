@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for reading ELF files, fixtures are built by test/data/elf/src/build.sh."""
+
+import os
+
+import pytest
+
+from thoth.package_extract.elf import ELFError
+from thoth.package_extract.elf import get_linking_info
+from thoth.package_extract.elf import get_read_only_data
+from thoth.package_extract.elf import get_version_symbols
+
+from .case import TestCase
+
+
+class TestELF(TestCase):
+    """Test reading ELF files."""
+
+    _ELF_DIR = os.path.join(TestCase.DATA_DIR, "elf")
+
+    def _read(self, name: str) -> bytes:
+        """Read an ELF file fixture."""
+        with open(os.path.join(self._ELF_DIR, name), "rb") as elf_file:
+            return elf_file.read()
+
+    def test_version_symbols(self) -> None:
+        """Test version definitions and absolute symbols are reported, the base definition is not."""
+        assert get_version_symbols(
+            os.path.join(self._ELF_DIR, "libversioned.so.1")
+        ) == {"LIBV_1.0", "LIBV_2.0", "LIBV_ABS_1.0"}
+
+    def test_version_symbols_not_elf(self, tmp_path) -> None:
+        """Test files which are not ELF files are not inspected."""
+        file_path = tmp_path / "libfoo.so"
+        file_path.write_bytes(b"INPUT(-lfoo)\n")
+        assert get_version_symbols(str(file_path)) is None
+
+    def test_linking_info(self) -> None:
+        """Test needed libraries and paths to search them in are reported."""
+        assert get_linking_info(self._read("python3")) == (
+            ["libpython3.9.so.1.0"],
+            ["$ORIGIN/../lib"],
+        )
+        assert get_linking_info(b"#!/bin/sh\n") is None
+
+    def test_read_only_data(self) -> None:
+        """Test the read-only data section is read."""
+        assert get_read_only_data(self._read("python3")) == b"3.9.7\x00"
+        assert get_read_only_data(b"#!/bin/sh\n") is None
+
+    def test_truncated(self) -> None:
+        """Test truncated ELF files are refused."""
+        with pytest.raises(ELFError):
+            get_linking_info(self._read("python3")[:128])
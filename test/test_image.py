@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for construction of rootfs out of image layers."""
+
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import pytest
+
+from thoth.package_extract import analyzers
+from thoth.package_extract import image
+from thoth.package_extract.cache import LayerCache
+from thoth.package_extract.cache import SymbolCache
+from thoth.package_extract.layers import LayerChanges
+from thoth.package_extract.image import construct_rootfs
+from thoth.package_extract.image import construct_virtual_rootfs
+from thoth.package_extract.image import get_extraction_filter
+from thoth.package_extract.image import get_image_size
+from thoth.package_extract.image import select_layer_results
+from thoth.package_extract.vfs import VirtualRootfs
+
+from .case import TestCase
+
+
+class TestConstructRootfs(TestCase):
+    """Test construction of rootfs by extracting layers."""
+
+    _WHITEOUT_LAYERS = [
+        [
+            ("etc", "dir"),
+            ("etc/conf", b"file"),
+            ("opt", "dir"),
+            ("opt/dir", "dir"),
+            ("opt/dir/a", b"a"),
+            ("var", "dir"),
+            ("var/gone", b"gone"),
+            ("var/keep", b"keep"),
+            ("var/opq", "dir"),
+            ("var/opq/old", b"old"),
+            ("var/opq/sub", "dir"),
+            ("var/opq/sub/x", b"x"),
+        ],
+        [
+            ("etc/conf", "dir"),
+            ("etc/conf/new", b"new"),
+            ("opt/dir", b"file"),
+            ("var/.wh.gone", b""),
+            ("var/opq/.wh..wh..opq", b""),
+            ("var/opq/fresh", b"fresh"),
+        ],
+    ]
+
+    @staticmethod
+    def _build_victim(tmp_path):
+        """Build a directory outside of rootfs layers point to with an absolute symlink."""
+        victim_path = tmp_path / "victim"
+        (victim_path / "opq").mkdir(parents=True)
+        (victim_path / "important").write_text("important")
+        (victim_path / "opq" / "keep").write_text("keep")
+        return victim_path
+
+    @pytest.mark.parametrize("use_layer_cache", [False, True])
+    def test_absolute_symlink_parent(self, tmp_path, use_layer_cache) -> None:
+        """Test whiteouts and files under a symlinked directory are resolved inside rootfs."""
+        victim_path = self._build_victim(tmp_path)
+        image_path = str(tmp_path / "image")
+        self.build_image(
+            image_path,
+            [
+                [
+                    ("var", "dir"),
+                    ("var/run", str(victim_path)),
+                    ("var/run/important", b"base"),
+                    ("var/run/opq", "dir"),
+                    ("var/run/opq/file", b"base"),
+                ],
+                [
+                    ("var/run/.wh.important", b""),
+                    ("var/run/opq/.wh..wh..opq", b""),
+                    ("var/run/opq/new", b"new"),
+                    ("var/run/created", b"created"),
+                ],
+            ],
+        )
+
+        rootfs_path = tmp_path / "rootfs"
+        layer_cache = (
+            LayerCache(str(tmp_path / "layer-cache")) if use_layer_cache else None
+        )
+        construct_rootfs(image_path, str(rootfs_path), layer_cache=layer_cache)
+
+        assert (victim_path / "important").read_text() == "important"
+        assert (victim_path / "opq" / "keep").read_text() == "keep"
+        assert sorted(os.listdir(victim_path)) == ["important", "opq"]
+        assert os.listdir(victim_path / "opq") == ["keep"]
+
+        run_path = rootfs_path / str(victim_path).lstrip("/")
+        assert (rootfs_path / "var" / "run").is_symlink()
+        assert not (run_path / "important").exists()
+        assert sorted(os.listdir(run_path / "opq")) == ["new"]
+        assert (run_path / "created").read_text() == "created"
+
+    @pytest.mark.parametrize("virtual", [False, True])
+    @pytest.mark.parametrize("use_layer_cache", [False, True])
+    def test_whiteouts(self, tmp_path, virtual, use_layer_cache) -> None:
+        """Test entries replacing entries of a different type and opaque directories, in all the extraction modes."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._WHITEOUT_LAYERS)
+        layer_cache = (
+            LayerCache(str(tmp_path / "layer-cache")) if use_layer_cache else None
+        )
+
+        if virtual:
+            rootfs = construct_virtual_rootfs(image_path, layer_cache=layer_cache)
+        else:
+            rootfs_path = str(tmp_path / "rootfs")
+            construct_rootfs(image_path, rootfs_path, layer_cache=layer_cache)
+            rootfs = VirtualRootfs.from_directory(rootfs_path)
+
+        # A file replaced by a directory.
+        assert rootfs.isdir("etc/conf")
+        assert rootfs.listdir("etc/conf") == ["new"]
+        # A directory replaced by a file.
+        assert rootfs.isfile("opt/dir")
+        assert rootfs.read_bytes("opt/dir") == b"file"
+        # Whited-out files and content of lower layers in opaque directories are dropped, markers are not present.
+        assert rootfs.listdir("var/opq") == ["fresh"]
+        assert sorted(rootfs.listdir("var")) == ["keep", "opq"]
+        assert rootfs.read_bytes("var/keep") == b"keep"
+
+
+class TestConstructVirtualRootfs(TestCase):
+    """Test construction of virtual rootfs by indexing layers."""
+
+    def test_unused_layers_removed(self, tmp_path) -> None:
+        """Test decompressed layers no file in rootfs is read from are removed, the others are kept."""
+        image_path = str(tmp_path / "image")
+        self.build_image(
+            image_path,
+            [
+                [("usr", "dir"), ("usr/a.py", b"a\n")],
+                [("usr/.wh.a.py", b""), ("usr/b.py", b"b\n")],
+            ],
+        )
+        _, upper_layer = image.get_image_layers(image_path)
+
+        rootfs = construct_virtual_rootfs(image_path, workers=1)
+
+        assert not rootfs.exists("usr/a.py")
+        assert rootfs.read_bytes("usr/b.py") == b"b\n"
+        decompressed = [
+            name for name in os.listdir(image_path) if name.endswith(".tar")
+        ]
+        assert len(decompressed) == 1
+        assert decompressed[0].startswith(upper_layer + "-")
+
+
+class TestHashFiles(TestCase):
+    """Test hashing of files when layers are prepared."""
+
+    _LAYERS = [
+        [("usr", "dir"), ("usr/a.py", b"a"), ("usr/b.py", b"b"), ("usr/c.txt", b"c")],
+        [("usr/a.py", b"A"), ("usr/d.py", "a.py")],
+    ]
+
+    @pytest.mark.parametrize("virtual", [False, True])
+    def test_hashed_by_workers(self, tmp_path, monkeypatch, virtual) -> None:
+        """Test files are hashed by workers decompressing layers, not by the thread applying them."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+
+        hashing_threads = set()
+        hash_member = image._hash_member
+
+        def _hash_member(*args, **kwargs):
+            hashing_threads.add(threading.current_thread())
+            return hash_member(*args, **kwargs)
+
+        monkeypatch.setattr(image, "_hash_member", _hash_member)
+        layer_changes: List[LayerChanges] = []
+        if virtual:
+            construct_virtual_rootfs(image_path, layer_changes=layer_changes, workers=2)
+        else:
+            construct_rootfs(
+                image_path,
+                str(tmp_path / "rootfs"),
+                layer_changes=layer_changes,
+                workers=2,
+            )
+
+        assert hashing_threads
+        assert threading.main_thread() not in hashing_threads
+        assert [changes.digests for changes in layer_changes] == [
+            {
+                "usr/a.py": hashlib.sha256(b"a").hexdigest(),
+                "usr/b.py": hashlib.sha256(b"b").hexdigest(),
+            },
+            {"usr/a.py": hashlib.sha256(b"A").hexdigest(), "usr/d.py": None},
+        ]
+
+    def test_not_hashed(self, tmp_path) -> None:
+        """Test no digests are computed if turned off."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+
+        layer_changes: List[LayerChanges] = []
+        construct_rootfs(
+            image_path,
+            str(tmp_path / "rootfs"),
+            layer_changes=layer_changes,
+            hash_files=False,
+        )
+        assert [changes.digests for changes in layer_changes] == [{}, {}]
+        assert (tmp_path / "rootfs" / "usr" / "a.py").read_bytes() == b"A"
+
+
+class TestIncrementalAnalysis(TestCase):
+    """Test updating results computed for a cached stack of layers based on changes done by an upper layer."""
+
+    _SITE_PACKAGES = "usr/lib/python3.8/site-packages"
+    _APP_SITE_PACKAGES = "opt/app/lib/python3.8/site-packages"
+
+    _BASE_LAYER = [
+        ("usr", "dir"),
+        ("usr/lib", "dir"),
+        ("usr/lib/python3.8", "dir"),
+        (_SITE_PACKAGES, "dir"),
+        (f"{_SITE_PACKAGES}/six.py", b"six\n"),
+        (f"{_SITE_PACKAGES}/old.py", b"old\n"),
+        (f"{_SITE_PACKAGES}/six-1.15.0.dist-info", "dir"),
+        (
+            f"{_SITE_PACKAGES}/six-1.15.0.dist-info/METADATA",
+            b"Name: six\nVersion: 1.15.0\n\n",
+        ),
+        ("opt", "dir"),
+        ("opt/app", "dir"),
+        ("opt/app/lib", "dir"),
+        ("opt/app/lib/python3.8", "dir"),
+        (_APP_SITE_PACKAGES, "dir"),
+        (f"{_APP_SITE_PACKAGES}/app-1.0.dist-info", "dir"),
+        (
+            f"{_APP_SITE_PACKAGES}/app-1.0.dist-info/METADATA",
+            b"Name: app\nVersion: 1.0\n\n",
+        ),
+        ("usr/lib64", "dir"),
+        ("usr/lib64/libfoo.so.1", b"foo"),
+        ("usr/lib64/libbar.so.1", b"bar"),
+        ("usr/lib64/libbar.so", "libbar.so.1"),
+        ("usr/lib64/libkept.so.1", b"kept"),
+    ]
+    _UPPER_LAYER = [
+        (f"{_SITE_PACKAGES}/.wh.old.py", b""),
+        (f"{_SITE_PACKAGES}/new.py", b"new\n"),
+        (f"{_SITE_PACKAGES}/toml-0.10.2.dist-info", "dir"),
+        (
+            f"{_SITE_PACKAGES}/toml-0.10.2.dist-info/METADATA",
+            b"Name: toml\nVersion: 0.10.2\n\n",
+        ),
+        ("usr/lib64/libfoo.so.1", b"foo2"),
+        ("usr/lib64/libbar.so.1", b"bar2"),
+    ]
+
+    def _construct(self, tmp_path, name: str, layers) -> Tuple[str, List[LayerChanges]]:
+        """Construct rootfs of an image with the given layers, return path to rootfs and changes done by layers."""
+        image_path = str(tmp_path / f"{name}-image")
+        rootfs_path = str(tmp_path / f"{name}-rootfs")
+        self.build_image(image_path, layers)
+        layer_changes: List[LayerChanges] = []
+        construct_rootfs(image_path, rootfs_path, layer_changes=layer_changes)
+        return rootfs_path, layer_changes
+
+    def test_layer_changes_match(self, tmp_path) -> None:
+        """Test patterns of paths analyzers read are matched against changes done by the upper layer."""
+        _, layer_changes = self._construct(
+            tmp_path, "image", [self._BASE_LAYER, self._UPPER_LAYER]
+        )
+
+        assert layer_changes[1].matches([f"{self._SITE_PACKAGES}/*.py"])
+        assert layer_changes[1].matches(["usr/lib64/*.so*"])
+        assert not layer_changes[1].matches([f"{self._APP_SITE_PACKAGES}/**"])
+        assert not layer_changes[1].matches(["etc/**"])
+
+    def test_update_python_file_digests(self, tmp_path) -> None:
+        """Test checksums of Python files computed for the base layer are updated to match the whole image."""
+        base_path, base_changes = self._construct(tmp_path, "base", [self._BASE_LAYER])
+        rootfs_path, layer_changes = self._construct(
+            tmp_path, "image", [self._BASE_LAYER, self._UPPER_LAYER]
+        )
+        previous = image._get_python_file_digests(
+            VirtualRootfs.from_directory(base_path),
+            LayerChanges.merge(base_changes).digests,
+        )
+        rootfs = VirtualRootfs.from_directory(rootfs_path)
+
+        updated = image._update_python_file_digests(
+            rootfs, previous, layer_changes[1], workers=1
+        )
+
+        assert updated == image._get_python_file_digests(
+            rootfs, LayerChanges.merge(layer_changes).digests
+        )
+        assert [entry["filepath"] for entry in updated] == [
+            f"/{self._SITE_PACKAGES}/new.py",
+            f"/{self._SITE_PACKAGES}/six.py",
+        ]
+        assert updated[0]["sha256"] == hashlib.sha256(b"new\n").hexdigest()
+
+    def test_update_python_packages(self, tmp_path) -> None:
+        """Test packages detected in the base layer are reused for library directories not changed."""
+        base_path, _ = self._construct(tmp_path, "base", [self._BASE_LAYER])
+        rootfs_path, layer_changes = self._construct(
+            tmp_path, "image", [self._BASE_LAYER, self._UPPER_LAYER]
+        )
+        previous = image._get_python_packages(VirtualRootfs.from_directory(base_path))
+        for entry in previous:
+            entry["reused"] = True
+        rootfs = VirtualRootfs.from_directory(rootfs_path)
+
+        updated = image._update_python_packages(rootfs, previous, layer_changes[1])
+
+        assert [
+            (entry["package_name"], entry["location"], entry.get("reused", False))
+            for entry in updated
+        ] == [
+            ("app", f"/{self._APP_SITE_PACKAGES}", True),
+            ("six", f"/{self._SITE_PACKAGES}", False),
+            ("toml", f"/{self._SITE_PACKAGES}", False),
+        ]
+
+    def test_get_previous_symbols(self, tmp_path) -> None:
+        """Test symbols gathered for the base layer are reused only for shared objects not changed."""
+        rootfs_path, layer_changes = self._construct(
+            tmp_path, "image", [self._BASE_LAYER, self._UPPER_LAYER]
+        )
+        previous = {
+            "/usr/lib64/libkept.so.1": ["KEPT_1.0"],
+            "/usr/lib64/libfoo.so.1": ["FOO_1.0"],
+        }
+
+        def get_previous_symbols(so_file_path: str) -> Optional[List[str]]:
+            return image._get_previous_symbols(
+                rootfs_path, previous, layer_changes[1], so_file_path
+            )
+
+        assert get_previous_symbols("/usr/lib64/libkept.so.1") == ["KEPT_1.0"]
+        assert get_previous_symbols("/usr/lib64/libfoo.so.1") is None
+        # The symlink was not changed, but the shared object it points to was.
+        assert get_previous_symbols("/usr/lib64/libbar.so") is None
+        previous.pop("/usr/lib64/libkept.so.1")
+        assert get_previous_symbols("/usr/lib64/libkept.so.1") == []
+
+
+class TestGetExtractionFilter(TestCase):
+    """Test filtering of files extracted in the selective extraction mode."""
+
+    def test_filter(self) -> None:
+        """Test only files needed by the given analyzers are accepted, files in etc/ always are."""
+        path_filter = get_extraction_filter(["rpm"])
+
+        assert path_filter("var/lib/rpm/Packages")
+        assert path_filter("usr/lib/sysimage/rpm/rpmdb.sqlite")
+        assert path_filter("etc/os-release")
+        assert not path_filter("usr/lib/os-release")
+        assert not path_filter("usr/bin/python3")
+
+    def test_dependencies(self) -> None:
+        """Test files needed by analyzers the given analyzers depend on are accepted as well."""
+        path_filter = get_extraction_filter(["deb-dependencies"])
+
+        assert path_filter("usr/bin/apt-cache")
+        assert path_filter("usr/bin/dpkg-query")
+        assert path_filter("usr/lib/x86_64-linux-gnu/libapt-pkg.so.6.0")
+
+    def test_skip_virtual(self) -> None:
+        """Test files needed solely by virtual analyzers are not accepted if virtual analyzers are skipped."""
+        path_filter = get_extraction_filter(
+            ["rpm", "operating-system"], skip_virtual=True
+        )
+
+        assert path_filter("var/lib/rpm/Packages")
+        assert not path_filter("usr/lib/os-release")
+        assert get_extraction_filter(["operating-system"])("usr/lib/os-release")
+
+    def test_whole_rootfs(self, monkeypatch) -> None:
+        """Test no filter is returned if any of the analyzers needs the whole rootfs."""
+        monkeypatch.setitem(
+            analyzers._REGISTRY,
+            "whole-rootfs",
+            analyzers.Analyzer("whole-rootfs", lambda context: None),
+        )
+
+        assert get_extraction_filter(["rpm", "whole-rootfs"]) is None
+        assert get_extraction_filter() is None
+        assert get_extraction_filter(["rpm"]) is not None
+
+
+class TestFileDigests(TestCase):
+    """Test digests of files computed when constructing rootfs."""
+
+    _LAYERS = [
+        [
+            ("usr", "dir"),
+            ("usr/a.py", b"a\n"),
+            ("usr/lib.so.1", b"lib"),
+            ("usr/data.txt", b"data"),
+            ("usr/link.py", "a.py"),
+        ],
+    ]
+
+    @pytest.mark.parametrize("virtual", [False, True])
+    @pytest.mark.parametrize("use_layer_cache", [False, True])
+    def test_recorded(self, tmp_path, virtual, use_layer_cache) -> None:
+        """Test digests of Python files and shared objects are recorded, symlinks are recorded with no digest."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+        layer_cache = (
+            LayerCache(str(tmp_path / "layer-cache")) if use_layer_cache else None
+        )
+
+        layer_changes: List[LayerChanges] = []
+        if virtual:
+            construct_virtual_rootfs(
+                image_path, layer_cache=layer_cache, layer_changes=layer_changes
+            )
+        else:
+            construct_rootfs(
+                image_path,
+                str(tmp_path / "rootfs"),
+                layer_cache=layer_cache,
+                layer_changes=layer_changes,
+            )
+
+        assert layer_changes[0].digests == {
+            "usr/a.py": hashlib.sha256(b"a\n").hexdigest(),
+            "usr/lib.so.1": hashlib.sha256(b"lib").hexdigest(),
+            "usr/link.py": None,
+        }
+
+    def test_resolve_symlinks(self, tmp_path) -> None:
+        """Test symlinks are reported with digests of files they point to, files are reported where stored."""
+        rootfs_path = tmp_path / "rootfs"
+        (rootfs_path / "usr" / "lib").mkdir(parents=True)
+        (rootfs_path / "usr" / "lib" / "a.py").write_text("a\n")
+        (rootfs_path / "opt").mkdir()
+        (rootfs_path / "opt" / "target").write_text("target\n")
+        (rootfs_path / "usr" / "lib" / "link.py").symlink_to("a.py")
+        (rootfs_path / "usr" / "lib" / "absolute.py").symlink_to("/usr/lib/a.py")
+        (rootfs_path / "usr" / "lib" / "other.py").symlink_to("../../opt/target")
+        (rootfs_path / "usr" / "lib" / "broken.py").symlink_to("missing.py")
+        (rootfs_path / "lib").symlink_to("usr/lib")
+        digest = hashlib.sha256(b"a\n").hexdigest()
+
+        resolved = image._resolve_file_digests(
+            VirtualRootfs.from_directory(str(rootfs_path)),
+            {
+                "usr/lib/a.py": digest,
+                "usr/lib/link.py": None,
+                "usr/lib/absolute.py": None,
+                "usr/lib/other.py": None,
+                "usr/lib/broken.py": None,
+                # Stated in a layer through the symlinked directory.
+                "lib/b.py": "b",
+            },
+        )
+
+        assert resolved == {
+            "usr/lib/a.py": digest,
+            "usr/lib/link.py": digest,
+            "usr/lib/absolute.py": digest,
+            "usr/lib/other.py": hashlib.sha256(b"target\n").hexdigest(),
+            "usr/lib/b.py": "b",
+        }
+
+
+class TestSystemSymbols(TestCase):
+    """Test gathering of symbols exported by shared objects."""
+
+    def test_same_file_read_once(self, tmp_path) -> None:
+        """Test shared objects available under multiple names are read once, symbols are reported for each name."""
+        lib_path = tmp_path / "usr" / "lib64"
+        lib_path.mkdir(parents=True)
+        shutil.copy(
+            os.path.join(self.DATA_DIR, "elf", "libversioned.so.1"),
+            lib_path / "libversioned.so.1",
+        )
+        os.link(lib_path / "libversioned.so.1", lib_path / "libhardlinked.so.1")
+        (lib_path / "libversioned.so").symlink_to("libversioned.so.1")
+        (tmp_path / "lib64").symlink_to("usr/lib64")
+
+        read = []
+
+        def get_symbols(path: str) -> Optional[Set[str]]:
+            read.append(path)
+            return image._read_version_symbols(str(tmp_path), path)
+
+        result: dict = {}
+        gathered: dict = {}
+        for lib_dir in ("/usr/lib64", "/lib64"):
+            image._get_lib_dir_symbols(
+                result,
+                str(tmp_path),
+                lib_dir,
+                gathered=gathered,
+                get_symbols=get_symbols,
+            )
+
+        assert len(read) == 1
+        assert sorted(result) == [
+            "/lib64/libhardlinked.so.1",
+            "/lib64/libversioned.so",
+            "/lib64/libversioned.so.1",
+            "/usr/lib64/libhardlinked.so.1",
+            "/usr/lib64/libversioned.so",
+            "/usr/lib64/libversioned.so.1",
+        ]
+        for symbols in result.values():
+            assert {"LIBV_1.0", "LIBV_2.0"} <= symbols
+
+
+class TestCachedSystemSymbols(TestCase):
+    """Test gathering of symbols of shared objects using the symbol cache."""
+
+    def _build_rootfs(
+        self, rootfs_path: str, content: bytes
+    ) -> Dict[str, Optional[str]]:
+        """Build rootfs with a shared object of the given content, return digests of files as if extracted."""
+        lib_path = os.path.join(rootfs_path, "usr", "lib64")
+        os.makedirs(lib_path, exist_ok=True)
+        with open(os.path.join(lib_path, "libversioned.so.1"), "wb") as so_file:
+            so_file.write(content)
+        return {"usr/lib64/libversioned.so.1": hashlib.sha256(content).hexdigest()}
+
+    def test_symbol_cache(self, tmp_path, monkeypatch) -> None:
+        """Test shared objects are read only if their content digest is not found in the symbol cache."""
+        with open(
+            os.path.join(self.DATA_DIR, "elf", "libversioned.so.1"), "rb"
+        ) as so_file:
+            content = so_file.read()
+
+        read = []
+        read_version_symbols = image._read_version_symbols
+
+        def _read(path: str, relative_path: str) -> Optional[Set[str]]:
+            read.append(relative_path)
+            return read_version_symbols(path, relative_path)
+
+        monkeypatch.setattr(image, "_read_version_symbols", _read)
+        symbol_cache = SymbolCache(str(tmp_path / "symbol-cache"))
+
+        rootfs_path = str(tmp_path / "rootfs")
+        file_digests = self._build_rootfs(rootfs_path, content)
+        result = image._get_system_symbols(
+            rootfs_path, file_digests=file_digests, symbol_cache=symbol_cache
+        )
+        assert read == ["usr/lib64/libversioned.so.1"]
+        assert "LIBV_1.0" in result["/usr/lib64/libversioned.so.1"]
+
+        # The same shared object in another image is not read again.
+        other_path = str(tmp_path / "other-rootfs")
+        other_digests = self._build_rootfs(other_path, content)
+        assert (
+            image._get_system_symbols(
+                other_path, file_digests=other_digests, symbol_cache=symbol_cache
+            )
+            == result
+        )
+        assert read == ["usr/lib64/libversioned.so.1"]
+
+        # A changed shared object has a different digest, it is read.
+        changed_digests = self._build_rootfs(other_path, content + b"\0")
+        image._get_system_symbols(
+            other_path, file_digests=changed_digests, symbol_cache=symbol_cache
+        )
+        assert len(read) == 2
+
+
+class TestAptCacheShow(TestCase):
+    """Test gathering of dependencies of deb packages using apt-cache."""
+
+    _PACKAGES = [
+        {"name": "bash", "version": "5.0-6ubuntu1", "arch": "amd64"},
+        {"name": "libc6:amd64", "version": "2.31-0ubuntu9", "arch": "amd64"},
+        {"name": "libfoo", "version": "1:2.3~rc1-1", "arch": "all"},
+        {"name": "missing", "version": "1.0", "arch": "amd64"},
+    ]
+
+    _APT_CACHE_OUTPUT = """\
+Package: bash
+Version: 5.0-6ubuntu2
+Architecture: amd64
+Depends: base-files (>= 2.1.12)
+
+Package: bash
+Version: 5.0-6ubuntu1
+Architecture: amd64
+Pre-Depends: libc6 (>= 2.15), libtinfo6 (>= 6)
+Depends: base-files (>= 2.1.12), debianutils (>= 2.15)
+Replaces: bash-doc (<= 2.05-1)
+
+Package: libc6
+Version: 2.31-0ubuntu9
+Architecture: i386
+Depends: libcrypt1-i386
+
+Package: libc6
+Version: 2.31-0ubuntu9
+Architecture: amd64
+Depends: libcrypt1 (>= 1:4.4.10-10ubuntu4)
+
+Package: libfoo
+Version: 1:2.3~rc1-1
+Architecture: all
+Depends: libc6
+"""
+
+    def test_batches(self, monkeypatch) -> None:
+        """Test arguments are quoted and split into batches not exceeding the maximum length."""
+        monkeypatch.setattr(image, "_APT_CACHE_MAX_ARGS_LENGTH", 40)
+
+        assert list(image._get_apt_cache_batches(self._PACKAGES)) == [
+            ["bash=5.0-6ubuntu1"],
+            ["libc6:amd64=2.31-0ubuntu9"],
+            ["'libfoo=1:2.3~rc1-1'", "missing=1.0"],
+        ]
+        assert list(image._get_apt_cache_batches([])) == []
+
+    def test_single_batch(self) -> None:
+        """Test all the packages are queried at once if the arguments fit into a single command."""
+        assert list(image._get_apt_cache_batches(self._PACKAGES)) == [
+            [
+                "bash=5.0-6ubuntu1",
+                "libc6:amd64=2.31-0ubuntu9",
+                "'libfoo=1:2.3~rc1-1'",
+                "missing=1.0",
+            ]
+        ]
+
+    def test_stanzas_matched(self, tmp_path, monkeypatch) -> None:
+        """Test stanzas printed are matched to packages by name, version and architecture."""
+        (tmp_path / "usr" / "bin").mkdir(parents=True)
+        (tmp_path / "usr" / "bin" / "apt-cache").write_text("")
+        commands = []
+
+        def run_task_command(cmd, timeout=None, raise_on_error=True):
+            commands.append(cmd)
+            return subprocess.CompletedProcess(cmd, 100, self._APT_CACHE_OUTPUT, "")
+
+        monkeypatch.setattr(image, "run_task_command", run_task_command)
+
+        result = image._run_apt_cache_show(str(tmp_path), self._PACKAGES)
+
+        assert len(commands) == 1
+        assert result[0]["pre-depends"] == [
+            {"name": "libc6", "version": ">= 2.15"},
+            {"name": "libtinfo6", "version": ">= 6"},
+        ]
+        assert result[0]["depends"] == [
+            {"name": "base-files", "version": ">= 2.1.12"},
+            {"name": "debianutils", "version": ">= 2.15"},
+        ]
+        assert result[0]["replaces"] == [{"name": "bash-doc", "version": "<= 2.05-1"}]
+        assert result[1]["depends"] == [
+            {"name": "libcrypt1", "version": ">= 1:4.4.10-10ubuntu4"}
+        ]
+        assert (result[2]["epoch"], result[2]["version"]) == ("1", "2.3~rc1-1")
+        assert result[2]["depends"] == [{"name": "libc6", "version": ""}]
+        assert result[3] == {
+            **self._PACKAGES[3],
+            "pre-depends": [],
+            "depends": [],
+            "replaces": [],
+        }
+
+
+class TestSelectLayerResults(TestCase):
+    """Test selection of analyzer results stored in the analysis cache."""
+
+    _RESULT = {
+        "python-files": [],
+        "system-symbols": {},
+        "skopeo-inspect": {},
+    }
+
+    def test_select(self) -> None:
+        """Test results of analyzers depending on image metadata are not selected."""
+        assert select_layer_results(self._RESULT) == {
+            "python-files": [],
+            "system-symbols": {},
+        }
+
+    def test_select_virtual_only(self) -> None:
+        """Test only results of virtual analyzers are selected if rootfs was materialized partially."""
+        assert select_layer_results(self._RESULT, virtual_only=True) == {
+            "python-files": [],
+        }
+
+
+class TestGetImageSize(TestCase):
+    """Test reporting size of images."""
+
+    _LAYERS = [
+        [("usr", "dir"), ("usr/a.py", b"a" * 1000)],
+        [("usr/b.py", b"b" * 3000)],
+    ]
+
+    @staticmethod
+    def _get_tarball_size(entries) -> int:
+        """Get size of the uncompressed layer tarball with the given entries."""
+        return len(gzip.decompress(TestCase.build_layer(entries)))
+
+    def test_not_decompressed(self, tmp_path) -> None:
+        """Test uncompressed size of gzipped layers is not guessed if they were not decompressed."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+
+        image_size = get_image_size(image_path)
+        assert image_size["compressed"] is not None
+        assert image_size["uncompressed"] is None
+        assert [layer["uncompressed"] for layer in image_size["layers"]] == [None, None]
+
+    @pytest.mark.parametrize("virtual", [False, True])
+    def test_recorded(self, tmp_path, virtual) -> None:
+        """Test uncompressed sizes recorded when constructing rootfs are reported."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+
+        layer_changes: List[LayerChanges] = []
+        if virtual:
+            construct_virtual_rootfs(image_path, layer_changes=layer_changes)
+        else:
+            construct_rootfs(
+                image_path, str(tmp_path / "rootfs"), layer_changes=layer_changes
+            )
+
+        expected = [self._get_tarball_size(entries) for entries in self._LAYERS]
+        image_size = get_image_size(image_path, layer_changes=layer_changes)
+        assert [layer["uncompressed"] for layer in image_size["layers"]] == expected
+        assert image_size["uncompressed"] == sum(expected)
+
+    def test_layer_cache(self, tmp_path) -> None:
+        """Test uncompressed sizes of layers are taken from the layer cache."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, self._LAYERS)
+        layer_cache = LayerCache(str(tmp_path / "layer-cache"))
+        construct_rootfs(image_path, str(tmp_path / "rootfs"), layer_cache=layer_cache)
+
+        expected = [self._get_tarball_size(entries) for entries in self._LAYERS]
+        image_size = get_image_size(image_path, layer_cache)
+        assert image_size["uncompressed"] == sum(expected)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for tracking of changes done to the root filesystem by image layers."""
+
+from thoth.package_extract.layers import LayerChanges
+from thoth.package_extract.layers import compile_path_patterns
+
+from .case import TestCase
+
+
+class TestCompilePathPatterns(TestCase):
+    """Test compilation of patterns matching paths relative to rootfs."""
+
+    def test_asterisk(self) -> None:
+        """Test a single asterisk does not match the path separator."""
+        regex = compile_path_patterns(["usr/lib*/*.so*"])
+        assert regex.match("usr/lib64/libc.so.6")
+        assert regex.match("usr/lib/libc.so")
+        assert not regex.match("usr/lib/x86_64-linux-gnu/libc.so.6")
+
+    def test_double_asterisk(self) -> None:
+        """Test two asterisks match the path separator as well."""
+        regex = compile_path_patterns(["**/site-packages/*.dist-info/**"])
+        assert regex.match(
+            "usr/lib/python3.8/site-packages/six-1.15.0.dist-info/METADATA"
+        )
+        assert regex.match("a/site-packages/six-1.15.0.dist-info/licenses/LICENSE")
+        assert not regex.match("usr/lib/python3.8/site-packages/six.py")
+
+    def test_question_mark(self) -> None:
+        """Test a question mark matches a single character except for the path separator."""
+        regex = compile_path_patterns(["lib?"])
+        assert regex.match("lib6")
+        assert not regex.match("lib64")
+        assert not regex.match("lib/")
+
+    def test_whole_path(self) -> None:
+        """Test whole paths are matched and characters special in regular expressions are matched literally."""
+        regex = compile_path_patterns(["etc/os-release", "usr/bin/g++"])
+        assert regex.match("etc/os-release")
+        assert not regex.match("etc/os-release.bak")
+        assert not regex.match("usr/etc/os-release")
+        assert regex.match("usr/bin/g++")
+        assert not regex.match("usr/bin/gg+")
+
+    def test_no_patterns(self) -> None:
+        """Test no path is matched if no patterns are given."""
+        regex = compile_path_patterns([])
+        assert not regex.match("")
+        assert not regex.match("etc/os-release")
+
+
+class TestLayerChanges(TestCase):
+    """Test changes done by image layers."""
+
+    _PATTERNS = ["usr/lib*/python3*/site-packages/**"]
+
+    def test_matches_changed(self) -> None:
+        """Test changed paths are matched against the patterns."""
+        assert LayerChanges(
+            changed={"usr/lib64/python3.8/site-packages/six.py"}
+        ).matches(self._PATTERNS)
+        assert not LayerChanges(changed={"usr/lib64/libc.so.6"}).matches(self._PATTERNS)
+        assert not LayerChanges().matches(self._PATTERNS)
+
+    def test_matches_removed(self) -> None:
+        """Test removed paths match if they match the patterns or if matching paths could be stored under them."""
+        assert LayerChanges(
+            removed={"usr/lib64/python3.8/site-packages/six.py"}
+        ).matches(self._PATTERNS)
+        assert LayerChanges(removed={"usr/lib64"}).matches(self._PATTERNS)
+        assert LayerChanges(removed={"usr"}).matches(self._PATTERNS)
+        assert not LayerChanges(removed={"etc"}).matches(self._PATTERNS)
+
+    def test_matches_opaque(self) -> None:
+        """Test opaque directories match if paths matching the patterns could be stored under them."""
+        assert LayerChanges(opaque={"usr/lib64/python3.8/site-packages"}).matches(
+            self._PATTERNS
+        )
+        assert LayerChanges(opaque={""}).matches(self._PATTERNS)
+        assert not LayerChanges(opaque={"var/cache"}).matches(self._PATTERNS)
+
+    def test_merge_digests(self) -> None:
+        """Test digests of files written by upper layers replace digests of files written by lower layers."""
+        merged = LayerChanges.merge(
+            [
+                LayerChanges(
+                    changed={"a.py", "b.py"}, digests={"a.py": "a1", "b.py": "b1"}
+                ),
+                LayerChanges(changed={"a.py"}, digests={"a.py": "a2"}),
+            ]
+        )
+
+        assert merged.digests == {"a.py": "a2", "b.py": "b1"}
+
+    def test_merge_removed(self) -> None:
+        """Test digests of whited-out files and of files in whited-out directories are dropped."""
+        base = LayerChanges(
+            changed={"a.py", "dir/b.py", "dir/sub/c.py"},
+            digests={"a.py": "a", "dir/b.py": "b", "dir/sub/c.py": "c"},
+        )
+
+        assert LayerChanges.merge([base, LayerChanges(removed={"a.py"})]).digests == {
+            "dir/b.py": "b",
+            "dir/sub/c.py": "c",
+        }
+        assert LayerChanges.merge([base, LayerChanges(removed={"dir"})]).digests == {
+            "a.py": "a"
+        }
+
+    def test_merge_opaque(self) -> None:
+        """Test digests of files present in lower layers are dropped from opaque directories."""
+        merged = LayerChanges.merge(
+            [
+                LayerChanges(
+                    changed={"a.py", "dir/b.py"}, digests={"a.py": "a", "dir/b.py": "b"}
+                ),
+                LayerChanges(
+                    changed={"dir/c.py"}, opaque={"dir"}, digests={"dir/c.py": "c"}
+                ),
+            ]
+        )
+
+        assert merged.digests == {"a.py": "a", "dir/c.py": "c"}
+
+    def test_merge_replaced(self) -> None:
+        """Test digests of files are dropped if they or their directories are replaced by files not hashed."""
+        merged = LayerChanges.merge(
+            [
+                LayerChanges(
+                    changed={"a.py", "dir/b.py"}, digests={"a.py": "a", "dir/b.py": "b"}
+                ),
+                LayerChanges(changed={"a.py", "dir"}),
+            ]
+        )
+
+        assert merged.digests == {}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for Prometheus metrics of extraction jobs."""
+
+import http.server
+import threading
+import time
+
+from thoth.package_extract.metrics import push_metrics
+from thoth.package_extract.metrics import record_job
+from thoth.package_extract.metrics import wait_for_pushes
+from thoth.package_extract.profiling import Profile
+
+from .case import TestCase
+
+
+class _PushGateway(http.server.ThreadingHTTPServer):
+    """A push gateway stand-in recording paths of pushes, each push is answered after the given delay."""
+
+    def __init__(self, delay: float) -> None:
+        """Listen on a random local port."""
+        super().__init__(("127.0.0.1", 0), _PushGatewayHandler)
+        self.delay = delay
+        self.pushes = []
+        self.daemon_threads = True
+
+    def __enter__(self):
+        """Serve requests in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
+
+
+class _PushGatewayHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of pushes sent to the push gateway stand-in."""
+
+    def log_message(self, format, *args) -> None:
+        """Do not log requests."""
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Accept pushed metrics."""
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.delay)
+        self.server.pushes.append(self.path)
+        self.send_response(202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class TestMetrics(TestCase):
+    """Test recording and pushing metrics of jobs."""
+
+    def test_record_job_accumulates(self) -> None:
+        """Test counters accumulate across jobs run by the process."""
+        registry = record_job(Profile(), 0.0)
+        before = registry.get_sample_value("package_extract_downloaded_bytes_total")
+
+        for amount in (10, 20):
+            profile = Profile()
+            profile.count("downloaded_bytes", amount)
+            registry = record_job(profile, 1.5)
+
+        assert (
+            registry.get_sample_value("package_extract_downloaded_bytes_total")
+            == before + 30
+        )
+        assert registry.get_sample_value("package_extract_time") == 1.5
+
+    def test_push_metrics_daemon(self, monkeypatch) -> None:
+        """Test metrics are pushed by a thread which does not block exit of the process."""
+        monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_HOST", "127.0.0.1")
+        monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_PORT", "9")
+        monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_TIMEOUT", "0.1")
+
+        thread = push_metrics(record_job(Profile(), 0.0))
+        assert thread is not None
+        assert thread.daemon
+        thread.join()
+
+    def test_push_metrics_not_configured(self, monkeypatch) -> None:
+        """Test nothing is pushed if no push gateway is configured."""
+        monkeypatch.delenv("PROMETHEUS_PUSHGATEWAY_HOST", raising=False)
+        assert push_metrics(record_job(Profile(), 0.0)) is None
+
+    def test_wait_for_pushes(self, monkeypatch) -> None:
+        """Test pending pushes are waited for, pushes superseded by newer ones are skipped."""
+        with _PushGateway(delay=0.2) as gateway:
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_HOST", "127.0.0.1")
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_PORT", str(gateway.server_port))
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_TIMEOUT", "5")
+
+            threads = [push_metrics(record_job(Profile(), 0.0)) for _ in range(3)]
+            assert wait_for_pushes()
+            assert not any(thread.is_alive() for thread in threads)
+            # The first push can be in flight when others are started, the middle one is always superseded.
+            assert 1 <= len(gateway.pushes) <= 2
+            assert gateway.pushes[-1].startswith(
+                "/metrics/job/package-extract-runtime/"
+            )
+
+    def test_wait_for_pushes_timeout(self, monkeypatch) -> None:
+        """Test waiting for pushes is bounded by the push timeout."""
+        with _PushGateway(delay=1.0) as gateway:
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_HOST", "127.0.0.1")
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_PORT", str(gateway.server_port))
+            monkeypatch.setenv("PROMETHEUS_PUSHGATEWAY_TIMEOUT", "0.2")
+
+            push_metrics(record_job(Profile(), 0.0))
+            start_time = time.monotonic()
+            assert not wait_for_pushes()
+            assert time.monotonic() - start_time < 0.9
+            # Let the push fail so that it does not interfere with other tests.
+            assert wait_for_pushes(timeout=5)
+
+    def test_wait_for_pushes_none(self) -> None:
+        """Test waiting succeeds immediately if nothing is being pushed."""
+        assert wait_for_pushes(timeout=0)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for profiling of image extraction phases."""
+
+import concurrent.futures
+import contextvars
+import subprocess
+import sys
+
+from thoth.package_extract.profiling import collect_profile
+from thoth.package_extract.profiling import count
+from thoth.package_extract.profiling import profile_phase
+
+from .case import TestCase
+
+
+class TestProfiling(TestCase):
+    """Test profiling of phases and counting of work done."""
+
+    def test_profile_phase(self) -> None:
+        """Test phases are recorded in the order they finished, nested phases included."""
+        with collect_profile() as profile:
+            with profile_phase("outer"):
+                with profile_phase("inner", "subject"):
+                    sum(range(10000))
+
+        assert [(p.phase, p.subject) for p in profile.phases] == [
+            ("inner", "subject"),
+            ("outer", None),
+        ]
+        inner, outer = profile.phases
+        assert 0 < inner.wall_time <= outer.wall_time
+        assert outer.max_rss > 0
+
+    def test_not_collected(self) -> None:
+        """Test phases and counters are not recorded if no profile is being collected."""
+        with profile_phase("phase"):
+            count("counter")
+
+        with collect_profile() as profile:
+            pass
+
+        assert profile.phases == []
+        assert profile.counters == {}
+
+    def test_count(self) -> None:
+        """Test counters are incremented by the given amount, including counts done in worker threads."""
+        with collect_profile() as profile:
+            count("files")
+            count("bytes", 100)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                for _ in range(4):
+                    executor.submit(contextvars.copy_context().run, count, "files")
+
+        assert profile.counters == {"files": 5, "bytes": 100}
+
+    def test_subprocesses(self) -> None:
+        """Test subprocesses spawned in a phase are counted for the phase and all the phases it is nested in."""
+        with collect_profile() as profile:
+            with profile_phase("outer"):
+                subprocess.run([sys.executable, "-c", ""], check=True)
+                with profile_phase("inner"):
+                    subprocess.run([sys.executable, "-c", ""], check=True)
+            with profile_phase("other"):
+                pass
+
+        assert {p.phase: p.subprocesses for p in profile.phases} == {
+            "inner": 1,
+            "outer": 2,
+            "other": 0,
+        }
+        outer = next(p for p in profile.phases if p.phase == "outer")
+        assert outer.children_cpu_time > 0
+
+    def test_to_dict(self) -> None:
+        """Test the profile is serialized with all the measurements of phases and counters."""
+        with collect_profile() as profile:
+            count("files", 2)
+            with profile_phase("phase", "subject"):
+                pass
+
+        result = profile.to_dict()
+
+        assert result["counters"] == {"files": 2}
+        assert len(result["phases"]) == 1
+        assert result["phases"][0]["phase"] == "phase"
+        assert result["phases"][0]["subject"] == "subject"
+        assert set(result["phases"][0]) == {
+            "phase",
+            "subject",
+            "wall_time",
+            "cpu_time",
+            "children_cpu_time",
+            "max_rss",
+            "children_max_rss",
+            "subprocesses",
+        }
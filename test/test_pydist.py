@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for discovery of installed Python distributions."""
+
+from thoth.package_extract.pydist import canonicalize_name
+from thoth.package_extract.pydist import parse_metadata
+from thoth.package_extract.pydist import read_distributions
+from thoth.package_extract.vfs import VirtualRootfs
+
+from .case import TestCase
+
+_SITE_PACKAGES = "usr/lib/python3.8/site-packages"
+
+
+def _metadata(name: str, version: str) -> str:
+    """Build content of a metadata file with a body which is not parsed."""
+    return f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n\nName: body\n"
+
+
+class TestReadDistributions(TestCase):
+    """Test reading of Python distributions installed in a library directory."""
+
+    def _read(self, tmp_path, files) -> list:
+        """Create the given files in site-packages of rootfs and read distributions installed there."""
+        for path, content in files.items():
+            file_path = tmp_path / path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text(content)
+
+        (tmp_path / _SITE_PACKAGES).mkdir(parents=True, exist_ok=True)
+        return read_distributions(
+            VirtualRootfs.from_directory(str(tmp_path)), _SITE_PACKAGES
+        )
+
+    def test_dist_info(self, tmp_path) -> None:
+        """Test distributions installed as wheels are read from METADATA."""
+        result = self._read(
+            tmp_path,
+            {
+                f"{_SITE_PACKAGES}/six-1.15.0.dist-info/METADATA": _metadata(
+                    "six", "1.15.0"
+                ),
+                f"{_SITE_PACKAGES}/six-1.15.0.dist-info/RECORD": "six.py,sha256=abc,100\n",
+                f"{_SITE_PACKAGES}/six.py": "",
+            },
+        )
+
+        assert result == [
+            {
+                "package_name": "six",
+                "package_version": "1.15.0",
+                "location": f"/{_SITE_PACKAGES}",
+            }
+        ]
+
+    def test_egg_info(self, tmp_path) -> None:
+        """Test distributions installed as eggs, by setuptools and by distutils are read from PKG-INFO."""
+        result = self._read(
+            tmp_path,
+            {
+                f"{_SITE_PACKAGES}/toml-0.10.2-py3.8.egg-info/PKG-INFO": _metadata(
+                    "toml", "0.10.2"
+                ),
+                f"{_SITE_PACKAGES}/distro-1.5.0-py3.8.egg-info": _metadata(
+                    "distro", "1.5.0"
+                ),
+                f"{_SITE_PACKAGES}/attrs-20.2.0-py3.8.egg/EGG-INFO/PKG-INFO": _metadata(
+                    "attrs", "20.2.0"
+                ),
+                f"{_SITE_PACKAGES}/project.egg-link": "/opt/project\n.\n",
+                "opt/project/project.egg-info/PKG-INFO": _metadata("project", "0.1.0"),
+            },
+        )
+
+        assert [
+            (entry["package_name"], entry["package_version"]) for entry in result
+        ] == [
+            ("attrs", "20.2.0"),
+            ("distro", "1.5.0"),
+            ("project", "0.1.0"),
+            ("toml", "0.10.2"),
+        ]
+
+    def test_normalized_names(self, tmp_path) -> None:
+        """Test distributions are reported once per canonical name, sorted by name regardless of case."""
+        result = self._read(
+            tmp_path,
+            {
+                f"{_SITE_PACKAGES}/Jinja2-2.11.2.dist-info/METADATA": _metadata(
+                    "Jinja2", "2.11.2"
+                ),
+                f"{_SITE_PACKAGES}/jinja2-2.10.egg-info": _metadata("jinja2", "2.10"),
+                f"{_SITE_PACKAGES}/ruamel.yaml-0.16.12.dist-info/METADATA": _metadata(
+                    "ruamel.yaml", "0.16.12"
+                ),
+                f"{_SITE_PACKAGES}/ruamel_yaml-0.15.dist-info/METADATA": _metadata(
+                    "ruamel_yaml", "0.15"
+                ),
+                f"{_SITE_PACKAGES}/attrs-20.2.0.dist-info/METADATA": _metadata(
+                    "attrs", "20.2.0"
+                ),
+            },
+        )
+
+        assert [
+            (entry["package_name"], entry["package_version"]) for entry in result
+        ] == [
+            ("attrs", "20.2.0"),
+            ("Jinja2", "2.11.2"),
+            ("ruamel.yaml", "0.16.12"),
+        ]
+
+    def test_invalid(self, tmp_path) -> None:
+        """Test entries without metadata or without name and version stated are skipped."""
+        result = self._read(
+            tmp_path,
+            {
+                f"{_SITE_PACKAGES}/empty-1.0.dist-info/RECORD": "",
+                f"{_SITE_PACKAGES}/noversion-1.0.dist-info/METADATA": "Name: noversion\n",
+                f"{_SITE_PACKAGES}/broken.egg-link": "/opt/missing\n",
+                f"{_SITE_PACKAGES}/module.py": "",
+            },
+        )
+
+        assert result == []
+
+
+class TestMetadata(TestCase):
+    """Test parsing of distribution metadata."""
+
+    def test_parse_metadata(self) -> None:
+        """Test only headers are parsed, values are stripped."""
+        assert parse_metadata(_metadata("six", "1.15.0")) == ("six", "1.15.0")
+        assert parse_metadata(
+            "Name:  six \r\nVersion: 1.15.0\r\n\r\nVersion: 2\r\n"
+        ) == ("six", "1.15.0")
+        assert parse_metadata("Summary: nothing\n") == (None, None)
+
+    def test_canonicalize_name(self) -> None:
+        """Test names are canonicalized as stated in PEP 503."""
+        assert canonicalize_name("Ruamel_.YAML") == "ruamel-yaml"
+        assert canonicalize_name("six") == "six"
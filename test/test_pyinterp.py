@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for detection of Python interpreter versions, fixtures are built by test/data/elf/src/build.sh."""
+
+import os
+import shutil
+
+from thoth.package_extract.pyinterp import get_python_version
+from thoth.package_extract.pyinterp import get_stdlib_series
+from thoth.package_extract.vfs import VirtualRootfs
+
+from .case import TestCase
+
+
+class TestGetPythonVersion(TestCase):
+    """Test detection of versions of Python interpreters."""
+
+    @staticmethod
+    def _build_rootfs(tmp_path, interpreters, stdlib_series=()) -> VirtualRootfs:
+        """Build rootfs with the given interpreters (path to fixture name) and standard libraries."""
+        for path, fixture in interpreters.items():
+            (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(
+                os.path.join(TestCase.DATA_DIR, "elf", fixture), tmp_path / path
+            )
+
+        for series in stdlib_series:
+            stdlib_path = tmp_path / "usr" / "lib" / f"python{series}"
+            stdlib_path.mkdir(parents=True, exist_ok=True)
+            (stdlib_path / "os.py").write_text("")
+
+        return VirtualRootfs.from_directory(str(tmp_path))
+
+    def test_linked_libpython(self, tmp_path) -> None:
+        """Test the version series is determined by libpython the interpreter is linked against."""
+        (tmp_path / "usr" / "lib").mkdir(parents=True)
+        (tmp_path / "usr" / "lib" / "libpython3.9.so.1.0").write_bytes(b"")
+        rootfs = self._build_rootfs(tmp_path, {"usr/bin/python3": "python3"}, ("3.9",))
+
+        assert get_python_version(rootfs, "usr/bin/python3") == "Python 3.9.7"
+
+    def test_version_in_name(self, tmp_path) -> None:
+        """Test the version series is taken from the name of an interpreter not linked against libpython."""
+        rootfs = self._build_rootfs(
+            tmp_path, {"usr/bin/python3.8": "python3-static"}, ("3.6", "3.8")
+        )
+
+        assert get_python_version(rootfs, "usr/bin/python3.8") == "Python 3.8.6"
+
+    def test_no_version_in_name(self, tmp_path) -> None:
+        """Test versions of standard libraries installed are tried, the newest first, if not stated in the name."""
+        rootfs = self._build_rootfs(
+            tmp_path, {"usr/bin/python": "python3-static"}, ("3.6", "3.8", "3.10")
+        )
+
+        assert get_stdlib_series(rootfs) == ["3.6", "3.8", "3.10"]
+        assert get_python_version(rootfs, "usr/bin/python") == "Python 3.8.6"
+
+    def test_unknown_version(self, tmp_path) -> None:
+        """Test no version is reported if the version series cannot be determined or is not stated in the binary."""
+        rootfs = self._build_rootfs(
+            tmp_path,
+            {"usr/bin/python": "python3-static", "usr/bin/python3.7": "python3-static"},
+        )
+
+        assert get_python_version(rootfs, "usr/bin/python") is None
+        assert get_python_version(rootfs, "usr/bin/python3.7") is None
+
+    def test_not_elf(self, tmp_path) -> None:
+        """Test interpreters which are not ELF files (such as wrapper scripts) are not inspected."""
+        (tmp_path / "usr" / "bin").mkdir(parents=True)
+        (tmp_path / "usr" / "bin" / "python3.8").write_text(
+            '#!/bin/sh\nexec python3.8-real "$@"\n'
+        )
+
+        rootfs = VirtualRootfs.from_directory(str(tmp_path))
+        assert get_python_version(rootfs, "usr/bin/python3.8") is None
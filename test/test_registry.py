@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the client pulling images from container registries."""
+
+import base64
+import concurrent.futures
+import json
+import os
+import urllib.parse
+
+import pytest
+
+from thoth.package_extract.cache import BlobCache
+from thoth.package_extract.registry import pull_image
+from thoth.package_extract.registry import RegistryError
+
+from .case import TestCase
+from .registry import FakeRegistry
+
+_BASE_LAYER = [("usr", "dir"), ("usr/base.py", b"base\n" * 1000)]
+
+
+class TestPullImage(TestCase):
+    """Test pulling images by the registry client."""
+
+    @staticmethod
+    def _get_layer_digests(dir_path: str):
+        """Get digests of layers stated in the manifest of an image."""
+        with open(os.path.join(dir_path, "manifest.json")) as manifest_file:
+            return [layer["digest"] for layer in json.load(manifest_file)["layers"]]
+
+    def test_pull(self, tmp_path) -> None:
+        """Test an image is pulled in skopeo's dir: layout, credentials are exchanged for a bearer token."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, [_BASE_LAYER, [("usr/top.py", b"top\n")]])
+        target_path = tmp_path / "pulled"
+        target_path.mkdir()
+
+        with FakeRegistry({"thoth/image": image_path}) as registry:
+            pull_image(
+                f"{registry.address}/thoth/image:latest",
+                str(target_path),
+                plain_http=True,
+                registry_credentials="user:password",
+            )
+
+        assert sorted(os.listdir(target_path)) == sorted(os.listdir(image_path))
+        for name in os.listdir(image_path):
+            with open(os.path.join(image_path, name), "rb") as expected_file, open(
+                target_path / name, "rb"
+            ) as pulled_file:
+                assert pulled_file.read() == expected_file.read()
+
+        assert registry.token_requests
+        token_path, authorization = registry.token_requests[0]
+        assert urllib.parse.parse_qs(urllib.parse.urlsplit(token_path).query)[
+            "scope"
+        ] == ["repository:thoth/image:pull"]
+        assert authorization == "Basic " + base64.b64encode(b"user:password").decode()
+
+    def test_resume_download(self, tmp_path) -> None:
+        """Test an interrupted download of a blob is resumed from the last byte received."""
+        image_path = str(tmp_path / "image")
+        # Data are received in chunks of 1 MiB, the blob is cut after the first chunk.
+        self.build_image(
+            image_path, [[("usr", "dir"), ("usr/data.bin", os.urandom(3 * 1024**2))]]
+        )
+        layer_digest = self._get_layer_digests(image_path)[0]
+        target_path = tmp_path / "pulled"
+        target_path.mkdir()
+
+        with FakeRegistry(
+            {"thoth/image": image_path}, drop_once=[layer_digest]
+        ) as registry:
+            pull_image(
+                f"{registry.address}/thoth/image", str(target_path), plain_http=True
+            )
+
+        blob_name = layer_digest.split(":")[-1]
+        with open(os.path.join(image_path, blob_name), "rb") as expected_file:
+            expected = expected_file.read()
+        with open(target_path / blob_name, "rb") as pulled_file:
+            assert pulled_file.read() == expected
+
+        blob_requests = [
+            range_header
+            for path, range_header in registry.requests
+            if path == f"/v2/thoth/image/blobs/{layer_digest}"
+        ]
+        assert len(blob_requests) == 2
+        assert blob_requests[0] is None
+        offset = int(blob_requests[1][len("bytes=") :].rstrip("-"))
+        assert 0 < offset <= len(expected) // 2
+
+    def test_digest_mismatch(self, tmp_path) -> None:
+        """Test blobs not matching their digest are refused."""
+        image_path = str(tmp_path / "image")
+        self.build_image(image_path, [_BASE_LAYER])
+        blob_name = self._get_layer_digests(image_path)[0].split(":")[-1]
+        with open(os.path.join(image_path, blob_name), "r+b") as blob_file:
+            blob_file.write(b"\x00")
+        target_path = tmp_path / "pulled"
+        target_path.mkdir()
+
+        with FakeRegistry({"thoth/image": image_path}) as registry:
+            with pytest.raises(RegistryError):
+                pull_image(
+                    f"{registry.address}/thoth/image",
+                    str(target_path),
+                    plain_http=True,
+                )
+
+        assert not os.path.exists(target_path / blob_name)
+
+    def test_shared_blobs_downloaded_once(self, tmp_path) -> None:
+        """Test blobs shared by images pulled concurrently are downloaded once through the blob cache."""
+        images = {}
+        for name in ("first", "second"):
+            images[f"thoth/{name}"] = str(tmp_path / "images" / name)
+            self.build_image(
+                images[f"thoth/{name}"],
+                [_BASE_LAYER, [(f"usr/{name}.py", name.encode())]],
+            )
+
+        blob_cache = BlobCache(str(tmp_path / "blobs"))
+        with FakeRegistry(images, delay=0.2) as registry:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                futures = []
+                for name in images:
+                    target_path = tmp_path / "pulled" / name
+                    target_path.mkdir(parents=True)
+                    futures.append(
+                        executor.submit(
+                            pull_image,
+                            f"{registry.address}/{name}",
+                            str(target_path),
+                            plain_http=True,
+                            blob_cache=blob_cache,
+                        )
+                    )
+                for future in futures:
+                    future.result()
+
+        base_digest = self._get_layer_digests(images["thoth/first"])[0]
+        assert base_digest == self._get_layer_digests(images["thoth/second"])[0]
+        assert (
+            registry.count_requests(f"/v2/thoth/first/blobs/{base_digest}")
+            + registry.count_requests(f"/v2/thoth/second/blobs/{base_digest}")
+            == 1
+        )
+        for name in images:
+            blob_path = tmp_path / "pulled" / name / base_digest.split(":")[-1]
+            with open(blob_path, "rb") as blob_file, open(
+                os.path.join(images[name], base_digest.split(":")[-1]), "rb"
+            ) as expected_file:
+                assert blob_file.read() == expected_file.read()
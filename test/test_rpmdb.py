@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for reading rpm databases, fixtures are generated by test/data/rpmdb/generate.py."""
+
+import os
+
+import pytest
+
+from thoth.package_extract.rpmdb import read_rpmdb
+from thoth.package_extract.rpmdb import RpmDBError
+
+from .case import TestCase
+
+
+class TestRpmDB(TestCase):
+    """Test reading packages installed by rpm."""
+
+    _RPMDB_DIR = os.path.join(TestCase.DATA_DIR, "rpmdb")
+
+    @pytest.mark.parametrize("db_format", ["bdb", "ndb"])
+    def test_read(self, db_format) -> None:
+        """Test packages are read with their requirements as listed by dnf, weak and rpmlib dependencies are omitted."""
+        packages = read_rpmdb(os.path.join(self._RPMDB_DIR, db_format))
+        assert [package.nvra for package in packages] == [
+            "bash-5.0.17-2.fc32.x86_64",
+            "python3-3.8.5-1.fc32.x86_64",
+        ]
+        assert [package.package_identifier for package in packages] == [
+            "bash-5.0.17-2.fc32.x86_64",
+            "python3-1:3.8.5-1.fc32.x86_64",
+        ]
+        assert packages[0].requires == [
+            "/bin/sh",
+            "filesystem >= 3",
+            "libc.so.6()(64bit)",
+        ]
+        assert packages[1].requires == ["python3-libs = 1:3.8.5-1.fc32"]
+
+    def test_no_rpmdb(self, tmp_path) -> None:
+        """Test None is returned if there is no rpm database."""
+        assert read_rpmdb(str(tmp_path)) is None
+
+    def test_corrupted(self, tmp_path) -> None:
+        """Test corrupted databases are reported."""
+        db_path = tmp_path / "usr" / "lib" / "sysimage" / "rpm"
+        db_path.mkdir(parents=True)
+        with open(
+            os.path.join(
+                self._RPMDB_DIR, "ndb", "usr", "lib", "sysimage", "rpm", "Packages.db"
+            ),
+            "rb",
+        ) as db_file:
+            (db_path / "Packages.db").write_bytes(db_file.read()[:600])
+
+        with pytest.raises(RpmDBError):
+            read_rpmdb(str(tmp_path))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the shared scan of rootfs."""
+
+import os
+
+import pytest
+
+from thoth.package_extract.cache import SymbolCache
+from thoth.package_extract.image import run_analyzers
+from thoth.package_extract.scan import scan
+from thoth.package_extract.scan import Visitor
+from thoth.package_extract.vfs import VirtualRootfs
+
+from .case import TestCase
+
+
+class TestScan(TestCase):
+    """Test scanning rootfs with visitors."""
+
+    @staticmethod
+    def _build_rootfs(rootfs_path) -> None:
+        """Build a rootfs with Python files inside and outside of library directories."""
+        package_path = (
+            rootfs_path / "usr" / "lib" / "python3.8" / "site-packages" / "foo"
+        )
+        package_path.mkdir(parents=True)
+        (package_path / "__init__.py").write_text("")
+        (rootfs_path / "app").mkdir()
+        (rootfs_path / "app" / "main.py").write_text("import foo\n")
+        (rootfs_path / "app" / "link.py").symlink_to("main.py")
+
+    def test_scan(self, tmp_path) -> None:
+        """Test results of all visitors are gathered by a single scan, symlinks to Python files are reported."""
+        self._build_rootfs(tmp_path)
+        result = scan(
+            VirtualRootfs.from_directory(str(tmp_path)),
+            ["python-files", "library-directories"],
+        )
+        assert result == {
+            "python-files": [
+                "app/link.py",
+                "app/main.py",
+                "usr/lib/python3.8/site-packages/foo/__init__.py",
+            ],
+            "library-directories": ["usr/lib/python3.8/site-packages"],
+        }
+
+    def test_no_visitors(self, tmp_path) -> None:
+        """Test rootfs is not walked if no visitors are requested."""
+        assert scan(VirtualRootfs.from_directory(str(tmp_path)), []) == {}
+
+    def test_visitor_abstract(self) -> None:
+        """Test visitors need to implement visiting directories and reporting results."""
+        with pytest.raises(TypeError):
+            Visitor()
+
+    def test_rootfs_indexed_once(self, tmp_path, monkeypatch) -> None:
+        """Test analyzers run on a directory share a single index of it."""
+        rootfs_path = tmp_path / "rootfs"
+        self._build_rootfs(rootfs_path)
+        indexed = []
+        from_directory = VirtualRootfs.from_directory
+
+        def _from_directory(path: str) -> VirtualRootfs:
+            indexed.append(path)
+            return from_directory(path)
+
+        monkeypatch.setattr(VirtualRootfs, "from_directory", _from_directory)
+        result = run_analyzers(
+            str(rootfs_path),
+            analyzers=["system-symbols", "python-interpreters"],
+            file_digests={"app/main.py": "0" * 64},
+            symbol_cache=SymbolCache(str(tmp_path / "symbols")),
+            # Analyzers are run in the order of registration, symbols are gathered first.
+            workers=1,
+        )
+
+        assert result == {"system-symbols": {}, "python-interpreters": []}
+        assert indexed == [os.path.join(str(tmp_path), "rootfs")]
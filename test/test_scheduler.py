@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for concurrent execution of tasks."""
+
+import threading
+import time
+
+import pytest
+
+from thoth.package_extract.exceptions import CommandError
+from thoth.package_extract.exceptions import TimeoutExpired
+from thoth.package_extract.scheduler import run_task_command
+from thoth.package_extract.scheduler import run_tasks
+from thoth.package_extract.scheduler import Task
+
+from .case import TestCase
+
+
+class TestRunTasks(TestCase):
+    """Test running tasks respecting their dependencies."""
+
+    def test_dependencies(self) -> None:
+        """Test tasks are run once their dependencies finished, results are ordered as tasks were given."""
+        order = []
+        tasks = [
+            Task("b", lambda: order.append("b") or 2, dependencies=("a",)),
+            Task("a", lambda: order.append("a") or 1),
+        ]
+        assert run_tasks(tasks, workers=2) == {"b": 2, "a": 1}
+        assert order == ["a", "b"]
+
+    def test_cyclic_dependencies(self) -> None:
+        """Test tasks with cyclic dependencies are refused."""
+        tasks = [
+            Task("a", lambda: None, dependencies=("b",)),
+            Task("b", lambda: None, dependencies=("a",)),
+        ]
+        with pytest.raises(ValueError):
+            run_tasks(tasks)
+
+    def test_timeout_queued(self) -> None:
+        """Test time tasks wait for a free worker does not count towards the timeout."""
+        tasks = [Task(str(i), lambda: time.sleep(0.6)) for i in range(3)]
+        assert run_tasks(tasks, workers=1, timeout=1) == {
+            "0": None,
+            "1": None,
+            "2": None,
+        }
+
+    def test_timeout(self) -> None:
+        """Test a task not finishing in time and tasks depending on it are reported, other tasks are run."""
+        finished = threading.Event()
+
+        def _slow() -> None:
+            time.sleep(0.5)
+            finished.set()
+
+        results = run_tasks(
+            [
+                Task("slow", _slow),
+                Task("dependent", lambda: 1, dependencies=("slow",)),
+                Task("transitive", lambda: 2, dependencies=("dependent",)),
+                Task("independent", lambda: 3),
+            ],
+            timeout=0.1,
+        )
+
+        assert isinstance(results["slow"], TimeoutExpired)
+        assert isinstance(results["dependent"], TimeoutExpired)
+        assert isinstance(results["transitive"], TimeoutExpired)
+        assert results["independent"] == 3
+        # The thread running the task is waited for, it does not outlive the call.
+        assert finished.is_set()
+
+    def test_timeout_kills_commands(self) -> None:
+        """Test commands run by a task not finishing in time are killed."""
+        start_time = time.monotonic()
+        results = run_tasks(
+            [Task("slow", lambda: run_task_command("sleep 30; echo done").stdout)],
+            timeout=0.2,
+        )
+        assert isinstance(results["slow"], TimeoutExpired)
+        assert time.monotonic() - start_time < 10
+
+    def test_failure(self) -> None:
+        """Test failures of tasks are raised once running tasks are cancelled."""
+        start_time = time.monotonic()
+        with pytest.raises(CommandError):
+            run_tasks(
+                [
+                    Task("failing", lambda: run_task_command("exit 3")),
+                    Task("slow", lambda: run_task_command("sleep 30")),
+                ]
+            )
+        assert time.monotonic() - start_time < 10
+
+
+class TestRunTaskCommand(TestCase):
+    """Test running commands on behalf of tasks."""
+
+    def test_output(self) -> None:
+        """Test output of a command is returned."""
+        result = run_task_command("echo out; echo err >&2")
+        assert (result.returncode, result.stdout, result.stderr) == (
+            0,
+            "out\n",
+            "err\n",
+        )
+
+    def test_error(self) -> None:
+        """Test commands exiting with non-zero status code are reported, unless turned off."""
+        with pytest.raises(CommandError):
+            run_task_command("exit 3")
+        assert run_task_command("exit 3", raise_on_error=False).returncode == 3
+
+    def test_timeout(self) -> None:
+        """Test a command not finishing in time is killed together with processes it started."""
+        start_time = time.monotonic()
+        with pytest.raises(TimeoutExpired):
+            run_task_command("sleep 30 & sleep 30; wait", timeout=0.2)
+        assert time.monotonic() - start_time < 10
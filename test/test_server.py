@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""Tests for the service accepting extraction jobs over HTTP."""
+
+import datetime
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from thoth.package_extract import server
+
+from .case import TestCase
+
+
+class TestServer(TestCase):
+    """Test the job API."""
+
+    @pytest.fixture
+    def address(self, monkeypatch):
+        """Serve the job API with results of jobs stating values JSON cannot serialize by default."""
+        created = datetime.datetime(2020, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        monkeypatch.setattr(
+            server,
+            "extract_image",
+            lambda image, timeout, **kwargs: {"image": image, "created": created},
+        )
+        job_queue = server.JobQueue()
+        http_server = server._HTTPServer(("127.0.0.1", 0), server._RequestHandler)
+        http_server.job_queue = job_queue
+        threading.Thread(target=http_server.serve_forever, daemon=True).start()
+        try:
+            yield f"127.0.0.1:{http_server.server_port}"
+        finally:
+            http_server.shutdown()
+            http_server.server_close()
+            job_queue.shutdown()
+
+    def test_result_encoding(self, address) -> None:
+        """Test results are encoded as by the CLI."""
+        request = urllib.request.Request(
+            f"http://{address}/jobs",
+            data=json.dumps({"image": "fedora:32"}).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request) as response:
+            job_id = json.load(response)["id"]
+
+        with urllib.request.urlopen(
+            f"http://{address}/jobs/{job_id}?wait=10"
+        ) as response:
+            job = json.load(response)
+
+        assert job["status"] == "finished"
+        assert job["result"] == {
+            "image": "fedora:32",
+            "created": "2020-01-01T12:00:00+00:00",
+        }
@@ -17,6 +17,9 @@
 
 """Extraction of installed packages for project Thoth."""
 
+from .cache import AnalysisCache  # noqa F401
+from .cache import LayerCache  # noqa F401
+from .cache import SymbolCache  # noqa F401
 from .core import extract_image  # noqa F401
 
 __version__ = "1.3.1"
@@ -24,4 +27,4 @@ __title__ = "thoth-package-extract"
 __author__ = "Fridolin Pokorny"
 __license__ = "GPLv3+"
 __copyright__ = "Copyright 2018 Fridolin Pokorny"
-__all__ = ["extract_image"]
+__all__ = ["extract_image", "AnalysisCache", "LayerCache", "SymbolCache"]
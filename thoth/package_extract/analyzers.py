@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A registry of named analyzers run on root filesystem of images."""
+
+import functools
+import importlib.metadata
+import logging
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+
+from .cache import SymbolCache
+from .exceptions import NotSupported
+from .layers import LayerChanges
+from .scan import scan
+from .vfs import VirtualRootfs
+
+_LOGGER = logging.getLogger(__name__)
+
+# Entry points in this group are expected to refer to Analyzer instances.
+ENTRY_POINT_GROUP = "thoth_package_extract.analyzers"
+
+_REGISTRY: Dict[str, "Analyzer"] = {}
+
+
+@attr.s(slots=True)
+class AnalyzerContext:
+    """Inputs of analyzers run on a single root filesystem.
+
+    Results of previous analysis (see run_analyzers) are available together with results of finished
+    analyzers, intermediate results can be shared between analyzers (dependent on each other) by storing them.
+    Rootfs can be queried through the virtual rootfs, see get_rootfs. Analyzers walking rootfs get results
+    of visitors from a single scan of rootfs shared by all of them, see get_scan_result.
+    """
+
+    path = attr.ib(type=str)
+    timeout = attr.ib(type=Optional[int], default=None)
+    previous = attr.ib(type=Dict[str, Any], factory=dict)
+    changes = attr.ib(type=Optional[LayerChanges], default=None)
+    file_digests = attr.ib(type=Optional[Dict[str, Optional[str]]], default=None)
+    symbol_cache = attr.ib(type=Optional[SymbolCache], default=None)
+    results = attr.ib(type=Dict[str, Any], factory=dict)
+    shared = attr.ib(type=Dict[str, Any], factory=dict)
+    rootfs = attr.ib(type=Optional[VirtualRootfs], default=None)
+    visitors = attr.ib(type=Tuple[str, ...], default=())
+    _lock = attr.ib(type=threading.Lock, factory=threading.Lock, repr=False)
+    _scan_lock = attr.ib(type=threading.Lock, factory=threading.Lock, repr=False)
+    _scan_results = attr.ib(type=Optional[Dict[str, Any]], default=None, repr=False)
+
+    def get_rootfs(self) -> VirtualRootfs:
+        """Get virtual rootfs, it is indexed from the rootfs directory on first use if not constructed from layers."""
+        with self._lock:
+            if self.rootfs is None:
+                self.rootfs = VirtualRootfs.from_directory(self.path)
+            return self.rootfs
+
+    def get_scan_result(self, visitor: str) -> Any:
+        """Get result of the named visitor, rootfs is scanned with all visitors stated in the context on first use."""
+        rootfs = self.get_rootfs()
+        with self._scan_lock:
+            if self._scan_results is None:
+                self._scan_results = scan(rootfs, sorted({visitor, *self.visitors}))
+            elif visitor not in self._scan_results:
+                self._scan_results.update(scan(rootfs, (visitor,)))
+            return self._scan_results[visitor]
+
+
+@attr.s(slots=True, frozen=True)
+class Analyzer:
+    """An analyzer producing a named section of the output.
+
+    Paths (see compile_path_patterns for syntax) stated as inputs determine results of the analyzer, results
+    are reused if none of them was changed by upper layers; results are always recomputed if no inputs are
+    stated. Paths needed in rootfs restrict what is extracted, the whole rootfs is extracted if not stated.
+    Analyzers using file digests get digests of Python files and shared objects computed on extraction.
+    Results of analyzers working on image metadata do not depend on image layers, no rootfs is needed.
+    Virtual analyzers read rootfs solely through the virtual rootfs, rootfs does not need to be materialized
+    in a directory for them. Visitors (see scan.VISITORS) stated are fed by the scan of rootfs shared by analyzers.
+    """
+
+    name = attr.ib(type=str)
+    func = attr.ib(type=Callable[[AnalyzerContext], Any])
+    dependencies = attr.ib(type=Tuple[str, ...], default=())
+    inputs = attr.ib(type=Optional[Tuple[str, ...]], default=None)
+    paths = attr.ib(type=Optional[Tuple[str, ...]], default=None)
+    uses_file_digests = attr.ib(type=bool, default=False)
+    image_metadata = attr.ib(type=bool, default=False)
+    virtual = attr.ib(type=bool, default=False)
+    visitors = attr.ib(type=Tuple[str, ...], default=())
+
+
+def register_analyzer(analyzer: Analyzer) -> Analyzer:
+    """Register the given analyzer, analyzers are run and reported in the order of registration."""
+    if analyzer.name in _REGISTRY:
+        raise ValueError(f"Analyzer {analyzer.name!r} is already registered")
+
+    _REGISTRY[analyzer.name] = analyzer
+    return analyzer
+
+
+@functools.lru_cache(maxsize=None)
+def _load_entry_points() -> None:
+    """Register analyzers provided by installed packages via entry points."""
+    entry_points = importlib.metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        group = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        group = entry_points.get(ENTRY_POINT_GROUP, [])
+
+    for entry_point in group:
+        try:
+            analyzer = entry_point.load()
+            if not isinstance(analyzer, Analyzer):
+                raise TypeError(f"expected an Analyzer, got {type(analyzer)!r}")
+            register_analyzer(analyzer)
+        except Exception as exc:
+            _LOGGER.warning(
+                "Failed to load analyzer from entry point %r: %s",
+                entry_point.name,
+                str(exc),
+            )
+        else:
+            _LOGGER.debug(
+                "Registered analyzer %r from entry point %r",
+                analyzer.name,
+                entry_point.name,
+            )
+
+
+def get_analyzer(name: str) -> Optional[Analyzer]:
+    """Get a registered analyzer by its name, return None if no such analyzer is registered."""
+    _load_entry_points()
+    return _REGISTRY.get(name)
+
+
+def get_analyzers(
+    names: Optional[Iterable[str]] = None, skip: Iterable[str] = ()
+) -> List[Analyzer]:
+    """Get registered analyzers with the given names (all if not stated) except for the skipped ones."""
+    _load_entry_points()
+    selected = set(_REGISTRY if names is None else names)
+    skipped = set(skip)
+    unknown = (selected | skipped) - _REGISTRY.keys()
+    if unknown:
+        raise NotSupported(
+            f"Unknown analyzers {', '.join(sorted(unknown))}, "
+            f"available analyzers: {', '.join(_REGISTRY)}"
+        )
+
+    selected -= skipped
+    return [analyzer for name, analyzer in _REGISTRY.items() if name in selected]
+
+
+def resolve_dependencies(analyzers: Iterable[Analyzer]) -> List[Analyzer]:
+    """Add analyzers the given analyzers depend on, analyzers are kept in the order of registration."""
+    _load_entry_points()
+    names = set()
+    pending = [analyzer.name for analyzer in analyzers]
+    while pending:
+        name = pending.pop()
+        if name in names:
+            continue
+
+        if name not in _REGISTRY:
+            raise NotSupported(f"Analyzer {name!r} needed is not registered")
+
+        names.add(name)
+        pending.extend(_REGISTRY[name].dependencies)
+
+    return [analyzer for name, analyzer in _REGISTRY.items() if name in names]
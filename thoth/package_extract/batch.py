@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Extraction of multiple images in one run, sharing work done on common layers."""
+
+import concurrent.futures
+import logging
+import time
+from typing import Any
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import attr
+
+from .core import extract_image
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@attr.s(slots=True)
+class BatchResult:
+    """Result of extraction of an image in a batch, the error is stated if the extraction failed."""
+
+    image = attr.ib(type=str)
+    result = attr.ib(type=Optional[Dict[str, Any]], default=None)
+    error = attr.ib(type=Optional[str], default=None)
+    duration = attr.ib(type=float, default=0.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the result into a JSON serializable form."""
+        result: Dict[str, Any] = {"image": self.image, "duration": self.duration}
+        if self.error is not None:
+            result["error"] = self.error
+        else:
+            result["result"] = self.result
+
+        return result
+
+
+def read_image_list(lines: Iterable[str]) -> List[str]:
+    """Read image references stated one per line, empty lines and comments are skipped, duplicates are dropped."""
+    result = []
+    seen = set()
+    for line in lines:
+        image = line.split("#", maxsplit=1)[0].strip()
+        if image and image not in seen:
+            seen.add(image)
+            result.append(image)
+
+    return result
+
+
+def _extract(image: str, extract_kwargs: Dict[str, Any]) -> BatchResult:
+    """Extract a single image of a batch, errors are reported in the result."""
+    start_time = time.monotonic()
+    try:
+        result = extract_image(image, **extract_kwargs)
+    except Exception as exc:
+        _LOGGER.exception("Failed to extract image %r", image)
+        return BatchResult(
+            image=image, error=str(exc), duration=time.monotonic() - start_time
+        )
+
+    return BatchResult(
+        image=image, result=result, duration=time.monotonic() - start_time
+    )
+
+
+def extract_images(
+    images: Iterable[str], *, parallelism: int = 1, **extract_kwargs: Any
+) -> Generator[BatchResult, None, None]:
+    """Extract the given images concurrently, results are yielded as soon as each image is extracted.
+
+    Keyword arguments are passed to extract_image. Caches passed are shared by all extractions, layers shared
+    by images are extracted once into the layer cache (others wait for them, see LayerCache.lock) and analyzer
+    results computed for shared stacks of layers are reused.
+    """
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=parallelism, thread_name_prefix="batch"
+    ) as executor:
+        futures = [executor.submit(_extract, image, extract_kwargs) for image in images]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent caches shared across image scans."""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Generator
+from typing import IO
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+_LOGGER = logging.getLogger(__name__)
+_LAYER_CACHE_DEFAULT_SIZE = 10 * 1024**3
+_BLOB_CACHE_DEFAULT_SIZE = 2 * 1024**3
+_ANALYSIS_CACHE_DEFAULT_SIZE = 1024**3
+_SYMBOL_CACHE_DEFAULT_SIZE = 64 * 1024**2
+_SYMBOL_CACHE_TIMEOUT = 60
+
+
+def _get_tree_size(path: str) -> int:
+    """Compute size of all files stored in the given directory tree, symlinks are not followed."""
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for file_ in files:
+            try:
+                total_size += os.lstat(os.path.join(root, file_)).st_size
+            except OSError:
+                pass
+    return total_size
+
+
+def get_chain_ids(layers: List[str]) -> List[str]:
+    """Compute identifiers of layer chains, the n-th identifier describes the stack of the first n+1 layers."""
+    result = []
+    for layer_digest in layers:
+        if not result:
+            result.append(layer_digest)
+            continue
+
+        chain_id = hashlib.sha256(f"{result[-1]} {layer_digest}".encode()).hexdigest()
+        result.append(chain_id)
+
+    return result
+
+
+def _lock_file(path: str, operation: int) -> Optional[IO[str]]:
+    """Open and lock (see flock) the file at the given path, return None if a non-blocking lock is not acquired.
+
+    Lock files are removed only by holders of exclusive locks. If the file was removed before the lock was
+    acquired, a lock of the file now present at the path is acquired instead. The lock is released once
+    the returned file is closed.
+    """
+    while True:
+        lock_file = open(path, "a")
+        try:
+            fcntl.flock(lock_file.fileno(), operation)
+            lock_stat = os.fstat(lock_file.fileno())
+            path_stat = os.stat(path)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        except FileNotFoundError:
+            lock_file.close()
+            continue
+        except Exception:
+            lock_file.close()
+            raise
+
+        if (lock_stat.st_dev, lock_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino):
+            return lock_file
+
+        lock_file.close()
+
+
+class _DiskCache:
+    """A base class for on-disk caches with size-bounded LRU eviction."""
+
+    _CACHE_NAME = "cache"
+    _LOCK_DIRS: Tuple[str, ...] = (".locks",)
+
+    def __init__(self, path: str, max_size: int) -> None:
+        """Initialize cache stored in the given directory."""
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, key: str) -> str:
+        """Get path to a cache entry for the given key."""
+        return os.path.join(self.path, key)
+
+    def _touch(self, key: str) -> None:
+        """Mark the given entry as used, modification time keeps track of the last use for LRU eviction."""
+        try:
+            os.utime(self._entry_path(key))
+        except OSError as exc:
+            _LOGGER.warning(
+                "Failed to mark %r as used in the %s: %s",
+                key,
+                self._CACHE_NAME,
+                str(exc),
+            )
+
+    def _entry_size(self, key: str) -> int:
+        """Get size of the given entry."""
+        return os.stat(self._entry_path(key)).st_size
+
+    def _remove_entry(self, key: str) -> None:
+        """Remove the given entry from the cache."""
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, key: str) -> bool:
+        """Remove the given entry from the cache, if present, return False if the entry is in use and it is kept."""
+        with self._lock_for_eviction(key) as evictable:
+            if evictable:
+                self._remove_entry(key)
+
+        self._remove_stale_lock_files()
+        return evictable
+
+    def _lock_path(self, dir_name: str, key: str) -> str:
+        """Get path to the file locked to lock the given entry, lock files are kept in the given directory."""
+        locks_path = os.path.join(self.path, dir_name)
+        os.makedirs(locks_path, exist_ok=True)
+        return os.path.join(locks_path, key)
+
+    @contextlib.contextmanager
+    def lock(self, key: str) -> Generator[None, None, None]:
+        """Hold an exclusive lock of the given entry.
+
+        Threads and processes sharing the cache look up and store entries under the lock, so each entry is
+        created once and others wait for it instead of creating it again.
+        """
+        # Locks are held on distinct open file descriptions, so they exclude threads of a process as well.
+        with _lock_file(self._lock_path(".locks", key), fcntl.LOCK_EX):  # type: ignore
+            yield
+
+    def _remove_stale_lock_files(self) -> None:
+        """Remove lock files of entries not present in the cache, lock files held by others are kept."""
+        for dir_name in self._LOCK_DIRS:
+            self._remove_stale_lock_files_in(dir_name)
+
+    def _remove_stale_lock_files_in(self, dir_name: str) -> None:
+        """Remove lock files kept in the given directory of entries not present in the cache."""
+        locks_path = os.path.join(self.path, dir_name)
+        try:
+            keys = os.listdir(locks_path)
+        except FileNotFoundError:
+            return
+
+        for key in keys:
+            if os.path.lexists(self._entry_path(key)):
+                continue
+
+            lock_path = os.path.join(locks_path, key)
+            lock_file = _lock_file(lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if lock_file is None:
+                continue
+
+            try:
+                # The entry could be stored before the lock was acquired.
+                if not os.path.lexists(self._entry_path(key)):
+                    os.remove(lock_path)
+            finally:
+                lock_file.close()
+
+    def _list_entries(self) -> List[Tuple[float, int, str]]:
+        """List cache entries as tuples of last use time, size and key."""
+        result = []
+        for key in os.listdir(self.path):
+            if key.startswith("."):
+                continue
+
+            try:
+                size = self._entry_size(key)
+                result.append((os.stat(self._entry_path(key)).st_mtime, size, key))
+            except (OSError, ValueError) as exc:
+                _LOGGER.warning(
+                    "Skipping invalid %s entry %r: %s", self._CACHE_NAME, key, str(exc)
+                )
+
+        return result
+
+    @contextlib.contextmanager
+    def _lock_for_eviction(self, key: str) -> Generator[bool, None, None]:
+        """Lock the given entry for eviction, yield False if the entry is in use and cannot be evicted."""
+        yield True
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Evict least recently used entries so that the cache fits into its size limit, entries in use are kept."""
+        entries = sorted(self._list_entries())
+        total_size = sum(size for _, size, _ in entries)
+
+        for _, size, key in entries:
+            if total_size <= self.max_size:
+                break
+
+            if key == keep:
+                continue
+
+            with self._lock_for_eviction(key) as evictable:
+                if not evictable:
+                    _LOGGER.debug(
+                        "Not evicting %r from the %s, it is in use",
+                        key,
+                        self._CACHE_NAME,
+                    )
+                    continue
+
+                _LOGGER.debug(
+                    "Evicting %r (%d bytes) from the %s", key, size, self._CACHE_NAME
+                )
+                self._remove_entry(key)
+                total_size -= size
+
+        # Lock files of evicted entries (or of entries never stored) are removed, so they do not pile up.
+        self._remove_stale_lock_files()
+
+
+class LayerCache(_DiskCache):
+    """A content-addressed store of extracted image layers with size-bounded LRU eviction.
+
+    Each cached layer is stored in a directory named after its digest. Files of a cached layer tree are
+    hardlinked into constructed root filesystems so they have to be treated as read-only. Layers used by
+    a job are pinned (see leased) and they are not evicted until the job finishes.
+    """
+
+    _CACHE_NAME = "layer cache"
+    _LOCK_DIRS = (".locks", ".pins")
+
+    def __init__(self, path: str, max_size: int = _LAYER_CACHE_DEFAULT_SIZE) -> None:
+        """Initialize layer cache stored in the given directory."""
+        super().__init__(path, max_size)
+        self._pins: Optional[Dict[str, IO[str]]] = None
+        self._pins_lock = threading.Lock()
+
+    def _pin_path(self, digest: str) -> str:
+        """Get path to the file locked to pin the given layer."""
+        return self._lock_path(".pins", digest)
+
+    @contextlib.contextmanager
+    def leased(self) -> Generator["LayerCache", None, None]:
+        """Get a view of the cache for a single job, layers looked up or stored through the view are pinned.
+
+        Pins are shared locks held until the job finishes, so threads and processes sharing the cache do
+        not evict layers the job uses.
+        """
+        lease = LayerCache(self.path, self.max_size)
+        lease._pins = {}
+        try:
+            yield lease
+        finally:
+            with lease._pins_lock:
+                for pin_file in lease._pins.values():
+                    pin_file.close()
+                lease._pins.clear()
+
+    def _pin(self, digest: str) -> None:
+        """Pin the given layer if this is a leased view of the cache, waits if the layer is being evicted."""
+        if self._pins is None:
+            return
+
+        with self._pins_lock:
+            if digest in self._pins:
+                return
+
+            self._pins[digest] = _lock_file(self._pin_path(digest), fcntl.LOCK_SH)  # type: ignore
+
+    @contextlib.contextmanager
+    def _lock_for_eviction(self, key: str) -> Generator[bool, None, None]:
+        """Lock the given layer for eviction, yield False if the layer is pinned."""
+        pin_file = _lock_file(self._pin_path(key), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if pin_file is None:
+            yield False
+            return
+
+        with pin_file:
+            yield True
+
+    def _entry_size(self, key: str) -> int:
+        """Get size of the extracted layer as computed when the layer was stored."""
+        with open(os.path.join(self._entry_path(key), "size")) as size_file:
+            return int(size_file.read())
+
+    def _remove_entry(self, key: str) -> None:
+        """Remove extracted layer from the cache together with its pin file, the layer is locked for eviction."""
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+        try:
+            os.remove(self._pin_path(key))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, key: str) -> bool:
+        """Remove the given layer from the cache, if present, return False if the layer is pinned by others."""
+        if self._pins is not None:
+            # The layer pinned through this view is unpinned, it is pinned again once stored.
+            with self._pins_lock:
+                pin_file = self._pins.pop(key, None)
+            if pin_file is not None:
+                pin_file.close()
+
+        return super().remove(key)
+
+    def get(self, digest: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Get path to an extracted layer tree and metadata stored with it, return None if the layer is not cached."""
+        self._pin(digest)
+        entry_path = self._entry_path(digest)
+        tree_path = os.path.join(entry_path, "rootfs")
+        try:
+            with open(os.path.join(entry_path, "metadata.json")) as metadata_file:
+                metadata = json.load(metadata_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            _LOGGER.warning(
+                "Failed to load metadata of layer %r from the layer cache: %s",
+                digest,
+                str(exc),
+            )
+            return None
+
+        if not os.path.isdir(tree_path):
+            return None
+
+        self._touch(digest)
+        _LOGGER.debug("Using layer %r from the layer cache", digest)
+        return tree_path, metadata
+
+    def store(
+        self, digest: str, populate: Callable[[str], Dict[str, Any]]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Store a layer in the cache.
+
+        The populate callback extracts the layer into the directory passed and returns metadata stored with the layer.
+        """
+        self._pin(digest)
+        staging_path = tempfile.mkdtemp(prefix=".staging-", dir=self.path)
+        try:
+            tree_path = os.path.join(staging_path, "rootfs")
+            os.mkdir(tree_path)
+            metadata = populate(tree_path)
+
+            with open(
+                os.path.join(staging_path, "metadata.json"), "w"
+            ) as metadata_file:
+                json.dump(metadata, metadata_file)
+
+            with open(os.path.join(staging_path, "size"), "w") as size_file:
+                size_file.write(str(_get_tree_size(tree_path)))
+
+            try:
+                os.rename(staging_path, self._entry_path(digest))
+            except OSError:
+                # The layer was stored in the meantime by another process sharing the cache.
+                _LOGGER.debug("Layer %r is already present in the layer cache", digest)
+                shutil.rmtree(staging_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+
+        self.evict(keep=digest)
+        return os.path.join(self._entry_path(digest), "rootfs"), metadata
+
+
+class BlobCache(_DiskCache):
+    """A content-addressed store of downloaded image blobs with size-bounded LRU eviction.
+
+    Blobs are stored under their hex digests and linked into directories images are pulled into. Jobs pulling
+    images concurrently look up and download blobs under the lock of the blob (see lock), so a blob shared by
+    images is downloaded once.
+    """
+
+    _CACHE_NAME = "blob cache"
+
+    def __init__(self, path: str, max_size: int = _BLOB_CACHE_DEFAULT_SIZE) -> None:
+        """Initialize blob cache stored in the given directory."""
+        super().__init__(path, max_size)
+
+    def link(self, digest: str, path: str) -> bool:
+        """Link the given blob to the path, return False if the blob is not cached."""
+        entry_path = self._entry_path(digest)
+        try:
+            os.link(entry_path, path)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # The cache can be placed on a different filesystem.
+            try:
+                shutil.copyfile(entry_path, path)
+            except FileNotFoundError:
+                return False
+
+        self._touch(digest)
+        _LOGGER.debug("Using blob %r from the blob cache", digest)
+        return True
+
+    def store(self, digest: str, path: str) -> None:
+        """Store a downloaded blob in the cache, the blob is linked (or copied) from the given path."""
+        fd, staging_path = tempfile.mkstemp(prefix=".staging-", dir=self.path)
+        os.close(fd)
+        try:
+            os.remove(staging_path)
+            try:
+                os.link(path, staging_path)
+            except OSError:
+                shutil.copyfile(path, staging_path)
+            os.replace(staging_path, self._entry_path(digest))
+        except Exception:
+            try:
+                os.remove(staging_path)
+            except OSError:
+                pass
+            raise
+
+        self.evict(keep=digest)
+
+
+class AnalysisCache(_DiskCache):
+    """A store of analyzer results keyed by the chain of layers analyzed.
+
+    Only results of analyzers that depend solely on the content of image layers should be stored.
+    """
+
+    _CACHE_NAME = "analysis cache"
+
+    def __init__(self, path: str, max_size: int = _ANALYSIS_CACHE_DEFAULT_SIZE) -> None:
+        """Initialize analysis cache stored in the given directory."""
+        super().__init__(path, max_size)
+
+    def get(self, layers: List[str]) -> Optional[Dict[str, Any]]:
+        """Get analyzer results computed for the given stack of layers, return None if not cached."""
+        if not layers:
+            return None
+
+        chain_id = get_chain_ids(layers)[-1]
+        try:
+            with open(self._entry_path(chain_id)) as entry_file:
+                result: Dict[str, Any] = json.load(entry_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            _LOGGER.warning(
+                "Failed to load cached analyzer results for layer chain %r: %s",
+                chain_id,
+                str(exc),
+            )
+            return None
+
+        self._touch(chain_id)
+        _LOGGER.debug("Using cached analyzer results for layer chain %r", chain_id)
+        return result
+
+    def get_longest_prefix(
+        self, layers: List[str]
+    ) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Get analyzer results computed for the longest cached prefix of the given stack of layers.
+
+        Returns the number of layers in the prefix found together with the results, (0, None) if nothing is cached.
+        """
+        for prefix_length in range(len(layers), 0, -1):
+            result = self.get(layers[:prefix_length])
+            if result is not None:
+                return prefix_length, result
+
+        return 0, None
+
+    def store(self, layers: List[str], result: Dict[str, Any]) -> None:
+        """Store analyzer results computed for the given stack of layers."""
+        if not layers:
+            return
+
+        chain_id = get_chain_ids(layers)[-1]
+        fd, staging_path = tempfile.mkstemp(prefix=".staging-", dir=self.path)
+        try:
+            with os.fdopen(fd, "w") as staging_file:
+                json.dump(result, staging_file)
+            os.replace(staging_path, self._entry_path(chain_id))
+        except Exception:
+            try:
+                os.remove(staging_path)
+            except OSError:
+                pass
+            raise
+
+        self.evict(keep=chain_id)
+
+
+class SymbolCache:
+    """A store of version symbols exported by shared objects keyed by SHA-256 digest of their content.
+
+    Entries are kept in an SQLite database (digests as raw bytes, symbols as newline separated text) with
+    size-bounded LRU eviction, the database can be shared by multiple processes.
+    """
+
+    _DATABASE_NAME = "symbols.sqlite"
+
+    def __init__(self, path: str, max_size: int = _SYMBOL_CACHE_DEFAULT_SIZE) -> None:
+        """Initialize symbol cache stored in the given directory."""
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS symbols ("
+                    "digest BLOB PRIMARY KEY, symbols TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL"
+                    ")"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS symbols_last_used ON symbols (last_used)"
+                )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database, connections are not shared across threads."""
+        return sqlite3.connect(
+            os.path.join(self.path, self._DATABASE_NAME), timeout=_SYMBOL_CACHE_TIMEOUT
+        )
+
+    def get_many(self, digests: Iterable[str]) -> Dict[str, List[str]]:
+        """Get symbols of shared objects with the given content digests, digests not cached are not stated."""
+        result = {}
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                for digest in digests:
+                    row = connection.execute(
+                        "SELECT symbols FROM symbols WHERE digest = ?",
+                        (bytes.fromhex(digest),),
+                    ).fetchone()
+                    if row is None:
+                        continue
+
+                    result[digest] = row[0].split("\n") if row[0] else []
+                    connection.execute(
+                        "UPDATE symbols SET last_used = ? WHERE digest = ?",
+                        (now, bytes.fromhex(digest)),
+                    )
+        finally:
+            connection.close()
+
+        _LOGGER.debug(
+            "Found symbols of %d shared objects in the symbol cache", len(result)
+        )
+        return result
+
+    def store(self, entries: Dict[str, Iterable[str]]) -> None:
+        """Store symbols of shared objects keyed by their content digests."""
+        if not entries:
+            return
+
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                for digest, symbols in entries.items():
+                    symbols_text = "\n".join(sorted(symbols))
+                    connection.execute(
+                        "INSERT OR REPLACE INTO symbols (digest, symbols, size, last_used) VALUES (?, ?, ?, ?)",
+                        (
+                            bytes.fromhex(digest),
+                            symbols_text,
+                            len(digest) // 2 + len(symbols_text),
+                            now,
+                        ),
+                    )
+                self._evict(connection)
+        finally:
+            connection.close()
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """Evict least recently used entries so that the cache fits into its size limit."""
+        total_size = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM symbols"
+        ).fetchone()[0]
+        if total_size <= self.max_size:
+            return
+
+        to_evict = []
+        for digest, size in connection.execute(
+            "SELECT digest, size FROM symbols ORDER BY last_used"
+        ):
+            if total_size <= self.max_size:
+                break
+            to_evict.append((digest,))
+            total_size -= size
+
+        _LOGGER.debug("Evicting %d entries from the symbol cache", len(to_evict))
+        connection.executemany("DELETE FROM symbols WHERE digest = ?", to_evict)
@@ -17,19 +17,35 @@
 
 """Command line interface for thoth-package-extract."""
 
+import contextlib
+import json
 import logging
+import os
 import sys
+import tempfile
 import time
 
 import click
 
+from thoth.common import SafeJSONEncoder
 from thoth.common import init_logging
 from thoth.common import __version__ as __common_version__
 from thoth.analyzer import print_command_result
 from thoth.analyzer import __version__ as __analyzer_version__
 from thoth.package_extract import __title__ as analyzer
 from thoth.package_extract import __version__ as analyzer_version
+from thoth.package_extract.analyzers import get_analyzers
+from thoth.package_extract.batch import extract_images
+from thoth.package_extract.batch import read_image_list
+from thoth.package_extract.cache import AnalysisCache
+from thoth.package_extract.cache import BlobCache
+from thoth.package_extract.cache import LayerCache
+from thoth.package_extract.cache import SymbolCache
 from thoth.package_extract.core import extract_image
+from thoth.package_extract.exceptions import NotSupported
+from thoth.package_extract.metrics import wait_for_pushes
+from thoth.package_extract.server import JobQueue
+from thoth.package_extract.server import serve
 
 __component_version__ = (
     f"{analyzer_version}+"
@@ -40,6 +56,130 @@ init_logging()
 _LOG = logging.getLogger("thoth.package_extract")
 
 
+def _split_names(ctx, param, value):
+    """Split a comma separated list of names passed to an option."""
+    if not value:
+        return None
+
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+# Options configuring extraction shared by commands running it.
+_EXTRACTION_OPTIONS = [
+    click.option(
+        "--cache-dir",
+        type=str,
+        envvar="THOTH_PACKAGE_EXTRACT_CACHE_DIR",
+        default=None,
+        help="Directory with persistent caches shared across runs, extracted layers and analyzer results "
+        "are reused if set.",
+    ),
+    click.option(
+        "--layer-cache-size",
+        type=int,
+        envvar="THOTH_PACKAGE_EXTRACT_LAYER_CACHE_SIZE",
+        default=10 * 1024**3,
+        show_default=True,
+        help="Maximum size of extracted layers kept in the cache directory, in bytes.",
+    ),
+    click.option(
+        "--extraction-workers",
+        type=int,
+        envvar="THOTH_PACKAGE_EXTRACT_EXTRACTION_WORKERS",
+        default=None,
+        help="Number of layers decompressed (and hashed) concurrently when constructing root filesystem, "
+        "defaults to CPU count.",
+    ),
+    click.option(
+        "--selective-extraction",
+        is_flag=True,
+        envvar="THOTH_PACKAGE_EXTRACT_SELECTIVE_EXTRACTION",
+        help="Materialize only files needed by analyzers when constructing root filesystem.",
+    ),
+    click.option(
+        "--analyzer-workers",
+        type=int,
+        envvar="THOTH_PACKAGE_EXTRACT_ANALYZER_WORKERS",
+        default=None,
+        help="Number of analyzers run concurrently, all independent analyzers are run at once by default.",
+    ),
+    click.option(
+        "--native-registry",
+        is_flag=True,
+        envvar="THOTH_PACKAGE_EXTRACT_NATIVE_REGISTRY",
+        help="Pull images by the built-in registry client instead of skopeo, layers found in the layer cache "
+        "are not downloaded and blobs shared by images of a batch are downloaded once.",
+    ),
+    click.option(
+        "--download-workers",
+        type=int,
+        envvar="THOTH_PACKAGE_EXTRACT_DOWNLOAD_WORKERS",
+        default=None,
+        help="Number of blobs downloaded concurrently by the built-in registry client, defaults to 4.",
+    ),
+    click.option(
+        "--virtual-rootfs",
+        is_flag=True,
+        envvar="THOTH_PACKAGE_EXTRACT_VIRTUAL_ROOTFS",
+        help="Analyze layers through an index instead of extracting them, only files needed by analyzers "
+        "which require a real directory are written.",
+    ),
+]
+
+
+def _extract_images(images, output, **kwargs):
+    """Extract the given images, results are written to the output as newline delimited JSON.
+
+    Return number of images which failed to be extracted.
+    """
+    failed = 0
+    with contextlib.ExitStack() as stack:
+        if output == "-":
+            output_file = sys.stdout
+        else:
+            output_file = stack.enter_context(open(output, "w"))
+
+        for batch_result in extract_images(images, **kwargs):
+            if batch_result.error is not None:
+                failed += 1
+
+            content = batch_result.to_dict()
+            content["analyzer"] = analyzer
+            content["analyzer_version"] = analyzer_version
+            output_file.write(json.dumps(content, cls=SafeJSONEncoder) + "\n")
+            output_file.flush()
+
+    _LOG.info("Extracted %d images, %d failed", len(images) - failed, failed)
+    return failed
+
+
+def _extraction_options(func):
+    """Add options configuring extraction to a command."""
+    for option in reversed(_EXTRACTION_OPTIONS):
+        func = option(func)
+    return func
+
+
+def _create_caches(cache_dir, layer_cache_size):
+    """Create layer, blob, analysis and symbol caches stored in the given directory, no caches are used if not set."""
+    if not cache_dir:
+        return {}
+
+    return {
+        "layer_cache": LayerCache(
+            os.path.join(cache_dir, "layers"), max_size=layer_cache_size
+        ),
+        "blob_cache": BlobCache(os.path.join(cache_dir, "blobs")),
+        # Results are kept per analyzer version as they can change across releases.
+        "analysis_cache": AnalysisCache(
+            os.path.join(cache_dir, "analysis", analyzer_version)
+        ),
+        "symbol_cache": SymbolCache(
+            os.path.join(cache_dir, "symbols", analyzer_version)
+        ),
+    }
+
+
 def _print_version(ctx, _, value):
     """Print version information and exit."""
     if not value or ctx.resilient_parsing:
@@ -85,10 +225,27 @@ def cli(ctx=None, verbose: bool = False, metadata: str = None):
     "--image",
     "-i",
     type=str,
-    required=True,
+    required=False,
     envvar="THOTH_ANALYZED_IMAGE",
     help="Image name from which packages should be extracted.",
 )
+@click.option(
+    "--images-file",
+    type=click.File("r"),
+    envvar="THOTH_PACKAGE_EXTRACT_IMAGES_FILE",
+    default=None,
+    help="A file with image names to extract packages from, one per line ('-' for standard input); "
+    "results are written as newline delimited JSON as images are extracted. Blobs shared by images are "
+    "downloaded once only with --native-registry, skopeo downloads all blobs of each image.",
+)
+@click.option(
+    "--parallelism",
+    type=int,
+    envvar="THOTH_PACKAGE_EXTRACT_PARALLELISM",
+    default=1,
+    show_default=True,
+    help="Number of images from the images file extracted concurrently.",
+)
 @click.option(
     "--registry-credentials",
     "-c",
@@ -107,8 +264,8 @@ def cli(ctx=None, verbose: bool = False, metadata: str = None):
     default=None,
     show_default=True,
     envvar="THOTH_ANALYZER_TIMEOUT",
-    help="Soft timeout for extraction - timeout is set to commands run, the actual execution time of "
-    "this tool will be bigger.",
+    help="Soft timeout for extraction - timeout is set to commands and analyzers run, the actual execution "
+    "time of this tool will be bigger.",
 )
 @click.option(
     "--output",
@@ -124,22 +281,122 @@ def cli(ctx=None, verbose: bool = False, metadata: str = None):
     envvar="THOTH_ANALYZER_NO_TLS_VERIFY",
     help="Do not verify TLS certificates of registry from which the image is pulled from.",
 )
+@click.option(
+    "--plain-http",
+    is_flag=True,
+    envvar="THOTH_PACKAGE_EXTRACT_PLAIN_HTTP",
+    help="Access registry over plain HTTP instead of HTTPS.",
+)
+@_extraction_options
+@click.option(
+    "--analyzers",
+    type=str,
+    envvar="THOTH_PACKAGE_EXTRACT_ANALYZERS",
+    default=None,
+    callback=_split_names,
+    help="A comma separated list of analyzers to run, all registered analyzers are run by default.",
+)
+@click.option(
+    "--skip",
+    type=str,
+    envvar="THOTH_PACKAGE_EXTRACT_SKIP",
+    default=None,
+    callback=_split_names,
+    help="A comma separated list of analyzers not to run.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    envvar="THOTH_PACKAGE_EXTRACT_PROFILE",
+    help="Report time, memory and subprocesses used by phases of extraction in the profile section.",
+)
 def cli_extract_image(
     click_ctx,
-    image,
+    image=None,
+    images_file=None,
+    parallelism=1,
     timeout=None,
     no_pretty=False,
     output=None,
     registry_credentials=None,
     no_tls_verify=False,
+    plain_http=False,
+    cache_dir=None,
+    layer_cache_size=None,
+    extraction_workers=None,
+    selective_extraction=False,
+    analyzer_workers=None,
+    native_registry=False,
+    download_workers=None,
+    virtual_rootfs=False,
+    analyzers=None,
+    skip=None,
+    profile=False,
 ):
-    """Extract installed packages from an image."""
+    """Extract installed packages from an image or from images listed in a file."""
+    if (image is None) == (images_file is None):
+        raise click.UsageError(
+            "Exactly one of --image and --images-file has to be stated"
+        )
+
+    if analyzers is not None or skip is not None:
+        try:
+            analyzers = [a.name for a in get_analyzers(analyzers, skip or ())]
+        except NotSupported as exc:
+            raise click.BadParameter(str(exc), param_hint="'--analyzers' / '--skip'")
+
+    if images_file is not None:
+        if output and output.startswith(("http://", "https://")):
+            raise click.BadParameter(
+                "Results of multiple images can be written only to a file or standard output",
+                param_hint="'--output'",
+            )
+
+        with contextlib.ExitStack() as stack:
+            if not cache_dir:
+                # Layers shared by images are extracted once for the whole batch.
+                cache_dir = stack.enter_context(
+                    tempfile.TemporaryDirectory(prefix="thoth-package-extract-")
+                )
+
+            failed = _extract_images(
+                read_image_list(images_file),
+                output or "-",
+                parallelism=parallelism,
+                timeout=timeout,
+                registry_credentials=registry_credentials,
+                tls_verify=not no_tls_verify,
+                plain_http=plain_http,
+                extraction_workers=extraction_workers,
+                selective_extraction=selective_extraction,
+                analyzer_workers=analyzer_workers,
+                native_registry=native_registry,
+                download_workers=download_workers,
+                virtual_rootfs=virtual_rootfs,
+                analyzers=analyzers,
+                include_profile=profile,
+                **_create_caches(cache_dir, layer_cache_size),
+            )
+        # Metrics are pushed in the background, they would be lost on exit.
+        wait_for_pushes()
+        click_ctx.exit(1 if failed else 0)
+
     start_time = time.monotonic()
     result = extract_image(
         image,
         timeout,
         registry_credentials=registry_credentials,
         tls_verify=not no_tls_verify,
+        plain_http=plain_http,
+        extraction_workers=extraction_workers,
+        selective_extraction=selective_extraction,
+        analyzer_workers=analyzer_workers,
+        native_registry=native_registry,
+        download_workers=download_workers,
+        virtual_rootfs=virtual_rootfs,
+        analyzers=analyzers,
+        include_profile=profile,
+        **_create_caches(cache_dir, layer_cache_size),
     )
     print_command_result(
         click_ctx,
@@ -150,6 +407,87 @@ def cli_extract_image(
         duration=time.monotonic() - start_time,
         pretty=not no_pretty,
     )
+    wait_for_pushes()
+
+
+@cli.command("serve")
+@click.option(
+    "--host",
+    type=str,
+    envvar="THOTH_PACKAGE_EXTRACT_HOST",
+    default="127.0.0.1",
+    show_default=True,
+    help="Address to listen on for extraction jobs.",
+)
+@click.option(
+    "--port",
+    type=int,
+    envvar="THOTH_PACKAGE_EXTRACT_PORT",
+    default=8080,
+    show_default=True,
+    help="Port to listen on for extraction jobs.",
+)
+@click.option(
+    "--unix-socket",
+    type=str,
+    envvar="THOTH_PACKAGE_EXTRACT_UNIX_SOCKET",
+    default=None,
+    help="Listen on the given Unix socket instead of the TCP port.",
+)
+@click.option(
+    "--workers",
+    type=int,
+    envvar="THOTH_PACKAGE_EXTRACT_WORKERS",
+    default=1,
+    show_default=True,
+    help="Number of extraction jobs run concurrently.",
+)
+@click.option(
+    "--max-pending",
+    type=int,
+    envvar="THOTH_PACKAGE_EXTRACT_MAX_PENDING",
+    default=100,
+    show_default=True,
+    help="Maximum number of jobs waiting for a worker, further jobs are rejected.",
+)
+@_extraction_options
+def cli_serve(
+    host,
+    port,
+    unix_socket=None,
+    workers=1,
+    max_pending=100,
+    cache_dir=None,
+    layer_cache_size=None,
+    extraction_workers=None,
+    selective_extraction=False,
+    analyzer_workers=None,
+    native_registry=False,
+    download_workers=None,
+    virtual_rootfs=False,
+):
+    """Serve extraction jobs over HTTP, caches are shared by all jobs."""
+    with contextlib.ExitStack() as stack:
+        if not cache_dir:
+            # Caches are kept for the lifetime of the service if no cache directory is configured.
+            cache_dir = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="thoth-package-extract-")
+            )
+
+        job_queue = JobQueue(
+            workers=workers,
+            max_pending=max_pending,
+            **_create_caches(cache_dir, layer_cache_size),
+            extraction_workers=extraction_workers,
+            selective_extraction=selective_extraction,
+            analyzer_workers=analyzer_workers,
+            native_registry=native_registry,
+            download_workers=download_workers,
+            virtual_rootfs=virtual_rootfs,
+        )
+        serve(job_queue, host=host, port=port, unix_socket=unix_socket)
+
+    wait_for_pushes()
 
 
 if __name__ == "__main__":
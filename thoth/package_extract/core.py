@@ -17,18 +17,38 @@
 
 """Implementation of core routines for thoth-package-extract."""
 
+import contextlib
+import functools
 import logging
 import os
 import tempfile
+import time
 import typing
 from shlex import quote
 
-from prometheus_client import CollectorRegistry, pushadd_to_gateway, Gauge
-
+from .cache import AnalysisCache
+from .cache import BlobCache
+from .cache import LayerCache
+from .cache import SymbolCache
 from .image import construct_rootfs
+from .image import construct_virtual_rootfs
 from .image import download_image
+from .image import get_extraction_filter
+from .image import get_image_layers
 from .image import run_analyzers
 from .image import get_image_size
+from .image import is_layer_cached
+from .image import needs_directory
+from .image import needs_file_digests
+from .image import needs_rootfs
+from .image import select_layer_results
+from .layers import LayerChanges
+from .metrics import record_job
+from .metrics import push_metrics
+from .profiling import collect_profile
+from .profiling import count
+from .profiling import profile_phase
+from .registry import pull_image
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -39,50 +59,168 @@ def extract_image(
     *,
     registry_credentials: typing.Optional[str] = None,
     tls_verify: bool = True,
+    layer_cache: typing.Optional[LayerCache] = None,
+    analysis_cache: typing.Optional[AnalysisCache] = None,
+    blob_cache: typing.Optional[BlobCache] = None,
+    extraction_workers: typing.Optional[int] = None,
+    selective_extraction: bool = False,
+    symbol_cache: typing.Optional[SymbolCache] = None,
+    analyzer_workers: typing.Optional[int] = None,
+    analyzers: typing.Optional[typing.Iterable[str]] = None,
+    include_profile: bool = False,
+    native_registry: bool = False,
+    download_workers: typing.Optional[int] = None,
+    plain_http: bool = False,
+    virtual_rootfs: bool = False,
 ) -> dict:
-    """Extract dependencies from an image."""
-    # Setting up the prometheus registry and the Gauge metric
-    prometheus_registry = CollectorRegistry()
-    metric_analyzer_job = Gauge(
-        "package_extract_time",
-        "Runtime of package extract job",
-        registry=prometheus_registry,
-    )
-
-    # Begins a timer to record the running time of the job
-    with metric_analyzer_job.time(), tempfile.TemporaryDirectory() as dir_path:
-        image_name = quote(image_name)
-        download_image(
-            image_name,
-            dir_path,
-            timeout=timeout or None,
-            registry_credentials=registry_credentials or None,
-            tls_verify=tls_verify,
-        )
-        image_size = get_image_size(dir_path)
+    """Extract dependencies from an image.
+
+    Extracted layers are reused from the layer cache if provided. If the analysis cache is provided and the
+    stack of image layers was analyzed previously, the root filesystem is not constructed at all. If only
+    lower layers were analyzed previously, just changes done by upper layers are analyzed. In the selective
+    extraction mode, only files needed by analyzers are materialized in the root filesystem. Symbols of
+    shared objects seen previously are taken from the symbol cache if provided. Analyzers are run
+    concurrently by the given number of workers, each of them is given the timeout, analyzers not finishing
+    in time are reported in the errors section. If analyzers are stated, only they are run (only files they
+    need are extracted in the selective extraction mode), rootfs is not constructed if none of them needs it.
+    Resources used by phases of extraction (see profiling) are reported in the profile section if requested.
+    Images are pulled by skopeo unless the native registry client is requested, the client downloads blobs
+    concurrently by the given number of workers, skips layers found in the layer cache and shares blobs
+    with other jobs through the blob cache if provided (skopeo downloads all blobs). Registries are
+    accessed over plain HTTP if requested. With virtual rootfs, layers are indexed instead of extracted and
+    analyzers query the index, only files needed by analyzers which need a real directory are materialized.
+    """
+    if analyzers is not None:
+        analyzers = list(analyzers)
+
+    start_time = time.monotonic()
+    with collect_profile() as profile, tempfile.TemporaryDirectory() as dir_path, contextlib.ExitStack() as stack:
+        if layer_cache is not None:
+            # Layers used by this job are pinned, so concurrent jobs sharing the cache do not evict them.
+            layer_cache = stack.enter_context(layer_cache.leased())
+
+        with profile_phase("download"):
+            if native_registry:
+                pull_image(
+                    image_name,
+                    dir_path,
+                    registry_credentials=registry_credentials or None,
+                    tls_verify=tls_verify,
+                    plain_http=plain_http,
+                    timeout=timeout or None,
+                    workers=download_workers,
+                    skip_layer=functools.partial(is_layer_cached, layer_cache)
+                    if layer_cache is not None
+                    else None,
+                    blob_cache=blob_cache,
+                )
+            else:
+                download_image(
+                    quote(image_name),
+                    dir_path,
+                    timeout=timeout or None,
+                    registry_credentials=registry_credentials or None,
+                    tls_verify=tls_verify and not plain_http,
+                )
         rootfs_path = os.path.join(dir_path, "rootfs")
-        layers = construct_rootfs(dir_path, rootfs_path)
+        layers = get_image_layers(dir_path)
+
+        cached_prefix, cached_results = 0, None
+        if analysis_cache is not None:
+            cached_prefix, cached_results = analysis_cache.get_longest_prefix(layers)
+
+        if cached_prefix == len(layers):
+            # Only analyzers with no results cached for the whole stack of layers need rootfs.
+            build_rootfs = needs_rootfs(analyzers, cached_results)
+        else:
+            build_rootfs = needs_rootfs(analyzers)
+
+        changes = None
+        file_digests = None
+        rootfs = None
+        path_filter = None
+        layer_changes: typing.List[LayerChanges] = []
+        if build_rootfs:
+            hash_files = needs_file_digests(analyzers)
+            with profile_phase("construct-rootfs"):
+                if virtual_rootfs:
+                    rootfs = construct_virtual_rootfs(
+                        dir_path,
+                        layer_cache=layer_cache,
+                        layer_changes=layer_changes,
+                        workers=extraction_workers,
+                        hash_files=hash_files,
+                    )
+                    if needs_directory(analyzers):
+                        path_filter = get_extraction_filter(
+                            analyzers, skip_virtual=True
+                        )
+                        count(
+                            "extracted_bytes",
+                            rootfs.materialize(rootfs_path, path_filter),
+                        )
+                else:
+                    if selective_extraction:
+                        path_filter = get_extraction_filter(analyzers)
+                    construct_rootfs(
+                        dir_path,
+                        rootfs_path,
+                        layer_cache=layer_cache,
+                        layer_changes=layer_changes,
+                        workers=extraction_workers,
+                        path_filter=path_filter,
+                        hash_files=hash_files,
+                    )
+            if hash_files:
+                file_digests = LayerChanges.merge(layer_changes).digests
+            if cached_results is not None and cached_prefix < len(layers):
+                _LOGGER.debug(
+                    "Analyzing changes done by %d layers on top of %d analyzed layers",
+                    len(layers) - cached_prefix,
+                    cached_prefix,
+                )
+                changes = LayerChanges.merge(layer_changes[cached_prefix:])
+
+        # Uncompressed sizes of layers are recorded when layers are decompressed to construct rootfs.
+        image_size = get_image_size(dir_path, layer_cache, layer_changes)
+        if not native_registry and image_size["compressed"] is not None:
+            count("downloaded_bytes", image_size["compressed"])
+
+        result = run_analyzers(
+            rootfs_path,
+            timeout=timeout,
+            analyzers=analyzers,
+            cached_results=cached_results,
+            changes=changes,
+            file_digests=file_digests,
+            symbol_cache=symbol_cache,
+            workers=analyzer_workers,
+            rootfs=rootfs,
+        )
+        # Analyzers which did not finish in time have no results, nothing is stored for them.
+        errors = result.pop("errors", None)
+        # Analyzers which read a directory with just a subset of files materialized could miss files not
+        # stated in their paths, their results are not stored so they are never reused by full runs.
+        if (
+            analysis_cache is not None
+            and build_rootfs
+            and (path_filter is None or virtual_rootfs)
+        ):
+            layer_results = select_layer_results(
+                result, virtual_only=path_filter is not None
+            )
+            if cached_prefix == len(layers):
+                # Results of analyzers not run this time are kept.
+                layer_results = {**cached_results, **layer_results}
+            analysis_cache.store(layers, layer_results)
 
-        result = run_analyzers(rootfs_path)
         result["layers"] = layers
         result["image_size"] = image_size
+        if errors:
+            result["errors"] = errors
 
-    _push_gateway_host = os.getenv("PROMETHEUS_PUSHGATEWAY_HOST")
-    _push_gateway_port = os.getenv("PROMETHEUS_PUSHGATEWAY_PORT")
-    if _push_gateway_host and _push_gateway_port:
-        try:
-            push_gateway = f"{_push_gateway_host:_push_gateway_port}"
-            _LOGGER.debug(
-                f"Submitting metrics to Prometheus push gateway {push_gateway}"
-            )
-            pushadd_to_gateway(
-                push_gateway,
-                job="package-extract-runtime",
-                registry=prometheus_registry,
-            )
-        except Exception as e:
-            _LOGGER.exception(
-                "An error occurred pushing the metrics: {}".format(str(e))
-            )
+    push_metrics(record_job(profile, time.monotonic() - start_time))
+    if include_profile:
+        result["profile"] = profile.to_dict()
 
     return result
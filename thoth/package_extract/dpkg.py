@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A reader of the dpkg status database found in container images."""
+
+import logging
+import os
+from typing import Dict
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from .layers import get_real_relative_path
+
+_LOGGER = logging.getLogger(__name__)
+
+_DPKG_STATUS_PATH = "var/lib/dpkg/status"
+# Used by distroless images with no dpkg, a file per package.
+_DPKG_STATUS_DIR_PATH = "var/lib/dpkg/status.d"
+_INSTALLED_STATUS = "install ok installed"
+
+
+def parse_control(lines: Iterable[str]) -> Generator[Dict[str, str], None, None]:
+    """Parse stanzas of a control file (such as dpkg status), continuation lines are joined by a new line."""
+    stanza: Dict[str, str] = {}
+    field = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            if stanza:
+                yield stanza
+            stanza, field = {}, None
+        elif line[0] in " \t":
+            if field is not None:
+                stanza[field] += "\n" + line[1:]
+        elif ":" in line:
+            field, value = line.split(":", maxsplit=1)
+            stanza[field] = value.strip()
+        else:
+            _LOGGER.warning("Skipping malformed line in control file: %r", line)
+
+    if stanza:
+        yield stanza
+
+
+def _read_control_file(file_path: str) -> List[Dict[str, str]]:
+    """Read all stanzas stated in a control file."""
+    with open(file_path, encoding="utf-8", errors="replace") as control_file:
+        return list(parse_control(control_file))
+
+
+def read_dpkg_status(path: str) -> Optional[List[Dict[str, str]]]:
+    """Read stanzas of packages installed in the given rootfs, return None if no dpkg status database is present."""
+    found = False
+    stanzas = []
+
+    status_path = get_real_relative_path(path, _DPKG_STATUS_PATH)
+    if status_path is not None and os.path.isfile(os.path.join(path, status_path)):
+        found = True
+        stanzas.extend(_read_control_file(os.path.join(path, status_path)))
+
+    status_dir_path = get_real_relative_path(path, _DPKG_STATUS_DIR_PATH)
+    if status_dir_path is not None and os.path.isdir(
+        os.path.join(path, status_dir_path)
+    ):
+        found = True
+        for file_name in sorted(os.listdir(os.path.join(path, status_dir_path))):
+            file_path = os.path.join(path, status_dir_path, file_name)
+            if os.path.isfile(file_path):
+                # Packages listed in status.d are installed, the status is not always stated.
+                for stanza in _read_control_file(file_path):
+                    stanza.setdefault("Status", _INSTALLED_STATUS)
+                    stanzas.append(stanza)
+
+    if not found:
+        return None
+
+    return [
+        stanza
+        for stanza in stanzas
+        if stanza.get("Status") == _INSTALLED_STATUS and "Package" in stanza
+    ]
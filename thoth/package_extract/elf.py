@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A minimal reader of ELF files for gathering version symbols exported by shared objects and linking information."""
+
+import mmap
+import struct
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+from .exceptions import ThothPkgdepsException
+
+_ELF_MAGIC = b"\x7fELF"
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+
+_SHT_DYNAMIC = 6
+_SHT_DYNSYM = 11
+_SHT_GNU_VERDEF = 0x6FFFFFFD
+_SHN_ABS = 0xFFF1
+_STB_GLOBAL = 1
+_STT_GNU_IFUNC = 10
+_VER_FLG_BASE = 0x1
+
+_DT_NULL = 0
+_DT_NEEDED = 1
+_DT_RPATH = 15
+_DT_RUNPATH = 29
+
+
+class ELFError(ThothPkgdepsException):  # noqa: N818
+    """Raised on a malformed ELF file."""
+
+
+class _ELFFile:
+    """Access to sections of a memory mapped (or read) ELF file."""
+
+    def __init__(self, data: Union[bytes, mmap.mmap]) -> None:
+        """Parse ELF header and section headers of the given ELF file content."""
+        self.data = data
+        if len(data) < 16:
+            raise ELFError("Truncated ELF identification")
+
+        elf_class, elf_data = data[4], data[5]
+        if elf_data == _ELFDATA2LSB:
+            byte_order = "<"
+        elif elf_data == _ELFDATA2MSB:
+            byte_order = ">"
+        else:
+            raise ELFError(f"Unknown ELF data encoding {elf_data}")
+
+        if elf_class == _ELFCLASS32:
+            self.is_64 = False
+            header_format = "HHIIIIIHHHHHH"
+            self._section_format = byte_order + "IIIIIIIIII"
+        elif elf_class == _ELFCLASS64:
+            self.is_64 = True
+            header_format = "HHIQQQIHHHHHH"
+            self._section_format = byte_order + "IIQQQQIIQQ"
+        else:
+            raise ELFError(f"Unknown ELF class {elf_class}")
+
+        self._byte_order = byte_order
+        header = self.unpack(byte_order + header_format, 16)
+        section_offset, entry_size, section_count = header[5], header[10], header[11]
+        self._names_idx = header[12]
+
+        self.sections: List[Tuple[int, ...]] = []
+        for idx in range(section_count):
+            self.sections.append(
+                self.unpack(self._section_format, section_offset + idx * entry_size)
+            )
+
+    def unpack(self, format_: str, offset: int) -> Tuple[int, ...]:
+        """Unpack a structure stored at the given offset."""
+        try:
+            return struct.unpack_from(format_, self.data, offset)
+        except struct.error as exc:
+            raise ELFError(f"Truncated ELF file: {str(exc)}") from exc
+
+    def get_string(self, section_idx: int, offset: int) -> str:
+        """Get a NUL terminated string from the given string table section."""
+        if section_idx >= len(self.sections):
+            raise ELFError(f"No string table section {section_idx}")
+
+        start = self.sections[section_idx][4] + offset
+        end = self.data.find(b"\0", start)
+        if end == -1:
+            raise ELFError("Unterminated string in string table")
+
+        return self.data[start:end].decode("utf-8", errors="replace")
+
+    def get_section(self, name: str) -> Optional[bytes]:
+        """Get content of the named section, return None if there is no such section."""
+        for section in self.sections:
+            if self.get_string(self._names_idx, section[0]) == name:
+                return bytes(self.data[section[4] : section[4] + section[5]])
+
+        return None
+
+    def get_dynamic_entries(self) -> List[Tuple[int, str]]:
+        """Get tags and values of entries in the dynamic section referring to strings (needed libraries, paths)."""
+        if self.is_64:
+            entry_format = self._byte_order + "qQ"
+        else:
+            entry_format = self._byte_order + "iI"
+
+        result = []
+        for section in self.sections:
+            if section[1] != _SHT_DYNAMIC:
+                continue
+
+            offset, size, link = section[4], section[5], section[6]
+            entry_size = struct.calcsize(entry_format)
+            for idx in range(size // entry_size):
+                tag, value = self.unpack(entry_format, offset + idx * entry_size)
+                if tag == _DT_NULL:
+                    break
+                if tag in (_DT_NEEDED, _DT_RPATH, _DT_RUNPATH):
+                    result.append((tag, self.get_string(link, value)))
+
+        return result
+
+    def get_absolute_symbols(self) -> Set[str]:
+        """Get names of global absolute symbols with value aligned to 16 bytes from the dynamic symbol table."""
+        if self.is_64:
+            symbol_format = self._byte_order + "IBBHQQ"
+        else:
+            symbol_format = self._byte_order + "IIIBBH"
+
+        result = set()
+        for section in self.sections:
+            if section[1] != _SHT_DYNSYM:
+                continue
+
+            offset, size, link, entry_size = (
+                section[4],
+                section[5],
+                section[6],
+                section[9],
+            )
+            if not entry_size:
+                raise ELFError("Dynamic symbol table with zero entry size")
+
+            for idx in range(size // entry_size):
+                symbol = self.unpack(symbol_format, offset + idx * entry_size)
+                if self.is_64:
+                    name, info, _, shndx, value, _ = symbol
+                else:
+                    name, value, _, info, _, shndx = symbol
+
+                if (
+                    shndx == _SHN_ABS
+                    and info >> 4 == _STB_GLOBAL
+                    and info & 0xF != _STT_GNU_IFUNC
+                    and value & 0xF == 0
+                ):
+                    result.add(self.get_string(link, name))
+
+        return result
+
+    def get_version_definitions(self) -> Set[str]:
+        """Get names of versions defined by the ELF file, the base definition (soname) is not included."""
+        result = set()
+        for section in self.sections:
+            if section[1] != _SHT_GNU_VERDEF:
+                continue
+
+            offset, link, count = section[4], section[6], section[7]
+            for _ in range(count):
+                _, flags, _, aux_count, _, aux_offset, next_offset = self.unpack(
+                    self._byte_order + "HHHHIII", offset
+                )
+                if aux_count and not flags & _VER_FLG_BASE:
+                    name = self.unpack(self._byte_order + "I", offset + aux_offset)[0]
+                    result.add(self.get_string(link, name))
+
+                if not next_offset:
+                    break
+                offset += next_offset
+
+        return result
+
+
+def get_version_symbols(file_path: str) -> Optional[Set[str]]:
+    """Get version symbols exported by the given shared object, return None if the file is not an ELF file.
+
+    Version symbols are global absolute symbols stated in the dynamic symbol table (as listed by
+    `nm -D' with type 'A') together with version definitions stated in the version definition section.
+    """
+    with open(file_path, "rb") as elf_file:
+        if elf_file.read(len(_ELF_MAGIC)) != _ELF_MAGIC:
+            return None
+
+        with mmap.mmap(elf_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            elf = _ELFFile(data)
+            return elf.get_absolute_symbols() | elf.get_version_definitions()
+
+
+def get_linking_info(data: bytes) -> Optional[Tuple[List[str], List[str]]]:
+    """Get libraries needed by the given ELF file and paths stated to search them in, return None if not an ELF file.
+
+    Paths are taken from RUNPATH, or RPATH if no RUNPATH is stated, as the dynamic linker does.
+    """
+    if not data.startswith(_ELF_MAGIC):
+        return None
+
+    entries = _ELFFile(data).get_dynamic_entries()
+    needed = [value for tag, value in entries if tag == _DT_NEEDED]
+    search_paths = [value for tag, value in entries if tag == _DT_RUNPATH]
+    if not search_paths:
+        search_paths = [value for tag, value in entries if tag == _DT_RPATH]
+
+    return needed, [path for value in search_paths for path in value.split(":") if path]
+
+
+def get_read_only_data(data: bytes) -> Optional[bytes]:
+    """Get content of the read-only data section of the given ELF file, return None if not an ELF file.
+
+    The whole file is returned if the file states no read-only data section (e.g. section headers are stripped).
+    """
+    if not data.startswith(_ELF_MAGIC):
+        return None
+
+    rodata = _ELFFile(data).get_section(".rodata")
+    return rodata if rodata is not None else data
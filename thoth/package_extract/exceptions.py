@@ -32,3 +32,7 @@ class NotSupported(ThothPkgdepsException):  # noqa: N818
 
 class TimeoutExpired(ThothPkgdepsException):  # noqa: N818
     """Raised on command timeout."""
+
+
+class CommandError(ThothPkgdepsException):  # noqa: N818
+    """Raised if a command run exited with non-zero status code."""
@@ -17,32 +17,69 @@
 
 """Manipulation with an image and image scanning."""
 
+import concurrent.futures
+import contextvars
+import copy
+import functools
+import gzip
 import json
 import logging
 import os
+import shutil
 import tarfile
+import tempfile
 import typing
 import stat
 from shlex import quote
 import hashlib
-from pathlib import Path
 import glob
 from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Tuple
 from typing import Generator
+from typing import Iterable
 from typing import Optional
+from typing import Set
 from collections import deque
 
 import toml
 from thoth.analyzer import run_command
-from thoth.common import cwd
-from pip._internal.operations.freeze import freeze
 
+from .analyzers import Analyzer
+from .analyzers import AnalyzerContext
+from .analyzers import get_analyzer
+from .analyzers import get_analyzers
+from .analyzers import register_analyzer
+from .analyzers import resolve_dependencies
+from .cache import LayerCache
+from .cache import SymbolCache
+from .dpkg import parse_control
+from .dpkg import read_dpkg_status
+from .elf import ELFError
+from .elf import get_version_symbols
 from .exceptions import InvalidImageError
 from .exceptions import NotSupported
+from .exceptions import TimeoutExpired
+from .layers import LayerChanges
+from .layers import compile_path_patterns
+from .layers import get_real_relative_path
+from .layers import is_whiteout
+from .layers import normalize_member_name
+from .profiling import count
+from .profiling import profile_phase
+from .pydist import LIBRARY_DIRECTORIES
+from .pydist import read_distributions
+from .pyinterp import get_python_version
+from .rpmdb import RpmDBError
+from .rpmdb import read_rpmdb
 from .rpmlib import parse_nvra
+from .scan import scan
+from .scheduler import Task
+from .scheduler import run_task_command
+from .scheduler import run_tasks
+from .vfs import VirtualRootfs
 
 _LOGGER = logging.getLogger(__name__)
 _HERE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -50,6 +87,33 @@ _SKOPEO_EXEC_PATH = os.getenv(
     "SKOPEO_EXEC_PATH", os.path.join(_HERE_DIR, "bin", "skopeo")
 )
 _MAX_SYMLINKS = 50
+_GZIP_MAGIC = b"\x1f\x8b"
+_COPY_BUFFER_SIZE = 1024 * 1024
+_LD_CONFIG_PATHS = ("etc/ld.so.conf", "etc/ld.so.conf.d/**")
+# Keys in deb-dependencies entries and control fields they are parsed from.
+_DEB_DEPENDENCY_FIELDS = {
+    "pre-depends": "Pre-Depends",
+    "depends": "Depends",
+    "replaces": "Replaces",
+}
+# Commands are run by shell, the whole command is a single argument limited to 128 KiB on Linux.
+_APT_CACHE_MAX_ARGS_LENGTH = 64 * 1024
+# Shared objects in library directories and directories commonly stated in ld.so.conf.
+_SHARED_OBJECT_PATHS = (
+    "lib/*.so*",
+    "lib/*/*.so*",
+    "lib32/*.so*",
+    "lib64/*.so*",
+    "usr/lib/*.so*",
+    "usr/lib/*/*.so*",
+    "usr/lib32/*.so*",
+    "usr/lib64/*.so*",
+    "usr/lib64/*/*.so*",
+    "usr/local/lib*/*.so*",
+    "usr/local/*/lib*/*.so*",
+)
+# Files which digests are computed when extracting layers, see LayerChanges.
+_HASHED_PATHS = compile_path_patterns(("**.py", "**.so", "**.so.*"))
 
 
 def _parse_repoquery(output: str) -> dict:
@@ -87,7 +151,7 @@ def _parse_repoquery(output: str) -> dict:
 def _run_rpm_repoquery(path: str, timeout: int = None) -> list:
     """Run repoquery and return it's output (parsed)."""
     cmd = "repoquery --deplist --installed --installroot {!r}".format(path)
-    output = _parse_repoquery(run_command(cmd, timeout=timeout).stdout)
+    output = _parse_repoquery(run_task_command(cmd, timeout=timeout).stdout)
 
     result = []
     for package_identifier, dependencies in output.items():
@@ -104,13 +168,59 @@ def _run_rpm_repoquery(path: str, timeout: int = None) -> list:
 def _run_rpm(path: str, timeout: int = None) -> typing.List[str]:
     """Query for installed rpm packages in the given root described by path."""
     cmd = "rpm -qa --root {!r}".format(path)
-    output = run_command(cmd, timeout=timeout).stdout
+    output = run_task_command(cmd, timeout=timeout).stdout
     packages = output.split("\n")
     if not packages[-1]:
         packages.pop()
     return packages
 
 
+def _gather_rpm_packages(
+    path: str, timeout: int = None
+) -> Tuple[typing.List[str], typing.List[dict]]:
+    """Gather installed rpm packages and their dependencies, results of `rpm -qa' and `repoquery --deplist'.
+
+    The rpm database is read directly, commands are run only if the database cannot be parsed.
+    """
+    try:
+        packages = read_rpmdb(path)
+    except RpmDBError as exc:
+        _LOGGER.warning(
+            "Failed to read rpm database, falling back to rpm and repoquery: %s",
+            str(exc),
+        )
+        return _run_rpm(path, timeout=timeout), _run_rpm_repoquery(
+            path, timeout=timeout
+        )
+
+    if packages is None:
+        _LOGGER.debug("No rpm database found")
+        return [], []
+
+    dependencies = []
+    for package in sorted(
+        packages, key=lambda package: (package.name, package.package_identifier)
+    ):
+        # Public keys imported into rpmdb are not packages.
+        if package.name == "gpg-pubkey":
+            continue
+
+        dependencies.append(
+            {
+                "name": package.name,
+                "version": package.version,
+                "release": package.release,
+                "epoch": str(package.epoch) if package.epoch else None,
+                "arch": package.arch,
+                "src": package.arch == "src",
+                "dependencies": package.requires,
+                "package_identifier": package.package_identifier,
+            }
+        )
+
+    return [package.nvra for package in packages], dependencies
+
+
 def _run_dpkg_query(path: str, timeout: int = None) -> typing.List[dict]:
     """Query for installed deb packages in the given root."""
     # Make sure dpkg-query exist, give up if not.
@@ -128,7 +238,7 @@ def _run_dpkg_query(path: str, timeout: int = None) -> typing.List[dict]:
     cmd = "fakeroot fakechroot /usr/sbin/chroot {!r} /usr/bin/dpkg-query -l".format(
         path
     )
-    output = run_command(cmd, timeout=timeout).stdout
+    output = run_task_command(cmd, timeout=timeout).stdout
     result = []
     for line in output.split("\n"):
         if not line.startswith("ii "):
@@ -164,33 +274,158 @@ def _parse_deb_dependency_line(
     return result
 
 
-def _gather_python_file_digests(path: str) -> typing.List[dict]:
-    """Calculate checksum for all Python files inside image."""
+def _hash_file(file_path: str, rootfs: Optional[VirtualRootfs] = None) -> str:
+    """Compute SHA-256 digest of the given file, the path is relative to virtual rootfs if stated."""
+    digest = hashlib.sha256()
+    with rootfs.open(file_path) if rootfs is not None else open(
+        file_path, "rb"
+    ) as afile:
+        while True:
+            chunk = afile.read(_COPY_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_files(
+    file_paths: List[str],
+    workers: Optional[int] = None,
+    rootfs: Optional[VirtualRootfs] = None,
+) -> typing.List[str]:
+    """Compute SHA-256 digests of the given files by a pool of workers, digests are returned in the order of files.
+
+    Files are read in chunks, hashlib releases GIL when hashing them so threads are used.
+    """
+    count("hashed_files", len(file_paths))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(file_paths) < 2:
+        return [_hash_file(file_path, rootfs) for file_path in file_paths]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(functools.partial(_hash_file, rootfs=rootfs), file_paths)
+        )
+
+
+def _gather_python_file_digests(
+    rootfs: VirtualRootfs,
+    workers: Optional[int] = None,
+    file_paths: Optional[List[str]] = None,
+) -> typing.List[dict]:
+    """Calculate checksum for all Python files inside image, rootfs is scanned for them if paths are not given."""
+    if file_paths is None:
+        file_paths = scan(rootfs, ("python-files",))["python-files"]
+
+    return [
+        {"filepath": "/" + filepath, "sha256": digest}
+        for filepath, digest in zip(
+            file_paths, _hash_files(file_paths, workers, rootfs)
+        )
+    ]
+
+
+def _resolve_file_digests(
+    rootfs: VirtualRootfs,
+    file_digests: Dict[str, Optional[str]],
+    path_filter: Optional[Callable[[str], bool]] = None,
+) -> Dict[str, str]:
+    """Map digests computed when extracting layers to paths of files in rootfs, optionally filtered.
+
+    Paths stated in layers can go through symlinked directories, files are reported where they are stored.
+    Symlinks are reported with digests of files they point to.
+    """
+    result: Dict[str, str] = {}
+    real_dirs: Dict[str, Optional[str]] = {}
+    for relative_path, digest in file_digests.items():
+        if path_filter is not None and not path_filter(relative_path):
+            continue
+
+        dir_name, base_name = os.path.split(relative_path)
+        if dir_name not in real_dirs:
+            real_dirs[dir_name] = rootfs.resolve(dir_name)
+        real_dir = real_dirs[dir_name]
+        if real_dir is None:
+            continue
+
+        real_path = os.path.join(real_dir, base_name)
+        if real_path in result and real_dir != dir_name:
+            continue
+
+        if digest is None:
+            target_path = rootfs.resolve(real_path)
+            if target_path is None:
+                continue
+
+            digest = file_digests.get(target_path)
+            if digest is None:
+                if not rootfs.isfile(target_path):
+                    continue
+                digest = _hash_file(target_path, rootfs)
+
+        result[real_path] = digest
+
+    return result
+
+
+def _get_python_file_digests(
+    rootfs: VirtualRootfs, file_digests: Dict[str, Optional[str]]
+) -> typing.List[dict]:
+    """Get checksums of Python files present in rootfs based on digests computed when extracting layers."""
+    return [
+        {"filepath": "/" + relative_path, "sha256": digest}
+        for relative_path, digest in sorted(
+            _resolve_file_digests(
+                rootfs, file_digests, lambda file_path: file_path.endswith(".py")
+            ).items()
+        )
+    ]
+
+
+def _update_python_file_digests(
+    rootfs: VirtualRootfs,
+    previous: typing.List[dict],
+    changes: LayerChanges,
+    workers: Optional[int] = None,
+) -> typing.List[dict]:
+    """Update checksums of Python files computed for lower layers based on changes done by upper layers."""
     digests = []
-    for root, dirs, files in os.walk(path):
-        for file_ in files:
-            if file_.endswith(".py"):
-                filepath = os.path.join(root, file_)
-                if os.path.isfile(filepath):
-                    digest = hashlib.sha256()
-                    with open(filepath, "rb") as afile:
-                        digest.update(afile.read())
-                    digests.append(
-                        {
-                            "filepath": filepath[len(path) :],
-                            "sha256": digest.hexdigest(),
-                        }
-                    )
+    to_compute = set()
+    for entry in previous:
+        relative_path = entry["filepath"].lstrip("/")
+        # Symlinks are recomputed as well as their targets could be changed.
+        if changes.is_affected(relative_path) or rootfs.islink(relative_path):
+            to_compute.add(relative_path)
+        else:
+            digests.append(entry)
+
+    for changed_path in changes.changed:
+        if not changed_path.endswith(".py"):
+            continue
+
+        # Paths stated in layers can go through symlinked directories which are not walked when gathering all files.
+        real_dir = rootfs.resolve(os.path.dirname(changed_path))
+        if real_dir is not None:
+            to_compute.add(os.path.join(real_dir, os.path.basename(changed_path)))
+
+    file_paths = [
+        relative_path
+        for relative_path in sorted(to_compute)
+        if rootfs.isfile(relative_path)
+    ]
+    for filepath, digest in zip(file_paths, _hash_files(file_paths, workers, rootfs)):
+        digests.append({"filepath": "/" + filepath, "sha256": digest})
+
+    digests.sort(key=lambda entry: entry["filepath"])
     return digests
 
 
-def _gather_os_info(path: str) -> dict:
+def _gather_os_info(rootfs: VirtualRootfs) -> dict:
     """Gather information about operating system used."""
     result: dict = {}
-    os_release_file = Path(path) / "etc/os-release"
-    if os_release_file.exists():
+    if rootfs.exists("etc/os-release"):
         try:
-            content = os_release_file.read_text()
+            content = rootfs.read_text("etc/os-release")
         except Exception as exc:
             _LOGGER.warning(
                 "Failed to read /etc/os-release file to gather operating system information: %s",
@@ -231,72 +466,199 @@ def _run_apt_cache_show(
     st = os.stat(apt_cache_path)
     os.chmod(apt_cache_path, st.st_mode | stat.S_IEXEC)
 
-    result = []
-    for record in deb_packages:
-        cmd = "fakeroot fakechroot /usr/sbin/chroot {!r} /usr/bin/apt-cache show {}={}".format(
-            path, record["name"], record["version"]
+    # Packages are queried in batches, a stanza is printed for each package found.
+    stanzas = {}
+    for batch in _get_apt_cache_batches(deb_packages):
+        cmd = "fakeroot fakechroot /usr/sbin/chroot {!r} /usr/bin/apt-cache show {}".format(
+            path, " ".join(batch)
         )
+        command_result = run_task_command(cmd, timeout=timeout, raise_on_error=False)
+        if command_result.returncode != 0:
+            _LOGGER.warning(
+                "Failed to obtain information about some of deb packages; stderr: %s",
+                command_result.stderr,
+            )
 
-        # Do not touch original deb query, extend it rather with more info to follow rpm schema.
-        entry = dict(record)
-        parts = entry["version"].split(":", maxsplit=1)
-        if len(parts) == 2:
-            try:
-                # If it parses int, its an epoch probably.
-                int(parts[0])
-                entry["epoch"] = parts[0]
-                entry["version"] = parts[1]
-            except ValueError:
-                entry["epoch"] = None
-
-        output = run_command(cmd, timeout=timeout).stdout
-        entry["pre-depends"], entry["depends"], entry["replaces"] = [], [], []
-        for line in output.splitlines():
-            if line.startswith("Pre-Depends: "):
-                deps = _parse_deb_dependency_line(line[len("Pre-Depends: ") :])
-                entry["pre-depends"] = [{"name": d[0], "version": d[1]} for d in deps]
-            elif line.startswith("Depends: "):
-                deps = _parse_deb_dependency_line(line[len("Depends: ") :])
-                entry["depends"] = [{"name": d[0], "version": d[1]} for d in deps]
-            elif line.startswith("Replaces: "):
-                deps = _parse_deb_dependency_line(line[len("Replaces: ") :])
-                entry["replaces"] = [{"name": d[0], "version": d[1]} for d in deps]
-
-        result.append(entry)
+        for stanza in parse_control(command_result.stdout.splitlines()):
+            key = (
+                stanza.get("Package"),
+                stanza.get("Version"),
+                stanza.get("Architecture"),
+            )
+            stanzas[key] = stanza
+
+    result = []
+    for record in deb_packages:
+        key = (record["name"].split(":")[0], record["version"], record["arch"])
+        if key not in stanzas:
+            _LOGGER.warning(
+                "No information about deb package %r in version %r found",
+                record["name"],
+                record["version"],
+            )
+        result.append(_get_deb_dependencies_entry(record, stanzas.get(key, {})))
 
     return result
 
 
-def _get_lib_dir_symbols(result: dict, container_path: str, path: str) -> None:
-    """Get library symbols from a directory."""
+def _get_apt_cache_batches(
+    deb_packages: typing.List[dict],
+) -> Generator[typing.List[str], None, None]:
+    """Split apt-cache show arguments for the given packages into batches fitting into a single command."""
+    batch: typing.List[str] = []
+    batch_length = 0
+    for record in deb_packages:
+        argument = quote("{}={}".format(record["name"], record["version"]))
+        if batch and batch_length + len(argument) + 1 > _APT_CACHE_MAX_ARGS_LENGTH:
+            yield batch
+            batch, batch_length = [], 0
+
+        batch.append(argument)
+        batch_length += len(argument) + 1
+
+    if batch:
+        yield batch
+
+
+def _get_deb_dependencies_entry(record: dict, fields: Dict[str, str]) -> dict:
+    """Extend a deb package record with epoch and dependencies stated in the given package control fields."""
+    # Do not touch original deb query, extend it rather with more info to follow rpm schema.
+    entry = dict(record)
+    parts = entry["version"].split(":", maxsplit=1)
+    if len(parts) == 2:
+        try:
+            # If it parses int, its an epoch probably.
+            int(parts[0])
+            entry["epoch"] = parts[0]
+            entry["version"] = parts[1]
+        except ValueError:
+            entry["epoch"] = None
+
+    for key, field in _DEB_DEPENDENCY_FIELDS.items():
+        deps = _parse_deb_dependency_line(fields[field]) if field in fields else []
+        entry[key] = [{"name": d[0], "version": d[1]} for d in deps]
+
+    return entry
+
+
+def _gather_deb_packages(
+    path: str, timeout: int = None
+) -> Tuple[typing.List[dict], typing.List[dict]]:
+    """Gather installed deb packages and their dependencies, results of `dpkg-query -l' and `apt-cache show'.
+
+    The dpkg status database is read directly, commands are run in chroot only if the database is not present.
+    """
+    try:
+        stanzas = read_dpkg_status(path)
+    except OSError as exc:
+        _LOGGER.warning("Failed to read dpkg status database: %s", str(exc))
+        stanzas = None
+
+    if stanzas is None:
+        # Commands run in chroot assume binaries in the image are executable on the host architecture.
+        deb_packages = _run_dpkg_query(path, timeout=timeout)
+        return deb_packages, _run_apt_cache_show(path, deb_packages, timeout=timeout)
+
+    deb_packages = []
+    dependencies = []
+    for stanza in sorted(
+        stanzas,
+        key=lambda stanza: (stanza["Package"], stanza.get("Architecture", "")),
+    ):
+        name = stanza["Package"]
+        # Packages co-installable for multiple architectures are listed with architecture qualifier.
+        if stanza.get("Multi-Arch") == "same":
+            name += ":" + stanza.get("Architecture", "")
+
+        record = {
+            "name": name,
+            "version": stanza.get("Version", ""),
+            "arch": stanza.get("Architecture", ""),
+        }
+        deb_packages.append(record)
+        dependencies.append(_get_deb_dependencies_entry(record, stanza))
+
+    return deb_packages, dependencies
+
+
+def _read_version_symbols(path: str, relative_path: str) -> Optional[Set[str]]:
+    """Read version symbols of a shared object stored in rootfs, None is returned for non-ELF files."""
+    return get_version_symbols(os.path.join(path, relative_path))
+
+
+def _get_lib_dir_symbols(
+    result: dict,
+    container_path: str,
+    path: str,
+    reuse: Optional[Callable[[str], Optional[List[str]]]] = None,
+    gathered: Optional[Dict[Tuple[int, int], Optional[Set[str]]]] = None,
+    get_symbols: Optional[Callable[[str], Optional[Set[str]]]] = None,
+) -> None:
+    """Get library symbols from a directory.
+
+    The reuse callback can provide previously gathered symbols for a shared object (path relative to
+    container), None is returned by the callback if symbols need to be gathered. Symbols already gathered
+    for files (keyed by device and inode) are taken from the gathered mapping, so shared objects available
+    under multiple names (symlinks, hardlinks, symlinked directories) are read once. Symbols are gathered
+    by the get_symbols callback (given resolved path relative to container) if provided.
+    """
+    if gathered is None:
+        gathered = {}
+
+    if get_symbols is None:
+        get_symbols = functools.partial(_read_version_symbols, container_path)
+
     path = path[1:] if path.startswith("/") else path
     for so_file_path in glob.glob(os.path.join(container_path, path, "*.so*")):
-        # We grep for '0 A' here because all exported symbols are outputted by nm like:
-        # 00000000 A GLIBC_1.x or:
-        # 0000000000000000 A GLIBC_1.x
-        command = f"nm -D {so_file_path!r} | grep '0 A'"
-
         # Drop path to the extracted container in the output.
-        so_file_path = so_file_path[len(container_path) :]
+        relative_so_file_path = so_file_path[len(container_path) :]
+
+        if reuse is not None:
+            symbols = reuse(relative_so_file_path)
+            if symbols is not None:
+                if symbols:
+                    result.setdefault(relative_so_file_path, set()).update(symbols)
+                continue
 
-        _LOGGER.debug("Gathering symbols from %r", so_file_path)
-        command_result = run_command(command, timeout=120, raise_on_error=False)
-        if command_result.return_code != 0:
+        real_relative_path = get_real_relative_path(
+            container_path, relative_so_file_path.lstrip("/")
+        )
+        if real_relative_path is None:
             _LOGGER.warning(
-                "Failed to obtain library symbols from %r; stderr: %s, stdout: %s",
-                so_file_path,
-                command_result.stderr,
-                command_result.stdout,
+                "Failed to resolve %r, too many levels of symbolic links",
+                relative_so_file_path,
+            )
+            continue
+
+        try:
+            file_stat = os.stat(os.path.join(container_path, real_relative_path))
+        except OSError as exc:
+            _LOGGER.warning(
+                "Failed to obtain library symbols from %r: %s",
+                relative_so_file_path,
+                str(exc),
             )
             continue
 
-        if so_file_path not in result:
-            result[so_file_path] = set()
+        file_key = (file_stat.st_dev, file_stat.st_ino)
+        if file_key not in gathered:
+            _LOGGER.debug("Gathering symbols from %r", relative_so_file_path)
+            try:
+                gathered[file_key] = get_symbols(real_relative_path)
+            except (OSError, ValueError, ELFError) as exc:
+                _LOGGER.warning(
+                    "Failed to obtain library symbols from %r: %s",
+                    relative_so_file_path,
+                    str(exc),
+                )
+                gathered[file_key] = None
+
+            if gathered[file_key] is None:
+                _LOGGER.debug("No symbols gathered from %r", relative_so_file_path)
 
-        for line in command_result.stdout.splitlines():
-            columns = line.split(" ")
-            if len(columns) > 2:
-                result[so_file_path].add(columns[2])
+        symbols = gathered[file_key]
+        if symbols:
+            result.setdefault(relative_so_file_path, set()).update(symbols)
 
 
 def _ld_config_entries(path: str) -> Generator[str, None, None]:
@@ -349,12 +711,18 @@ def _ld_config_entries(path: str) -> Generator[str, None, None]:
             )
 
 
-def _ld_config_symbols(result: dict, path: str) -> None:
+def _ld_config_symbols(
+    result: dict,
+    path: str,
+    reuse: Optional[Callable[[str], Optional[List[str]]]] = None,
+    gathered: Optional[Dict[Tuple[int, int], Optional[Set[str]]]] = None,
+    get_symbols: Optional[Callable[[str], Optional[Set[str]]]] = None,
+) -> None:
     """Gather library symbols based on ld.so.conf."""
     _LOGGER.debug("Gathering symbols based on ld.so.conf file")
     for entry in _ld_config_entries(path):
         try:
-            _get_lib_dir_symbols(result, path, entry)
+            _get_lib_dir_symbols(result, path, entry, reuse, gathered, get_symbols)
         except Exception as exc:
             _LOGGER.warning(
                 "Cannot load symbols from %r (based on ld.so.conf configuration): %s",
@@ -375,51 +743,543 @@ def _ld_env_symbols(result: dict, path: str) -> None:
         _get_lib_dir_symbols(result, path, p[1:])
 
 
-def _get_system_symbols(path: str) -> Dict[str, List[str]]:
-    """Get library symbols found in relevant directories, configuration and environment variables."""
+def _get_previous_symbols(
+    path: str,
+    previous: Dict[str, List[str]],
+    changes: LayerChanges,
+    so_file_path: str,
+) -> Optional[List[str]]:
+    """Get symbols gathered for lower layers if the given shared object was not changed by upper layers."""
+    relative_path = so_file_path.lstrip("/")
+    if changes.is_affected(relative_path):
+        return None
+
+    real_relative_path = get_real_relative_path(path, relative_path)
+    if real_relative_path is None or changes.is_affected(real_relative_path):
+        return None
+
+    # Shared objects not stated in the previous result did not export any symbols.
+    return previous.get(so_file_path, [])
+
+
+def _get_cached_version_symbols(
+    path: str,
+    digests: Dict[str, str],
+    cached_symbols: Dict[str, List[str]],
+    new_symbols: Dict[str, Set[str]],
+    relative_path: str,
+) -> Optional[Set[str]]:
+    """Get version symbols of a shared object from the symbol cache based on its digest, read them if not cached.
+
+    Symbols read from shared objects with known digests are recorded in new_symbols to be stored in the cache.
+    """
+    digest = digests.get(relative_path)
+    if digest is not None and digest in cached_symbols:
+        return set(cached_symbols[digest])
+
+    symbols = _read_version_symbols(path, relative_path)
+    if digest is not None and symbols is not None:
+        new_symbols[digest] = symbols
+
+    return symbols
+
+
+def _get_system_symbols(
+    path: str,
+    previous: Optional[Dict[str, List[str]]] = None,
+    changes: Optional[LayerChanges] = None,
+    file_digests: Optional[Dict[str, Optional[str]]] = None,
+    symbol_cache: Optional[SymbolCache] = None,
+    rootfs: Optional[VirtualRootfs] = None,
+) -> Dict[str, List[str]]:
+    """Get library symbols found in relevant directories, configuration and environment variables.
+
+    If symbols gathered for lower layers are provided together with changes done by upper layers,
+    symbols are gathered only for shared objects changed. If the symbol cache is provided together with
+    digests of files computed when extracting layers, symbols of already seen shared objects are not read.
+    Digests are mapped to shared objects using the virtual rootfs, it is indexed from path if not provided.
+    """
+    reuse = None
+    if (
+        previous is not None
+        and changes is not None
+        and not changes.matches(_LD_CONFIG_PATHS)
+    ):
+        reuse = functools.partial(_get_previous_symbols, path, previous, changes)
+
+    get_symbols = None
+    new_symbols: Dict[str, Set[str]] = {}
+    if symbol_cache is not None and file_digests is not None:
+        digests = _resolve_file_digests(
+            rootfs or VirtualRootfs.from_directory(path),
+            file_digests,
+            lambda file_path: ".so" in os.path.basename(file_path),
+        )
+        get_symbols = functools.partial(
+            _get_cached_version_symbols,
+            path,
+            digests,
+            symbol_cache.get_many(set(digests.values())),
+            new_symbols,
+        )
+
     result: dict = {}
-    _get_lib_dir_symbols(result, path, "usr/lib64")
-    _get_lib_dir_symbols(result, path, "lib64")
-    _get_lib_dir_symbols(result, path, "usr/lib32")
-    _get_lib_dir_symbols(result, path, "lib32")
-    _get_lib_dir_symbols(result, path, "usr/lib")
-    _get_lib_dir_symbols(result, path, "lib")
-    _ld_config_symbols(result, path)
+    # Symbols are gathered once per file, results are shared by all paths pointing to it.
+    gathered: Dict[Tuple[int, int], Optional[Set[str]]] = {}
+    for lib_dir in ("usr/lib64", "lib64", "usr/lib32", "lib32", "usr/lib", "lib"):
+        _get_lib_dir_symbols(result, path, lib_dir, reuse, gathered, get_symbols)
+    _ld_config_symbols(result, path, reuse, gathered, get_symbols)
     # XXX: Commented out as we need to handle environment variables for this during container image extraction.
     # _ld_env_symbols(result, path)
-    # Convert to list as a result, also good for serialization into JSON happening later on.
-    return {path: list(symbols) for path, symbols in result.items()}
 
+    if symbol_cache is not None:
+        symbol_cache.store(new_symbols)
 
-def _get_layer_digest_v1(layer_def: dict):
-    """Get digest of a layer for v1 container image format."""
-    return layer_def["blobSum"].split(":", maxsplit=1)[-1]
+    # Convert to list as a result, also good for serialization into JSON happening later on.
+    return {path: sorted(symbols) for path, symbols in result.items()}
 
 
-def _get_layer_digest_v2(layer_def: dict):
-    """Get digest of a layer for v2 container image format."""
+def _get_layer_digest(layer_def: dict) -> str:
+    """Get digest of a layer as stated in the manifest."""
     return layer_def["digest"].split(":", maxsplit=1)[-1]
 
 
-def construct_rootfs(dir_path: str, rootfs_path: str) -> list:
-    """Construct rootfs in a directory by extracting layers."""
-    os.makedirs(rootfs_path, exist_ok=True)
+def _decompress_layer(layer_blob: str) -> str:
+    """Decompress a gzipped layer tarball into a temporary file next to it, return path to the uncompressed tarball.
+
+    If the layer is not gzipped, path to the layer blob is returned.
+    """
+    with open(layer_blob, "rb") as blob_file:
+        if blob_file.read(len(_GZIP_MAGIC)) != _GZIP_MAGIC:
+            return layer_blob
+
+    fd, layer_tar = tempfile.mkstemp(
+        prefix=os.path.basename(layer_blob) + "-",
+        suffix=".tar",
+        dir=os.path.dirname(layer_blob),
+    )
+    try:
+        with gzip.open(layer_blob, "rb") as gzip_file, os.fdopen(fd, "wb") as tar_file:
+            shutil.copyfileobj(gzip_file, tar_file, _COPY_BUFFER_SIZE)
+    except Exception:
+        os.remove(layer_tar)
+        raise
+
+    return layer_tar
+
+
+def _get_target_path(root_path: str, path: str) -> Optional[str]:
+    """Get path to an entry of rootfs (or an extracted layer tree) on disk, parent directories are resolved in rootfs.
+
+    Symlinks in parent directories are resolved as if rootfs was the root directory, so the returned path never
+    goes through a symlink and never escapes rootfs; the entry itself is not resolved. None is returned if
+    the path cannot be resolved.
+    """
+    parent, name = os.path.split(path)
+    if not name or name in (".", ".."):
+        return None
+
+    real_parent = get_real_relative_path(root_path, parent)
+    if real_parent is None:
+        _LOGGER.warning(
+            "Failed to resolve %r, too many levels of symbolic links", parent
+        )
+        return None
+
+    return os.path.join(root_path, real_parent, name)
+
+
+def _remove_conflicting_path(path: str, is_dir: bool) -> None:
+    """Remove an entry from lower layers which is replaced by an entry in an upper layer."""
+    if not os.path.lexists(path):
+        return
+
+    if is_dir:
+        # Directories are merged with directories (or symlinks to directories) present in lower layers.
+        if not os.path.isdir(path):
+            os.remove(path)
+    elif os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def _apply_whiteouts(rootfs_path: str, changes: LayerChanges) -> None:
+    """Remove entries whited-out by a layer, this needs to be done before the layer content is applied."""
+    for path in sorted(changes.removed):
+        _LOGGER.debug("Removing whited-out path %r", path)
+        target_path = _get_target_path(rootfs_path, path)
+        if target_path is not None:
+            _remove_conflicting_path(target_path, is_dir=False)
+
+    for dir_path in sorted(changes.opaque):
+        opaque_dir_path = _get_target_path(rootfs_path, dir_path)
+        if (
+            opaque_dir_path is None
+            or os.path.islink(opaque_dir_path)
+            or not os.path.isdir(opaque_dir_path)
+        ):
+            continue
+
+        _LOGGER.debug("Removing content of opaque directory %r", dir_path)
+        for entry in os.listdir(opaque_dir_path):
+            _remove_conflicting_path(os.path.join(opaque_dir_path, entry), is_dir=False)
+
+
+def get_extraction_filter(
+    analyzers: Optional[Iterable[str]] = None,
+    *,
+    skip_virtual: bool = False,
+) -> Optional[Callable[[str], bool]]:
+    """Get a filter for files (paths relative to rootfs) needed by the given analyzers, all analyzers if not stated.
 
+    Directories and symlinks are always extracted, files in etc/ are always extracted. None is returned if
+    any of the analyzers needs the whole rootfs. Virtual analyzers are not taken into account if requested.
+    """
+    patterns = ["etc/**"]
+    for analyzer in resolve_dependencies(get_analyzers(analyzers)):
+        if skip_virtual and analyzer.virtual:
+            continue
+
+        if analyzer.paths is None:
+            return None
+        patterns.extend(analyzer.paths)
+
+    regex = compile_path_patterns(patterns)
+    return lambda path: regex.match(path) is not None
+
+
+def _is_filtered_out(
+    path: str, is_file: bool, path_filter: Optional[Callable[[str], bool]]
+) -> bool:
+    """Check whether the given entry should not be materialized in rootfs, directories and symlinks always are."""
+    return path_filter is not None and is_file and not path_filter(path)
+
+
+def _hash_member(
+    tar_file: tarfile.TarFile,
+    member: tarfile.TarInfo,
+    target_path: Optional[str] = None,
+) -> str:
+    """Compute SHA-256 digest of a layer tarball member, the member is written to the target path if stated."""
+    count("hashed_files")
+    digest = hashlib.sha256()
+    target_file = None
+    source_file = tar_file.extractfile(member)
+    try:
+        if target_path is not None:
+            if os.path.dirname(target_path):
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            target_file = open(target_path, "wb")
+
+        while True:
+            chunk = source_file.read(_COPY_BUFFER_SIZE)  # type: ignore
+            if not chunk:
+                break
+
+            digest.update(chunk)
+            if target_file is not None:
+                target_file.write(chunk)
+    finally:
+        source_file.close()  # type: ignore
+        if target_file is not None:
+            target_file.close()
+
+    return digest.hexdigest()
+
+
+def _hash_layer_members(layer_tar: str) -> Dict[str, Optional[str]]:
+    """Compute digests of files matching hashed paths in an uncompressed layer tarball, see LayerChanges."""
+    digests: Dict[str, Optional[str]] = {}
+    with tarfile.open(layer_tar, "r:") as tar_file:
+        for member in tar_file:
+            member_path = normalize_member_name(member.name)
+            if (
+                member.isdir()
+                or is_whiteout(member.name)
+                or not _HASHED_PATHS.match(member_path)
+            ):
+                continue
+
+            if member.issym():
+                digests[member_path] = None
+            elif member.isreg() or member.islnk():
+                try:
+                    digests[member_path] = _hash_member(tar_file, member)
+                except Exception as exc:
+                    _LOGGER.exception(
+                        "Failed to compute digest of %r, exception is not fatal: %s",
+                        member.name,
+                        exc,
+                    )
+
+    return digests
+
+
+def _get_resolved_member(
+    root_path: str, member: tarfile.TarInfo, member_target_path: str
+) -> tarfile.TarInfo:
+    """Get a copy of the member to be extracted to the given target path, hardlink targets are resolved in rootfs."""
+    resolved_member = copy.copy(member)
+    resolved_member.name = os.path.relpath(member_target_path, root_path)
+    if member.islnk():
+        link_target = get_real_relative_path(
+            root_path, normalize_member_name(member.linkname)
+        )
+        if link_target is None:
+            raise ValueError(f"Failed to resolve hardlink target {member.linkname!r}")
+        resolved_member.linkname = link_target
+
+    return resolved_member
+
+
+def _extract_layer(
+    layer_tar: str,
+    target_path: str,
+    changes: LayerChanges,
+    path_filter: Optional[Callable[[str], bool]] = None,
+    hash_files: bool = True,
+) -> None:
+    """Extract a layer tarball into the given directory, paths changed by the layer are recorded.
+
+    Digests of files matching hashed paths are computed while the layer is extracted (unless turned off), even
+    if the files are not accepted by the filter. If a filter is provided, only files accepted by the filter
+    are extracted.
+    """
+    with tarfile.open(layer_tar, "r:*") as tar_file:
+        members = tar_file.getmembers()
+        for member in members:
+            changes.record_member(member)
+
+        _apply_whiteouts(target_path, changes)
+
+        # We cannot use extractall() since it does not handle overwriting files for us.
+        extracted_bytes = 0
+        for member in members:
+            if is_whiteout(member.name):
+                continue
+
+            member_path = normalize_member_name(member.name)
+            # The working directory is not changed, it is shared by threads extracting layers concurrently.
+            member_target_path = _get_target_path(target_path, member_path)
+            is_hashed = (
+                hash_files and not member.isdir() and _HASHED_PATHS.match(member_path)
+            )
+            is_extracted = not _is_filtered_out(
+                member_path, not member.isdir() and not member.issym(), path_filter
+            )
+
+            # Do not set attributes so we are fine with permissions.
+            try:
+                if is_hashed and member.issym():
+                    changes.digests[member_path] = None
+                elif is_hashed and member.islnk():
+                    changes.digests[member_path] = _hash_member(tar_file, member)
+                elif is_hashed and member.isreg():
+                    # Regular files are hashed and written in one pass.
+                    if not is_extracted or member_target_path is None:
+                        changes.digests[member_path] = _hash_member(tar_file, member)
+                        continue
+
+                    try:
+                        _remove_conflicting_path(member_target_path, False)
+                        changes.digests[member_path] = _hash_member(
+                            tar_file, member, member_target_path
+                        )
+                        extracted_bytes += member.size
+                    except OSError as exc:
+                        _LOGGER.warning(
+                            "Failed to extract %r, computing its digest only: %s",
+                            member.name,
+                            str(exc),
+                        )
+                        changes.digests[member_path] = _hash_member(tar_file, member)
+                    continue
+
+                if not is_extracted or member_target_path is None:
+                    continue
+
+                _remove_conflicting_path(member_target_path, member.isdir())
+                tar_file.extract(
+                    _get_resolved_member(target_path, member, member_target_path),
+                    target_path,
+                    set_attrs=False,
+                    numeric_owner=False,
+                )
+                if member.isreg():
+                    extracted_bytes += member.size
+            except Exception as exc:
+                _LOGGER.exception(
+                    "Failed to extract %r, exception is not fatal: %s",
+                    member.name,
+                    exc,
+                )
+
+        count("extracted_bytes", extracted_bytes)
+
+
+def _populate_layer_cache(
+    layer_blob: str, layer_digest: str, tree_path: str
+) -> Dict[str, Any]:
+    """Extract a layer into the layer cache, return changes done by the layer as metadata stored in the cache."""
+    changes = LayerChanges(digest=layer_digest)
+    layer_tar = _decompress_layer(layer_blob)
+    try:
+        _extract_layer(layer_tar, tree_path, changes)
+        # The uncompressed size is kept to report size of images even if the layer blob is not downloaded again.
+        changes.uncompressed_size = os.path.getsize(layer_tar)
+    finally:
+        if layer_tar != layer_blob:
+            os.remove(layer_tar)
+
+    return changes.to_dict()
+
+
+def _link_layer_tree(
+    tree_path: str,
+    rootfs_path: str,
+    path_filter: Optional[Callable[[str], bool]] = None,
+) -> None:
+    """Apply an extracted layer tree onto rootfs, files are hardlinked (or copied if hardlinks are not possible).
+
+    If a filter is provided, only files accepted by the filter are linked.
+    """
+    stack = [""]
+    while stack:
+        relative_path = stack.pop()
+        with os.scandir(os.path.join(tree_path, relative_path)) as entries:
+            for entry in entries:
+                entry_path = os.path.join(relative_path, entry.name)
+                target_path = _get_target_path(rootfs_path, entry_path)
+                if target_path is None:
+                    continue
+
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if _is_filtered_out(
+                        entry_path, not is_dir and not entry.is_symlink(), path_filter
+                    ):
+                        continue
+
+                    _remove_conflicting_path(target_path, is_dir)
+                    if is_dir:
+                        if not os.path.isdir(target_path):
+                            os.mkdir(target_path)
+                        stack.append(entry_path)
+                    elif entry.is_symlink():
+                        os.symlink(os.readlink(entry.path), target_path)
+                    else:
+                        try:
+                            os.link(entry.path, target_path)
+                        except OSError:
+                            shutil.copyfile(entry.path, target_path)
+                except Exception as exc:
+                    _LOGGER.exception(
+                        "Failed to link %r from layer cache, exception is not fatal: %s",
+                        entry_path,
+                        exc,
+                    )
+
+
+def _decompress_and_hash_layer(
+    layer_blob: str, hash_files: bool
+) -> Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Optional[str]]]]:
+    """Decompress a layer to be applied onto rootfs without the layer cache, files in it are hashed if requested."""
+    layer_tar = _decompress_layer(layer_blob)
+    try:
+        return (
+            layer_tar,
+            None,
+            _hash_layer_members(layer_tar) if hash_files else None,
+        )
+    except Exception:
+        if layer_tar != layer_blob:
+            os.remove(layer_tar)
+        raise
+
+
+def _prepare_layer(
+    layer_blob: str,
+    layer_digest: str,
+    layer_cache: Optional[LayerCache],
+    hash_files: bool = True,
+) -> Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Optional[str]]]]:
+    """Prepare a layer to be applied onto rootfs, this is done concurrently for multiple layers.
+
+    Without layer cache, path to the decompressed layer tarball is returned together with digests of files
+    in it (unless turned off), so files are hashed by workers preparing layers. With layer cache, path to the
+    extracted layer tree is returned together with metadata stored in the cache, digests are part of it.
+    """
+    with profile_phase("prepare-layer", layer_digest):
+        if layer_cache is None:
+            return _decompress_and_hash_layer(layer_blob, hash_files)
+
+        with layer_cache.lock(layer_digest):
+            cached_layer = layer_cache.get(layer_digest)
+            if cached_layer is not None and "digests" not in cached_layer[1]:
+                _LOGGER.debug(
+                    "Layer %r was stored in the layer cache without file digests",
+                    layer_digest,
+                )
+                if not layer_cache.remove(layer_digest):
+                    # The layer cannot be replaced while other jobs use it, it is prepared as if not cached.
+                    _LOGGER.debug(
+                        "Layer %r is in use by other jobs, not storing it in the layer cache",
+                        layer_digest,
+                    )
+                    count("layer_cache_misses")
+                    return _decompress_and_hash_layer(layer_blob, hash_files)
+
+                cached_layer = None
+
+            if cached_layer is None:
+                if not os.path.exists(layer_blob):
+                    raise InvalidImageError(
+                        f"Layer {layer_digest!r} was neither downloaded nor found in the layer cache"
+                    )
+
+                count("layer_cache_misses")
+                _LOGGER.debug("Extracting layer %r into the layer cache", layer_digest)
+                cached_layer = layer_cache.store(
+                    layer_digest,
+                    functools.partial(_populate_layer_cache, layer_blob, layer_digest),
+                )
+            else:
+                count("layer_cache_hits")
+
+        return (*cached_layer, None)
+
+
+def is_layer_cached(layer_cache: LayerCache, layer_digest: str) -> bool:
+    """Check whether the given layer can be applied from the layer cache, its blob is not needed then."""
+    cached_layer = layer_cache.get(layer_digest)
+    return cached_layer is not None and "digests" in cached_layer[1]
+
+
+def _load_manifest(dir_path: str) -> Dict[str, Any]:
+    """Load the manifest of a downloaded image."""
     try:
         with open(os.path.join(dir_path, "manifest.json")) as manifest_file:
-            manifest = json.load(manifest_file)
+            manifest: Dict[str, Any] = json.load(manifest_file)
     except FileNotFoundError as exc:
         raise InvalidImageError(
             "No manifest.json file found in the downloaded "
             "image in {}".format(os.path.join(dir_path, "manifest.json"))
         ) from exc
 
+    return manifest
+
+
+def _get_manifest_layers(manifest: Dict[str, Any]) -> List[dict]:
+    """Get layer definitions stated in the manifest, layers are ordered from the base layer."""
     if manifest.get("schemaVersion") == 1:
-        manifest_layers = manifest["fsLayers"]
-        get_layer_digest = _get_layer_digest_v1
+        # Layers are stated from the top-most one in schema version 1.
+        return [
+            {"digest": layer_def["blobSum"], **layer_def}
+            for layer_def in reversed(manifest["fsLayers"])
+        ]
     elif manifest.get("schemaVersion") == 2:
-        manifest_layers = manifest["layers"]
-        get_layer_digest = _get_layer_digest_v2
+        return manifest["layers"]
     else:
         raise NotSupported(
             "Invalid schema version in manifest.json file: {} "
@@ -428,89 +1288,236 @@ def construct_rootfs(dir_path: str, rootfs_path: str) -> list:
             )
         )
 
-    layers = []
-    _LOGGER.debug("Layers found: %r", manifest_layers)
-    for layer_def in manifest_layers:
-        layer_digest = get_layer_digest(layer_def)
 
-        _LOGGER.debug("Extracting layer %r", layer_digest)
-        layers.append(layer_digest)
+def _load_manifest_layers(dir_path: str) -> List[dict]:
+    """Load layer definitions from the manifest of a downloaded image, layers are ordered from the base layer."""
+    return _get_manifest_layers(_load_manifest(dir_path))
+
+
+def get_image_layers(dir_path: str) -> List[str]:
+    """Get digests of layers of a downloaded image."""
+    return [
+        _get_layer_digest(layer_def) for layer_def in _load_manifest_layers(dir_path)
+    ]
+
+
+def construct_rootfs(
+    dir_path: str,
+    rootfs_path: str,
+    *,
+    layer_cache: Optional[LayerCache] = None,
+    layer_changes: Optional[List[LayerChanges]] = None,
+    workers: Optional[int] = None,
+    path_filter: Optional[Callable[[str], bool]] = None,
+    hash_files: bool = True,
+) -> list:
+    """Construct rootfs in a directory by extracting layers.
+
+    Layers are decompressed (and extracted into the layer cache, if provided) concurrently by the given
+    number of workers and applied onto rootfs in the layer order, respecting whiteouts. Already extracted
+    layers are reused if the layer cache is provided. Paths changed by each layer are appended to
+    layer_changes if a list is passed. If a path filter is provided (see get_extraction_filter), only files
+    accepted by the filter are materialized in rootfs, the layer cache always keeps whole layers. Digests of
+    files (see LayerChanges) are not computed on extraction if turned off, the layer cache always keeps them.
+    """
+    os.makedirs(rootfs_path, exist_ok=True)
+    layers = get_image_layers(dir_path)
+    _LOGGER.debug("Layers found: %r", layers)
+    workers = workers or os.cpu_count() or 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Layers are prepared in a sliding window to bound space needed for decompressed layers.
+        pending = deque()
+        for layer_digest in layers[:workers]:
+            pending.append(
+                executor.submit(
+                    contextvars.copy_context().run,
+                    _prepare_layer,
+                    os.path.join(dir_path, layer_digest),
+                    layer_digest,
+                    layer_cache,
+                    hash_files,
+                )
+            )
 
-        layer_gzip_tar = os.path.join(dir_path, layer_digest)
-        with cwd(rootfs_path):
-            tar_file = tarfile.open(layer_gzip_tar, "r:gz")
+        for idx, layer_digest in enumerate(layers):
+            layer_blob = os.path.join(dir_path, layer_digest)
+            prepared_path, metadata, digests = pending.popleft().result()
+
+            if idx + workers < len(layers):
+                next_digest = layers[idx + workers]
+                pending.append(
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        _prepare_layer,
+                        os.path.join(dir_path, next_digest),
+                        next_digest,
+                        layer_cache,
+                        hash_files,
+                    )
+                )
 
-            # We cannot use extractall() since it does not handle overwriting files for us.
-            for member in tar_file:
-                # Do not set attributes so we are fine with permissions.
+            if metadata is None:
+                _LOGGER.debug("Extracting layer %r", layer_digest)
+                changes = LayerChanges(
+                    digest=layer_digest,
+                    uncompressed_size=os.path.getsize(prepared_path),
+                )
+                if digests is not None:
+                    changes.digests.update(digests)
                 try:
-                    tar_file.extract(member, set_attrs=False, numeric_owner=False)
-                except IOError:
-                    # If the given file is present, there is raised an exception - remove file to prevent from errors.
-                    try:
-                        os.remove(member.name)
-                        tar_file.extract(member, set_attrs=False, numeric_owner=False)
-                    except Exception as exc:
-                        _LOGGER.exception(
-                            "Failed to extract %r, exception is not fatal: %s",
-                            member.name,
-                            exc,
+                    with profile_phase("extract-layer", layer_digest):
+                        # Files were hashed when the layer was prepared.
+                        _extract_layer(
+                            prepared_path, rootfs_path, changes, path_filter, False
                         )
+                finally:
+                    if prepared_path != layer_blob:
+                        os.remove(prepared_path)
+            else:
+                _LOGGER.debug("Applying layer %r from the layer cache", layer_digest)
+                changes = LayerChanges.from_dict(metadata)
+                with profile_phase("link-layer", layer_digest):
+                    _apply_whiteouts(rootfs_path, changes)
+                    _link_layer_tree(prepared_path, rootfs_path, path_filter)
+
+            if layer_changes is not None:
+                layer_changes.append(changes)
 
     return layers
 
 
-def _get_absolute_link(
-    root_path: str, path: str, iter: int
-) -> Tuple[Optional[str], bool]:
-    """Find the absolute link of the given link."""
-    if iter > _MAX_SYMLINKS:
-        _LOGGER.warning("Maximum symlink traversal reached.")
-        return None, True
-    elif os.path.islink(path):
-        next_path = os.path.normpath(os.path.join(root_path, os.readlink(path)))
-        abs_link, _ = _get_absolute_link(root_path, next_path, iter + 1)
-        return abs_link, True
-    else:
-        if not os.path.isfile(path):
-            _LOGGER.warning(
-                "Python link refers to %s, but this file is not present on filesystem.",
-                path,
-            )
-        return path, False
+def _index_layer(rootfs: VirtualRootfs, layer_tar: str, changes: LayerChanges) -> None:
+    """Index an uncompressed layer tarball in virtual rootfs, paths changed by the layer are recorded."""
+    with tarfile.open(layer_tar, "r:") as tar_file:
+        members = tar_file.getmembers()
+        for member in members:
+            changes.record_member(member)
 
+        rootfs.apply_whiteouts(changes)
+        for member in members:
+            if is_whiteout(member.name):
+                continue
 
-def _get_python_interpreters(path: str) -> List[dict]:
-    """Find all python interpreters and symlinks."""
-    result = []
+            rootfs.add_member(layer_tar, member, changes.digest)
 
-    for py_path in glob.glob("{}/usr/bin/python*".format(path)):
-        version_ = None
-        try:
-            os.chmod(py_path, stat.S_IEXEC)
-            line = run_command("{} --version".format(py_path), timeout=2).stdout
-            parts = line.split(maxsplit=2)
-            if len(parts) == 2 and parts[0] == "Python":
-                version_ = line.rstrip()
-        except Exception as exc:
-            _LOGGER.warning(
-                "Failed to run %s --version to gather python interpreter version: %s",
-                py_path,
-                str(exc),
+
+def construct_virtual_rootfs(
+    dir_path: str,
+    *,
+    layer_cache: Optional[LayerCache] = None,
+    layer_changes: Optional[List[LayerChanges]] = None,
+    workers: Optional[int] = None,
+    hash_files: bool = True,
+) -> VirtualRootfs:
+    """Construct virtual rootfs by indexing layers, no files are extracted into rootfs.
+
+    Layers are decompressed (and extracted into the layer cache, if provided) concurrently by the given
+    number of workers and indexed in the layer order. Content of files is read from decompressed layer
+    tarballs kept next to layer blobs, or from extracted layer trees in the layer cache. Decompressed tarballs
+    are removed once no file in rootfs is read from them, the others are kept until the image directory is
+    removed - use the layer cache to avoid keeping uncompressed copies of layers. See construct_rootfs for
+    layer changes and digests of files.
+    """
+    layers = get_image_layers(dir_path)
+    _LOGGER.debug("Layers found: %r", layers)
+    workers = workers or os.cpu_count() or 1
+    rootfs = VirtualRootfs()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # Decompressed layers are kept until the analysis finishes, they are not prepared in a sliding window.
+        prepared = [
+            executor.submit(
+                contextvars.copy_context().run,
+                _prepare_layer,
+                os.path.join(dir_path, layer_digest),
+                layer_digest,
+                layer_cache,
+                hash_files,
             )
+            for layer_digest in layers
+        ]
+
+        decompressed = []
+        for layer_digest, future in zip(layers, prepared):
+            prepared_path, metadata, digests = future.result()
+            if metadata is None:
+                if prepared_path != os.path.join(dir_path, layer_digest):
+                    decompressed.append(prepared_path)
+
+                _LOGGER.debug("Indexing layer %r", layer_digest)
+                changes = LayerChanges(
+                    digest=layer_digest,
+                    uncompressed_size=os.path.getsize(prepared_path),
+                    digests=digests or {},
+                )
+                with profile_phase("index-layer", layer_digest):
+                    _index_layer(rootfs, prepared_path, changes)
+            else:
+                _LOGGER.debug("Indexing layer %r from the layer cache", layer_digest)
+                changes = LayerChanges.from_dict(metadata)
+                with profile_phase("index-layer", layer_digest):
+                    rootfs.apply_whiteouts(changes)
+                    rootfs.add_tree(prepared_path, layer_digest)
 
-        absolute_link, is_file_present = _get_absolute_link(path, py_path, 0)
-        if absolute_link is not None:
-            if not is_file_present:
-                absolute_link = absolute_link[len(path) :]
+            if layer_changes is not None:
+                layer_changes.append(changes)
 
-        py_interpret = {
-            "path": py_path[len(path) :],
-            "link": absolute_link,
-            "version": version_,
-        }
+    # Files of layers can be overwritten or whited out by upper layers.
+    sources = rootfs.get_sources()
+    for layer_tar in decompressed:
+        if layer_tar not in sources:
+            _LOGGER.debug("Removing %r, no file in rootfs is read from it", layer_tar)
+            os.remove(layer_tar)
+
+    return rootfs
+
+
+def _get_absolute_link(rootfs: VirtualRootfs, path: str) -> Optional[str]:
+    """Find the absolute path the given path points to, symlinks are resolved in rootfs."""
+    real_path = rootfs.resolve(path)
+    if real_path is None:
+        _LOGGER.warning("Maximum symlink traversal reached.")
+        return None
+
+    if not rootfs.isfile(real_path):
+        _LOGGER.warning(
+            "Python link refers to %s, but this file is not present on filesystem.",
+            "/" + real_path,
+        )
+    return "/" + real_path
 
-        result.append(py_interpret)
+
+def _get_python_interpreters(rootfs: VirtualRootfs) -> List[dict]:
+    """Find all python interpreters and symlinks, versions are detected without running interpreters."""
+    result: List[dict] = []
+    if not rootfs.isdir("usr/bin"):
+        return result
+
+    # Symlinks usually point to the same interpreter, its version is detected once.
+    versions: Dict[str, Optional[str]] = {}
+    for name in rootfs.listdir("usr/bin"):
+        if not name.startswith("python"):
+            continue
+
+        py_path = os.path.join("usr/bin", name)
+        absolute_link = _get_absolute_link(rootfs, py_path)
+        if absolute_link is not None and absolute_link not in versions:
+            versions[absolute_link] = (
+                get_python_version(rootfs, absolute_link.lstrip("/"))
+                if rootfs.isfile(absolute_link)
+                else None
+            )
+
+        result.append(
+            {
+                "path": "/" + py_path,
+                "link": absolute_link,
+                "version": versions.get(absolute_link)
+                if absolute_link is not None
+                else None,
+            }
+        )
 
     return result
 
@@ -536,14 +1543,106 @@ def download_image(
     _LOGGER.debug("%s stdout: %s", _SKOPEO_EXEC_PATH, stdout)
 
 
-def get_image_size(path: str) -> int:
-    """Calculate the size of the image."""
-    total_size = 0
-    for path_, dirs, files in os.walk(path):
-        for f in files:
-            fp = os.path.join(path, f)
-            total_size += os.path.getsize(fp)
-    return total_size
+def _get_blob_size(blob_path: str) -> Optional[int]:
+    """Get size of a downloaded blob, return None if the blob was not downloaded."""
+    try:
+        return os.stat(blob_path).st_size
+    except FileNotFoundError:
+        return None
+
+
+def _get_uncompressed_size(blob_path: str) -> Optional[int]:
+    """Get size of a downloaded layer tarball if it is not compressed, return None otherwise or if not downloaded.
+
+    Size of compressed layers is known only once they are decompressed, the gzip trailer states it modulo 4 GiB
+    and only for the last member of multi-member archives.
+    """
+    try:
+        with open(blob_path, "rb") as blob_file:
+            if blob_file.read(len(_GZIP_MAGIC)) == _GZIP_MAGIC:
+                return None
+
+            return os.fstat(blob_file.fileno()).st_size
+    except FileNotFoundError:
+        return None
+
+
+def _sum_sizes(sizes: Iterable[Optional[int]]) -> Optional[int]:
+    """Sum the given sizes, return None if any of them is not known."""
+    total = 0
+    for size in sizes:
+        if size is None:
+            return None
+        total += size
+
+    return total
+
+
+def get_image_size(
+    dir_path: str,
+    layer_cache: Optional[LayerCache] = None,
+    layer_changes: Optional[List[LayerChanges]] = None,
+) -> Dict[str, Any]:
+    """Get size of a downloaded image based on its manifest, compressed and uncompressed, in total and per layer.
+
+    Sizes stated in the manifest are used, blobs are inspected only if their size is not stated. Uncompressed
+    sizes are taken from layer changes recorded when constructing rootfs (see construct_rootfs) or from the layer
+    cache, sizes of layers which are not compressed are known from their blobs. Sizes which cannot be obtained
+    are reported as None, totals count each blob once and are None if size of any blob is not known.
+    """
+    recorded_sizes = {
+        changes.digest: changes.uncompressed_size
+        for changes in layer_changes or []
+        if changes.uncompressed_size is not None
+    }
+    manifest = _load_manifest(dir_path)
+    blobs: Dict[str, Optional[int]] = {}
+    uncompressed: Dict[str, Optional[int]] = {}
+
+    config = manifest.get("config")
+    if config is not None:
+        config_digest = _get_layer_digest(config)
+        blobs[config_digest] = config.get("size")
+        if blobs[config_digest] is None:
+            blobs[config_digest] = _get_blob_size(os.path.join(dir_path, config_digest))
+
+    layers = []
+    for layer_def in _get_manifest_layers(manifest):
+        layer_digest = _get_layer_digest(layer_def)
+        if layer_digest not in blobs:
+            blob_path = os.path.join(dir_path, layer_digest)
+            blobs[layer_digest] = layer_def.get("size")
+            if blobs[layer_digest] is None:
+                blobs[layer_digest] = _get_blob_size(blob_path)
+
+            cached_layer = (
+                layer_cache.get(layer_digest)
+                if layer_cache is not None and layer_digest not in recorded_sizes
+                else None
+            )
+            if layer_digest in recorded_sizes:
+                uncompressed[layer_digest] = recorded_sizes[layer_digest]
+            elif cached_layer is not None and cached_layer[1].get("uncompressed_size"):
+                uncompressed[layer_digest] = cached_layer[1]["uncompressed_size"]
+            else:
+                uncompressed[layer_digest] = _get_uncompressed_size(blob_path)
+
+        layers.append(
+            {
+                "digest": layer_digest,
+                "compressed": blobs[layer_digest],
+                "uncompressed": uncompressed[layer_digest],
+            }
+        )
+
+    manifest_size = os.path.getsize(os.path.join(dir_path, "manifest.json"))
+    return {
+        "compressed": _sum_sizes([manifest_size, *blobs.values()]),
+        "uncompressed": _sum_sizes(uncompressed.values()),
+        "manifest": manifest_size,
+        "config": blobs[config_digest] if config is not None else None,
+        "layers": layers,
+    }
 
 
 def _get_cuda_version(path: str) -> dict:
@@ -574,11 +1673,14 @@ def _get_cuda_version(path: str) -> dict:
     if os.path.exists(nvcc_path):
         st = os.stat(nvcc_path)
         os.chmod(nvcc_path, st.st_mode | stat.S_IEXEC)
-        result = run_command("{} --version".format(nvcc_path), raise_on_error=False)
-        if result.return_code != 0:
+        result = run_task_command(
+            "{} --version".format(nvcc_path), raise_on_error=False
+        )
+        if result.returncode != 0:
             _LOGGER.warning(
-                "Unable to detect CUDA version - nvcc returned non-zero exit code: %s",
-                result.to_dict(),
+                "Unable to detect CUDA version - nvcc returned non-zero exit code %d: %s",
+                result.returncode,
+                result.stderr,
             )
         else:
             for line in result.stdout.splitlines():
@@ -606,47 +1708,70 @@ def _gather_skopeo_inspect(path, timeout) -> Dict[str, str]:
     """Gether information from skopeo inspect."""
     path = os.path.dirname(path)  # Remove rootfs.
     cmd = f"{_SKOPEO_EXEC_PATH} inspect dir:{path}"
-    output = run_command(cmd, timeout=timeout, is_json=True).stdout
+    output = json.loads(run_task_command(cmd, timeout=timeout).stdout)
     return output
 
 
-def _get_python_packages(path: str) -> List[Dict[str, Any]]:
-    """Get installed Python packages in the container image."""
+def _get_python_packages(
+    rootfs: VirtualRootfs, locations: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """Get installed Python packages in the container image, rootfs is scanned for locations if not given."""
     _LOGGER.debug("Detecting installed Python packages")
+    if locations is None:
+        locations = scan(rootfs, ("library-directories",))["library-directories"]
+
     result = []
-    for location, _, _ in os.walk(path):
-        if os.path.basename(location) != "site-packages":
-            _LOGGER.debug(
-                "Excluding %r from checking Python modules installed: not a site-packages directory",
-                location,
-            )
+    for location in locations:
+        result.extend(read_distributions(rootfs, location))
+
+    return result
+
+
+def _update_python_packages(
+    rootfs: VirtualRootfs, previous: List[Dict[str, Any]], changes: LayerChanges
+) -> List[Dict[str, Any]]:
+    """Update Python packages detected in lower layers based on changes done by upper layers."""
+    _LOGGER.debug("Detecting changes in installed Python packages")
+    previous_locations: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in previous:
+        previous_locations.setdefault(entry["location"].lstrip("/"), []).append(entry)
+
+    locations = set(previous_locations)
+    for changed_path in changes.changed:
+        parts = changed_path.split("/")
+        index = next(
+            (i for i, part in enumerate(parts[:-1]) if part in LIBRARY_DIRECTORIES),
+            None,
+        )
+        if index is None:
             continue
 
-        for dist in freeze(paths=[location]):
-            package_name, package_version = dist.split("==", maxsplit=1)
-            result.append(
-                {
-                    "package_name": package_name,
-                    "package_version": package_version,
-                    "location": location[len(path) :]
-                    if location.startswith(path)
-                    else location,
-                }
-            )
+        real_location = rootfs.resolve("/".join(parts[: index + 1]))
+        if real_location is not None:
+            locations.add(real_location)
+
+    result = []
+    for location in sorted(locations):
+        if rootfs.islink(location) or not rootfs.isdir(location):
+            continue
+
+        if location in previous_locations and not changes.is_tree_affected(location):
+            result.extend(previous_locations[location])
+        else:
+            result.extend(read_distributions(rootfs, location))
 
     return result
 
 
-def _get_aicoe_ci(path: str) -> Dict[str, Any]:
+def _get_aicoe_ci(rootfs: VirtualRootfs) -> Dict[str, Any]:
     """Obtain information propagated from AICoE-CI during the image build."""
-    aicoe_ci_path = os.path.join(path, "opt", "aicoe-ci")
+    aicoe_ci_path = os.path.join("opt", "aicoe-ci")
 
     pipfile_content = None
     pipfile_path = os.path.join(aicoe_ci_path, "Pipfile")
-    if os.path.exists(pipfile_path):
+    if rootfs.exists(pipfile_path):
         try:
-            with open(pipfile_path) as f:
-                pipfile_content = toml.load(f)
+            pipfile_content = toml.loads(rootfs.read_text(pipfile_path))
         except Exception:
             _LOGGER.exception(
                 "Failed to obtain dependency information from Pipfile located at %r",
@@ -655,10 +1780,9 @@ def _get_aicoe_ci(path: str) -> Dict[str, Any]:
 
     pipfile_lock_content = None
     pipfile_lock_path = os.path.join(aicoe_ci_path, "Pipfile.lock")
-    if os.path.exists(pipfile_lock_path):
+    if rootfs.exists(pipfile_lock_path):
         try:
-            with open(pipfile_lock_path) as f:
-                pipfile_lock_content = json.load(f)
+            pipfile_lock_content = json.loads(rootfs.read_text(pipfile_lock_path))
         except Exception:
             _LOGGER.exception(
                 "Failed to obtain dependency information from Pipfile.lock located at %r",
@@ -671,26 +1795,327 @@ def _get_aicoe_ci(path: str) -> Dict[str, Any]:
     }
 
 
-def run_analyzers(path: str, timeout: int = None) -> dict:
-    """Run analyzers on the given path (directory) and extract found packages."""
-    path = quote(path)
+def _get_rpm_packages(context: AnalyzerContext) -> Tuple[List[str], List[dict]]:
+    """Gather rpm packages and their dependencies once per rootfs, shared by rpm analyzers."""
+    if "rpm" not in context.shared:
+        context.shared["rpm"] = _gather_rpm_packages(
+            context.path, timeout=context.timeout
+        )
+    return context.shared["rpm"]
 
-    # In case of Debian-based images we assume dpkg and apt-cache packages are actually executable,
-    # meaning the architecture matches with host. We could try to bundle own statically linked binaries
-    # and ship them with container to add support for other architectures (if that would be possible).
-    deb_packages = _run_dpkg_query(path, timeout=timeout)
 
-    return {
-        "rpm": _run_rpm(path, timeout=timeout),
-        "rpm-dependencies": _run_rpm_repoquery(path, timeout=timeout),
-        "deb": deb_packages,
-        "deb-dependencies": _run_apt_cache_show(path, deb_packages, timeout=timeout),
-        "python-files": _gather_python_file_digests(path),
-        "operating-system": _gather_os_info(path),
-        "skopeo-inspect": _gather_skopeo_inspect(path, timeout=timeout),
-        "system-symbols": _get_system_symbols(path),
-        "python-interpreters": _get_python_interpreters(path),
-        "cuda-version": _get_cuda_version(path),
-        "python-packages": _get_python_packages(path),
-        "aicoe-ci": _get_aicoe_ci(path),
-    }
+def _get_deb_packages(context: AnalyzerContext) -> Tuple[List[dict], List[dict]]:
+    """Gather deb packages and their dependencies once per rootfs, shared by deb analyzers."""
+    if "deb" not in context.shared:
+        context.shared["deb"] = _gather_deb_packages(
+            context.path, timeout=context.timeout
+        )
+    return context.shared["deb"]
+
+
+def _analyze_python_files(context: AnalyzerContext) -> List[Dict[str, Any]]:
+    """Get digests of Python files, only changed files are hashed if results for lower layers are available."""
+    if context.file_digests is not None:
+        return _get_python_file_digests(context.get_rootfs(), context.file_digests)
+    elif context.changes is not None and "python-files" in context.previous:
+        return _update_python_file_digests(
+            context.get_rootfs(),
+            context.previous["python-files"],
+            context.changes,
+        )
+    return _gather_python_file_digests(
+        context.get_rootfs(), file_paths=context.get_scan_result("python-files")
+    )
+
+
+def _analyze_python_packages(context: AnalyzerContext) -> List[Dict[str, Any]]:
+    """Get Python packages, only changed locations are inspected if results for lower layers are available."""
+    if context.changes is not None and "python-packages" in context.previous:
+        return _update_python_packages(
+            context.get_rootfs(), context.previous["python-packages"], context.changes
+        )
+    return _get_python_packages(
+        context.get_rootfs(), context.get_scan_result("library-directories")
+    )
+
+
+def _analyze_system_symbols(context: AnalyzerContext) -> Dict[str, List[str]]:
+    """Get version symbols exported by shared objects, see _get_system_symbols."""
+    return _get_system_symbols(
+        context.path,
+        context.previous.get("system-symbols"),
+        context.changes,
+        context.file_digests,
+        context.symbol_cache,
+        # Digests are mapped to shared objects through the index shared by analyzers, it is built if needed.
+        context.get_rootfs()
+        if context.symbol_cache is not None and context.file_digests is not None
+        else None,
+    )
+
+
+# Paths stated as inputs determine results of analyzers, see Analyzer. When analyzing an image with additional
+# layers on top of already analyzed ones, results are reused if no matching path was changed. Paths are files
+# analyzers need to be present in rootfs in the selective extraction mode.
+for _analyzer in (
+    Analyzer(
+        "rpm",
+        lambda context: _get_rpm_packages(context)[0],
+        inputs=("var/lib/rpm/**", "usr/lib/sysimage/rpm/**"),
+        paths=("var/lib/rpm/**", "usr/lib/sysimage/rpm/**", "usr/lib/rpm/**"),
+    ),
+    # Made dependent so that the rpm database is read once, not concurrently.
+    Analyzer(
+        "rpm-dependencies",
+        lambda context: _get_rpm_packages(context)[1],
+        dependencies=("rpm",),
+        inputs=("var/lib/rpm/**", "usr/lib/sysimage/rpm/**"),
+        paths=(
+            "var/lib/rpm/**",
+            "usr/lib/sysimage/rpm/**",
+            "usr/lib/rpm/**",
+            "usr/lib/os-release",
+        ),
+    ),
+    # Binaries are run in chroot, libraries they are linked to need to be present as well.
+    Analyzer(
+        "deb",
+        lambda context: _get_deb_packages(context)[0],
+        inputs=("var/lib/dpkg/**",),
+        paths=("usr/bin/dpkg-query", "var/lib/dpkg/**", *_SHARED_OBJECT_PATHS),
+    ),
+    Analyzer(
+        "deb-dependencies",
+        lambda context: _get_deb_packages(context)[1],
+        dependencies=("deb",),
+        inputs=("var/lib/dpkg/**", "var/lib/apt/**", "etc/apt/**"),
+        paths=(
+            "usr/bin/apt-cache",
+            "var/lib/dpkg/**",
+            "var/lib/apt/**",
+            "var/cache/apt/**",
+            *_SHARED_OBJECT_PATHS,
+        ),
+    ),
+    # Digests of Python files are computed from layer tarballs when constructing rootfs.
+    Analyzer(
+        "python-files",
+        _analyze_python_files,
+        paths=(),
+        uses_file_digests=True,
+        virtual=True,
+        visitors=("python-files",),
+    ),
+    Analyzer(
+        "operating-system",
+        lambda context: _gather_os_info(context.get_rootfs()),
+        inputs=("etc/os-release", "usr/lib/os-release"),
+        paths=("usr/lib/os-release",),
+        virtual=True,
+    ),
+    Analyzer(
+        "skopeo-inspect",
+        lambda context: _gather_skopeo_inspect(context.path, timeout=context.timeout),
+        paths=(),
+        image_metadata=True,
+    ),
+    Analyzer(
+        "system-symbols",
+        _analyze_system_symbols,
+        paths=_SHARED_OBJECT_PATHS,
+        uses_file_digests=True,
+    ),
+    Analyzer(
+        "python-interpreters",
+        lambda context: _get_python_interpreters(context.get_rootfs()),
+        paths=(
+            "usr/bin/python*",
+            "lib*/libpython*",
+            "lib/*/libpython*",
+            "usr/lib*/libpython*",
+            "usr/lib/*/libpython*",
+            "usr/local/lib*/libpython*",
+            "usr/lib*/python*/os.py",
+            "usr/local/lib*/python*/os.py",
+        ),
+        virtual=True,
+    ),
+    Analyzer(
+        "cuda-version",
+        lambda context: _get_cuda_version(context.path),
+        inputs=("usr/local/cuda*", "usr/local/cuda*/**"),
+        paths=("usr/local/cuda*/version.txt", "usr/local/cuda*/bin/nvcc"),
+    ),
+    Analyzer(
+        "python-packages",
+        _analyze_python_packages,
+        paths=(
+            "**/site-packages/*.dist-info/**",
+            "**/site-packages/*.egg-info",
+            "**/site-packages/*.egg-info/**",
+            "**/site-packages/*.egg/EGG-INFO/**",
+            "**/site-packages/*.egg-link",
+            "**/site-packages/*.pth",
+            "**/dist-packages/*.dist-info/**",
+            "**/dist-packages/*.egg-info",
+            "**/dist-packages/*.egg-info/**",
+            "**/dist-packages/*.egg/EGG-INFO/**",
+            "**/dist-packages/*.egg-link",
+            "**/dist-packages/*.pth",
+        ),
+        virtual=True,
+        visitors=("library-directories",),
+    ),
+    Analyzer(
+        "aicoe-ci",
+        lambda context: _get_aicoe_ci(context.get_rootfs()),
+        inputs=("opt/aicoe-ci/**",),
+        paths=("opt/aicoe-ci/**",),
+        virtual=True,
+    ),
+):
+    register_analyzer(_analyzer)
+
+
+def select_layer_results(
+    result: Dict[str, Any], virtual_only: bool = False
+) -> Dict[str, Any]:
+    """Select results of analyzers which depend solely on content of image layers.
+
+    Only results of virtual analyzers are selected if requested, other analyzers could see rootfs with
+    just a subset of files materialized.
+    """
+    result_ = {}
+    for name, value in result.items():
+        analyzer = get_analyzer(name)
+        if virtual_only and (analyzer is None or not analyzer.virtual):
+            continue
+
+        if analyzer is None or not analyzer.image_metadata:
+            result_[name] = value
+
+    return result_
+
+
+def needs_rootfs(
+    analyzers: Optional[Iterable[str]] = None,
+    cached_results: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Check whether any of the given analyzers (all if not stated) needs rootfs, results cached are reused."""
+    return any(
+        not analyzer.image_metadata and analyzer.name not in (cached_results or {})
+        for analyzer in resolve_dependencies(get_analyzers(analyzers))
+    )
+
+
+def needs_directory(analyzers: Optional[Iterable[str]] = None) -> bool:
+    """Check whether any of the given analyzers (all if not stated) needs rootfs materialized in a directory."""
+    return any(
+        not analyzer.virtual and not analyzer.image_metadata
+        for analyzer in resolve_dependencies(get_analyzers(analyzers))
+    )
+
+
+def needs_file_digests(analyzers: Optional[Iterable[str]] = None) -> bool:
+    """Check whether any of the given analyzers (all if not stated) uses digests of files computed on extraction."""
+    return any(
+        analyzer.uses_file_digests
+        for analyzer in resolve_dependencies(get_analyzers(analyzers))
+    )
+
+
+def run_analyzers(
+    path: str,
+    timeout: int = None,
+    *,
+    analyzers: Optional[Iterable[str]] = None,
+    cached_results: Optional[Dict[str, Any]] = None,
+    changes: Optional[LayerChanges] = None,
+    file_digests: Optional[Dict[str, Optional[str]]] = None,
+    symbol_cache: Optional[SymbolCache] = None,
+    workers: Optional[int] = None,
+    rootfs: Optional[VirtualRootfs] = None,
+) -> dict:
+    """Run analyzers with the given names (all registered if not stated) on the given path (directory).
+
+    Analyzers the requested ones depend on are run as well, only results of the requested ones are returned.
+    Independent analyzers are run concurrently by the given number of workers (all at once by default),
+    each of them has to finish within the timeout (in seconds) once started. Analyzers which did not finish
+    in time (and analyzers depending on them) are reported in the errors section instead of their results,
+    commands they run are killed.
+
+    If results for the analyzed stack of layers were computed previously, pass them as cached_results
+    to run only analyzers depending on image metadata and analyzers with no cached results. If cached_results
+    were computed for lower layers, pass also changes done by upper layers to analyze only what the upper layers
+    changed. Digests of files computed when constructing rootfs (see LayerChanges.merge) are used instead of
+    reading the files if passed, otherwise files are hashed concurrently.
+    Symbols of shared objects with known digests are looked up in the symbol cache, if provided.
+    If virtual rootfs is provided, analyzers query it instead of indexing the directory. Analyzers walking
+    rootfs share a single scan of it.
+    """
+    requested = get_analyzers(analyzers)
+    context = AnalyzerContext(
+        path=quote(path),
+        timeout=timeout,
+        previous=cached_results or {},
+        changes=changes,
+        file_digests=file_digests,
+        symbol_cache=symbol_cache,
+        rootfs=rootfs,
+    )
+
+    def _is_reused(analyzer: Analyzer) -> bool:
+        return (
+            not analyzer.image_metadata
+            and analyzer.name in context.previous
+            and (
+                changes is None
+                or (
+                    analyzer.inputs is not None and not changes.matches(analyzer.inputs)
+                )
+            )
+        )
+
+    def _run(analyzer: Analyzer) -> Any:
+        if _is_reused(analyzer):
+            _LOGGER.debug(
+                "Reusing results of analyzer %r, no relevant path changed",
+                analyzer.name,
+            )
+            result = context.previous[analyzer.name]
+            context.results[analyzer.name] = result
+            return result
+
+        with profile_phase("analyzer", analyzer.name):
+            result = analyzer.func(context)
+        context.results[analyzer.name] = result
+        return result
+
+    to_run = resolve_dependencies(requested)
+    # Analyzers walking rootfs share a single scan feeding visitors of all analyzers run.
+    context.visitors = tuple(
+        sorted(
+            {
+                visitor
+                for analyzer in to_run
+                if not _is_reused(analyzer)
+                for visitor in analyzer.visitors
+            }
+        )
+    )
+    tasks = [
+        Task(analyzer.name, functools.partial(_run, analyzer), analyzer.dependencies)
+        for analyzer in to_run
+    ]
+    results = run_tasks(tasks, workers=workers, timeout=timeout)
+    result: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for analyzer in requested:
+        if isinstance(results[analyzer.name], TimeoutExpired):
+            errors[analyzer.name] = str(results[analyzer.name])
+        else:
+            result[analyzer.name] = results[analyzer.name]
+
+    if errors:
+        result["errors"] = errors
+    return result
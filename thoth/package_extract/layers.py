@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tracking of changes done to the root filesystem by image layers."""
+
+import os
+import posixpath
+import re
+import tarfile
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Set
+
+import attr
+
+_WHITEOUT_PREFIX = ".wh."
+_WHITEOUT_OPAQUE = ".wh..wh..opq"
+_MAX_SYMLINKS = 40
+
+
+def normalize_member_name(name: str) -> str:
+    """Normalize name of a layer tarball member to a path relative to rootfs."""
+    return posixpath.normpath("/" + name).lstrip("/")
+
+
+def compile_path_patterns(patterns: Iterable[str]) -> Pattern[str]:
+    """Compile glob-like patterns matching paths relative to rootfs.
+
+    A single asterisk matches any characters except for the path separator, two asterisks match any
+    characters including the path separator, a question mark matches any single character except
+    for the path separator.
+    """
+    regexes = []
+    for pattern in patterns:
+        regex = ""
+        idx = 0
+        while idx < len(pattern):
+            if pattern.startswith("**", idx):
+                regex += ".*"
+                idx += 2
+            elif pattern[idx] == "*":
+                regex += "[^/]*"
+                idx += 1
+            elif pattern[idx] == "?":
+                regex += "[^/]"
+                idx += 1
+            else:
+                regex += re.escape(pattern[idx])
+                idx += 1
+        regexes.append(f"(?:{regex})")
+
+    return re.compile(r"\A(?:{})\Z".format("|".join(regexes) or "(?!)"))
+
+
+def _is_under(path: str, pattern: str) -> bool:
+    """Check conservatively whether a path matching the given pattern could be stored under the given directory."""
+    static_prefix = re.split(r"[*?]", pattern, maxsplit=1)[0]
+    dir_prefix = path + "/" if path else ""
+    return static_prefix.startswith(dir_prefix) or dir_prefix.startswith(static_prefix)
+
+
+def _is_within(path: str, paths: Set[str]) -> bool:
+    """Check whether the given path or any of its parent directories is present in the given set of paths."""
+    while True:
+        if path in paths:
+            return True
+
+        if not path:
+            return False
+
+        path = posixpath.dirname(path)
+
+
+def is_whiteout(name: str) -> bool:
+    """Check whether the given layer tarball member is a whiteout (including opaque directory markers)."""
+    return posixpath.basename(name).startswith(_WHITEOUT_PREFIX)
+
+
+@attr.s(slots=True)
+class LayerChanges:
+    """Paths relative to rootfs changed by an image layer (or by a stack of layers if merged).
+
+    Directories are not tracked as changed, their content is merged with content of lower layers.
+    Whited-out paths are tracked as removed, directories marked as opaque drop all their content
+    present in lower layers. Digests of selected files written by the layer are kept, symlinks are stated
+    with no digest. Size of the uncompressed layer tarball is kept if the layer was decompressed.
+    """
+
+    digest = attr.ib(type=Optional[str], default=None)
+    changed = attr.ib(type=Set[str], factory=set)
+    removed = attr.ib(type=Set[str], factory=set)
+    opaque = attr.ib(type=Set[str], factory=set)
+    digests = attr.ib(type=Dict[str, Optional[str]], factory=dict)
+    uncompressed_size = attr.ib(type=Optional[int], default=None)
+
+    @classmethod
+    def merge(cls, layer_changes: List["LayerChanges"]) -> "LayerChanges":
+        """Merge changes done by a stack of layers.
+
+        Digests of the merged changes describe files present in the flattened stack of layers.
+        """
+        result = cls()
+        for changes in layer_changes:
+            result.changed.update(changes.changed)
+            result.removed.update(changes.removed)
+            result.opaque.update(changes.opaque)
+
+            # Files are dropped if removed, if their directory was marked as opaque or replaced by a file.
+            dropped = (
+                changes.removed
+                | changes.opaque
+                | (changes.changed - changes.digests.keys())
+            )
+            if dropped and result.digests:
+                result.digests = {
+                    path: digest
+                    for path, digest in result.digests.items()
+                    if not _is_within(path, dropped)
+                }
+            result.digests.update(changes.digests)
+
+        return result
+
+    @classmethod
+    def from_dict(cls, dict_: Dict[str, Any]) -> "LayerChanges":
+        """Instantiate layer changes from their serialized form."""
+        return cls(
+            digest=dict_.get("digest"),
+            changed=set(dict_.get("changed") or []),
+            removed=set(dict_.get("removed") or []),
+            opaque=set(dict_.get("opaque") or []),
+            digests=dict(dict_.get("digests") or {}),
+            uncompressed_size=dict_.get("uncompressed_size"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize layer changes into a JSON serializable form."""
+        return {
+            "digest": self.digest,
+            "changed": sorted(self.changed),
+            "removed": sorted(self.removed),
+            "opaque": sorted(self.opaque),
+            "digests": self.digests,
+            "uncompressed_size": self.uncompressed_size,
+        }
+
+    def record_member(self, member: tarfile.TarInfo) -> None:
+        """Record a member of the layer tarball."""
+        if member.isdir():
+            return
+
+        path = normalize_member_name(member.name)
+        dir_name, base_name = posixpath.split(path)
+        if base_name == _WHITEOUT_OPAQUE:
+            self.opaque.add(dir_name)
+        elif base_name.startswith(_WHITEOUT_PREFIX):
+            self.removed.add(
+                posixpath.join(dir_name, base_name[len(_WHITEOUT_PREFIX) :])
+            )
+        else:
+            self.changed.add(path)
+
+    def is_affected(self, path: str) -> bool:
+        """Check whether the given path was changed, removed or removed as a part of a directory."""
+        if path in self.changed or path in self.removed:
+            return True
+
+        parent = posixpath.dirname(path)
+        while True:
+            if parent in self.removed or parent in self.opaque:
+                return True
+
+            if not parent:
+                return False
+
+            parent = posixpath.dirname(parent)
+
+    def is_tree_affected(self, path: str) -> bool:
+        """Check whether the given path or anything stored under it (if it is a directory) was affected."""
+        if self.is_affected(path):
+            return True
+
+        prefix = path + "/"
+        return any(
+            changed_path.startswith(prefix)
+            for changed_path in self.changed | self.removed | self.opaque
+        )
+
+    def matches(self, patterns: Iterable[str]) -> bool:
+        """Check whether any of the changes could affect paths matching the given patterns.
+
+        See compile_path_patterns for the pattern syntax.
+        """
+        patterns = list(patterns)
+        regex = compile_path_patterns(patterns)
+        if any(regex.match(path) for path in self.changed):
+            return True
+
+        for path in self.removed:
+            if regex.match(path) or any(_is_under(path, p) for p in patterns):
+                return True
+
+        return any(_is_under(path, p) for path in self.opaque for p in patterns)
+
+
+def get_real_relative_path(root_path: str, path: str) -> Optional[str]:
+    """Resolve symlinks in the given path relative to rootfs as if rootfs was the root directory.
+
+    Absolute symlinks are resolved relative to rootfs and the resolved path never escapes rootfs, None is
+    returned if too many symlinks are encountered.
+    """
+    resolved: List[str] = []
+    pending = list(reversed(path.split("/")))
+    followed = 0
+    while pending:
+        part = pending.pop()
+        if not part or part == ".":
+            continue
+
+        if part == "..":
+            if resolved:
+                resolved.pop()
+            continue
+
+        try:
+            target = os.readlink(os.path.join(root_path, *resolved, part))
+        except OSError:
+            # Not a symlink or not present at all.
+            resolved.append(part)
+            continue
+
+        followed += 1
+        if followed > _MAX_SYMLINKS:
+            return None
+
+        if target.startswith("/"):
+            resolved = []
+        pending.extend(reversed(target.split("/")))
+
+    return "/".join(resolved)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Prometheus metrics of extraction jobs pushed to a Prometheus push gateway."""
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import List
+from typing import Optional
+
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import pushadd_to_gateway
+
+from .profiling import Profile
+
+_LOGGER = logging.getLogger(__name__)
+
+_PUSH_GATEWAY_JOB = "package-extract-runtime"
+_PUSH_GATEWAY_TIMEOUT = 5.0
+
+_SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+_BYTES_BUCKETS = tuple(2**exp * 1024 * 1024 for exp in range(5, 15)) + (float("inf"),)
+_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, float("inf"))
+# Histograms observing phase profiles, keyed by phase profile attributes.
+_PHASE_HISTOGRAMS = {
+    "wall_time": (
+        "package_extract_phase_wall_seconds",
+        "Wall time spent in a phase of package extract job",
+        _SECONDS_BUCKETS,
+    ),
+    "cpu_time": (
+        "package_extract_phase_cpu_seconds",
+        "CPU time spent by the thread running a phase of package extract job",
+        _SECONDS_BUCKETS,
+    ),
+    "children_cpu_time": (
+        "package_extract_phase_children_cpu_seconds",
+        "CPU time spent by child processes during a phase of package extract job",
+        _SECONDS_BUCKETS,
+    ),
+    "max_rss": (
+        "package_extract_phase_max_rss_bytes",
+        "Peak resident set size of package extract reached by the end of a phase",
+        _BYTES_BUCKETS,
+    ),
+    "subprocesses": (
+        "package_extract_phase_subprocesses",
+        "Number of subprocesses spawned in a phase of package extract job",
+        _COUNT_BUCKETS,
+    ),
+}
+# Counters reported, keyed by names of profile counters.
+_COUNTERS = {
+    "downloaded_bytes": (
+        "package_extract_downloaded_bytes",
+        "Bytes of image blobs downloaded",
+    ),
+    "extracted_bytes": (
+        "package_extract_extracted_bytes",
+        "Bytes of files extracted from layers into rootfs or the layer cache",
+    ),
+    "layer_cache_hits": (
+        "package_extract_layer_cache_hits",
+        "Layers found in the layer cache",
+    ),
+    "layer_cache_misses": (
+        "package_extract_layer_cache_misses",
+        "Layers not found in the layer cache",
+    ),
+    "hashed_files": (
+        "package_extract_hashed_files",
+        "Files hashed when extracting layers or gathering Python files",
+    ),
+}
+
+
+# Metrics of all jobs run by the process accumulate in a single registry, a push replaces values pushed
+# previously under the same grouping key.
+_REGISTRY = CollectorRegistry()
+_JOB_TIME = Gauge(
+    "package_extract_time",
+    "Runtime of the last package extract job",
+    registry=_REGISTRY,
+)
+_HISTOGRAMS = {
+    attribute: Histogram(
+        name,
+        documentation,
+        ["phase", "analyzer"],
+        buckets=buckets,
+        registry=_REGISTRY,
+    )
+    for attribute, (name, documentation, buckets) in _PHASE_HISTOGRAMS.items()
+}
+_COUNTER_METRICS = {
+    counter_name: Counter(name, documentation, registry=_REGISTRY)
+    for counter_name, (name, documentation) in _COUNTERS.items()
+}
+_LAYER_CACHE_HIT_RATIO = Gauge(
+    "package_extract_layer_cache_hit_ratio",
+    "Ratio of layers of the last package extract job found in the layer cache",
+    registry=_REGISTRY,
+)
+_PUSH_LOCK = threading.Lock()
+# Threads pushing metrics which were not waited for yet.
+_PENDING_PUSHES: List[threading.Thread] = []
+_PENDING_PUSHES_LOCK = threading.Lock()
+
+
+def record_job(profile: Profile, duration: float) -> CollectorRegistry:
+    """Record metrics of a finished job from its profile (see profiling), return the registry to be pushed.
+
+    The registry is shared by all jobs run by the process, counters and histograms accumulate across jobs.
+    """
+    _JOB_TIME.set(duration)
+    for attribute, histogram in _HISTOGRAMS.items():
+        for phase_profile in profile.phases:
+            # Layers are not used as labels, their digests are not bounded.
+            analyzer = (
+                phase_profile.subject if phase_profile.phase == "analyzer" else ""
+            )
+            histogram.labels(phase_profile.phase, analyzer or "").observe(
+                getattr(phase_profile, attribute)
+            )
+
+    for counter_name, counter in _COUNTER_METRICS.items():
+        counter.inc(profile.counters.get(counter_name, 0))
+
+    hits = profile.counters.get("layer_cache_hits", 0)
+    lookups = hits + profile.counters.get("layer_cache_misses", 0)
+    if lookups:
+        _LAYER_CACHE_HIT_RATIO.set(hits / lookups)
+
+    return _REGISTRY
+
+
+def _push(push_gateway: str, registry: CollectorRegistry, timeout: float) -> None:
+    """Push metrics to the push gateway, errors are logged."""
+    try:
+        # Pushes are serialized so that values pushed last are the most recent ones.
+        with _PUSH_LOCK:
+            with _PENDING_PUSHES_LOCK:
+                superseded = _PENDING_PUSHES[-1] is not threading.current_thread()
+            if superseded:
+                # A push started later carries metrics of this job as well, the registry is shared.
+                _LOGGER.debug("Metrics push superseded by a newer one")
+                return
+
+            pushadd_to_gateway(
+                push_gateway,
+                job=_PUSH_GATEWAY_JOB,
+                registry=registry,
+                grouping_key={
+                    "instance": socket.gethostname(),
+                    "pid": str(os.getpid()),
+                },
+                timeout=timeout,
+            )
+    except Exception as exc:
+        _LOGGER.exception("An error occurred pushing the metrics: %s", str(exc))
+    else:
+        _LOGGER.debug("Metrics were submitted to Prometheus push gateway")
+
+
+def _get_push_timeout() -> float:
+    """Get timeout of a push to the push gateway in seconds."""
+    return float(os.getenv("PROMETHEUS_PUSHGATEWAY_TIMEOUT") or _PUSH_GATEWAY_TIMEOUT)
+
+
+def push_metrics(registry: CollectorRegistry) -> Optional[threading.Thread]:
+    """Push metrics in the background if a Prometheus push gateway is configured, return the pushing thread.
+
+    Metrics are pushed once per job grouped by the host name and the process id, the push is bounded by a timeout
+    (configurable in seconds via PROMETHEUS_PUSHGATEWAY_TIMEOUT) so a slow gateway does not delay the job. The
+    pushing thread does not keep the process running on exit, call wait_for_pushes before exiting.
+    """
+    push_gateway_host = os.getenv("PROMETHEUS_PUSHGATEWAY_HOST")
+    push_gateway_port = os.getenv("PROMETHEUS_PUSHGATEWAY_PORT")
+    if not push_gateway_host or not push_gateway_port:
+        return None
+
+    push_gateway = f"{push_gateway_host}:{push_gateway_port}"
+    _LOGGER.debug("Submitting metrics to Prometheus push gateway %s", push_gateway)
+    thread = threading.Thread(
+        target=_push,
+        args=(push_gateway, registry, _get_push_timeout()),
+        name="metrics-push",
+        daemon=True,
+    )
+    with _PENDING_PUSHES_LOCK:
+        _PENDING_PUSHES[:] = [t for t in _PENDING_PUSHES if t.is_alive()]
+        _PENDING_PUSHES.append(thread)
+    thread.start()
+    return thread
+
+
+def wait_for_pushes(timeout: Optional[float] = None) -> bool:
+    """Wait for metrics pushed in the background, return True if all pushes finished in time.
+
+    The wait is bounded by the push timeout (PROMETHEUS_PUSHGATEWAY_TIMEOUT) unless a timeout is given. As
+    the registry accumulates metrics of all jobs, the last push carries metrics of all jobs run by the process.
+    """
+    deadline = time.monotonic() + (_get_push_timeout() if timeout is None else timeout)
+    with _PENDING_PUSHES_LOCK:
+        threads = list(_PENDING_PUSHES)
+
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0.0))
+
+    with _PENDING_PUSHES_LOCK:
+        _PENDING_PUSHES[:] = [t for t in _PENDING_PUSHES if t.is_alive()]
+        if _PENDING_PUSHES:
+            _LOGGER.warning(
+                "Metrics were not submitted to Prometheus push gateway in time"
+            )
+            return False
+
+    return True
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Measurement of resources used by phases of image extraction and counting of work done."""
+
+import contextlib
+import contextvars
+import resource
+import sys
+import threading
+import time
+from typing import Any
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+
+_SUBPROCESS_EVENT = "subprocess.Popen"
+
+_PROFILE: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar(
+    "profile", default=None
+)
+# Counters of subprocesses spawned in all phases active in the current context (nested phases included).
+_SUBPROCESS_COUNTERS: contextvars.ContextVar[
+    Tuple["_Counter", ...]
+] = contextvars.ContextVar("subprocess_counters", default=())
+_AUDIT_HOOK_LOCK = threading.Lock()
+_audit_hook_installed = False
+
+
+class _Counter:
+    """A thread-safe counter."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        """Initialize the counter to zero."""
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self) -> None:
+        """Increment the counter by one."""
+        with self._lock:
+            self.value += 1
+
+
+@attr.s(slots=True)
+class PhaseProfile:
+    """Resources used by a phase of extraction.
+
+    CPU time is the time spent by the thread running the phase, CPU time of child processes is measured
+    process-wide and includes children of phases run concurrently. Peak RSS is the maximum resident set size
+    of the process (and of the largest child process) reached by the end of the phase, in bytes.
+    """
+
+    phase = attr.ib(type=str)
+    subject = attr.ib(type=Optional[str], default=None)
+    wall_time = attr.ib(type=float, default=0.0)
+    cpu_time = attr.ib(type=float, default=0.0)
+    children_cpu_time = attr.ib(type=float, default=0.0)
+    max_rss = attr.ib(type=int, default=0)
+    children_max_rss = attr.ib(type=int, default=0)
+    subprocesses = attr.ib(type=int, default=0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the phase profile into a JSON serializable form."""
+        return attr.asdict(self)
+
+
+@attr.s(slots=True)
+class Profile:
+    """Profiles of phases and counters recorded (possibly concurrently) during a single extraction."""
+
+    phases = attr.ib(type=List[PhaseProfile], factory=list)
+    counters = attr.ib(type=Dict[str, int], factory=dict)
+    _lock = attr.ib(type=threading.Lock, factory=threading.Lock, repr=False)
+
+    def record(self, phase_profile: PhaseProfile) -> None:
+        """Record profile of a finished phase."""
+        with self._lock:
+            self.phases.append(phase_profile)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Increment the named counter by the given amount."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize recorded phases (in the order they finished) and counters into a JSON serializable form."""
+        with self._lock:
+            return {
+                "phases": [phase_profile.to_dict() for phase_profile in self.phases],
+                "counters": dict(self.counters),
+            }
+
+
+def _audit_hook(event: str, _: Tuple[Any, ...]) -> None:
+    """Count subprocesses spawned in phases active in the current context."""
+    if event == _SUBPROCESS_EVENT:
+        for counter in _SUBPROCESS_COUNTERS.get():
+            counter.increment()
+
+
+def _install_audit_hook() -> None:
+    """Install the audit hook counting subprocesses, audit hooks cannot be removed so it is installed once."""
+    global _audit_hook_installed
+
+    with _AUDIT_HOOK_LOCK:
+        if not _audit_hook_installed:
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+
+
+def _get_children_cpu_time() -> float:
+    """Get CPU time consumed by terminated child processes of this process."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def collect_profile() -> Generator[Profile, None, None]:
+    """Collect profiles of phases run in the current context, including threads run in copies of the context."""
+    _install_audit_hook()
+    profile = Profile()
+    token = _PROFILE.set(profile)
+    try:
+        yield profile
+    finally:
+        _PROFILE.reset(token)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Increment the named counter, the counter is recorded only if a profile is being collected."""
+    profile = _PROFILE.get()
+    if profile is not None:
+        profile.count(name, amount)
+
+
+@contextlib.contextmanager
+def profile_phase(
+    phase: str, subject: Optional[str] = None
+) -> Generator[None, None, None]:
+    """Measure resources used by a phase, the phase is recorded only if a profile is being collected."""
+    profile = _PROFILE.get()
+    if profile is None:
+        yield
+        return
+
+    counter = _Counter()
+    token = _SUBPROCESS_COUNTERS.set(_SUBPROCESS_COUNTERS.get() + (counter,))
+    start_wall_time = time.monotonic()
+    start_cpu_time = time.thread_time()
+    start_children_cpu_time = _get_children_cpu_time()
+    try:
+        yield
+    finally:
+        _SUBPROCESS_COUNTERS.reset(token)
+        # ru_maxrss is reported in kilobytes on Linux.
+        profile.record(
+            PhaseProfile(
+                phase=phase,
+                subject=subject,
+                wall_time=time.monotonic() - start_wall_time,
+                cpu_time=time.thread_time() - start_cpu_time,
+                children_cpu_time=_get_children_cpu_time() - start_children_cpu_time,
+                max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                children_max_rss=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                * 1024,
+                subprocesses=counter.value,
+            )
+        )
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Discovery of installed Python distributions by reading their metadata, no code of the image is run."""
+
+import email.parser
+import logging
+import posixpath
+import re
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .vfs import VirtualRootfs
+
+_LOGGER = logging.getLogger(__name__)
+
+# Names of directories Python distributions are installed into, dist-packages is used by Debian based systems.
+LIBRARY_DIRECTORIES = frozenset(("site-packages", "dist-packages"))
+
+_HEADER_PARSER = email.parser.HeaderParser()
+_HEADERS_END_RE = re.compile(r"\r?\n\r?\n")
+
+
+def canonicalize_name(name: str) -> str:
+    """Canonicalize a distribution name as stated in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_metadata(content: str) -> Tuple[Optional[str], Optional[str]]:
+    """Parse name and version of a distribution from content of METADATA or PKG-INFO file, only headers are parsed."""
+    headers = _HEADER_PARSER.parsestr(_HEADERS_END_RE.split(content, maxsplit=1)[0])
+    name = headers.get("Name")
+    version = headers.get("Version")
+    return (
+        name.strip() if name else None,
+        version.strip() if version else None,
+    )
+
+
+def _get_metadata_path(rootfs: VirtualRootfs, path: str) -> Optional[str]:
+    """Get path to the metadata file of a distribution stated by the given library directory entry."""
+    name = posixpath.basename(path)
+    if name.endswith(".dist-info"):
+        metadata_path = posixpath.join(path, "METADATA")
+    elif name.endswith(".egg-info") and rootfs.isdir(path):
+        metadata_path = posixpath.join(path, "PKG-INFO")
+    elif name.endswith(".egg-info"):
+        # Distributions installed by distutils state metadata in a single file.
+        metadata_path = path
+    elif name.endswith(".egg"):
+        metadata_path = posixpath.join(path, "EGG-INFO", "PKG-INFO")
+    elif name.endswith(".egg-link"):
+        # Development installations link to a project directory with egg-info.
+        project_path = rootfs.read_text(path, errors="replace").split("\n")[0].strip()
+        if not project_path or not rootfs.isdir(project_path):
+            return None
+
+        egg_infos = [
+            entry
+            for entry in rootfs.listdir(project_path)
+            if entry.endswith(".egg-info")
+        ]
+        if not egg_infos:
+            return None
+        metadata_path = posixpath.join(project_path, egg_infos[0], "PKG-INFO")
+    else:
+        return None
+
+    return metadata_path if rootfs.isfile(metadata_path) else None
+
+
+def read_distributions(rootfs: VirtualRootfs, location: str) -> List[Dict[str, Any]]:
+    """Read name and version of Python distributions installed in the given library directory.
+
+    Distributions are reported once per canonical name, sorted by name as pip freeze does.
+    """
+    distributions: Dict[str, Tuple[str, str]] = {}
+    for entry in rootfs.listdir(location):
+        entry_path = posixpath.join(location, entry)
+        try:
+            metadata_path = _get_metadata_path(rootfs, entry_path)
+            if metadata_path is None:
+                continue
+
+            name, version = parse_metadata(
+                rootfs.read_text(metadata_path, errors="replace")
+            )
+        except (OSError, ValueError) as exc:
+            _LOGGER.warning(
+                "Failed to read metadata of Python distribution %r: %s",
+                entry_path,
+                str(exc),
+            )
+            continue
+
+        if not name or not version:
+            _LOGGER.debug("No name or version stated in metadata of %r", entry_path)
+            continue
+
+        distributions.setdefault(canonicalize_name(name), (name, version))
+
+    return [
+        {
+            "package_name": name,
+            "package_version": version,
+            "location": "/" + location,
+        }
+        for name, version in sorted(
+            distributions.values(), key=lambda item: item[0].lower()
+        )
+    ]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Detection of Python interpreter versions by static inspection of interpreter binaries, nothing is executed."""
+
+import logging
+import posixpath
+import re
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .elf import ELFError
+from .elf import get_linking_info
+from .elf import get_read_only_data
+from .vfs import VirtualRootfs
+
+_LOGGER = logging.getLogger(__name__)
+
+# Directories searched for shared libraries when not found in paths stated by the interpreter.
+_LIBRARY_DIRECTORIES = (
+    "lib64",
+    "usr/lib64",
+    "lib",
+    "usr/lib",
+    "usr/local/lib64",
+    "usr/local/lib",
+)
+# Directories holding the standard library of installed interpreters (pythonX.Y).
+_STDLIB_PARENT_DIRECTORIES = (
+    "usr/lib64",
+    "usr/lib",
+    "usr/local/lib64",
+    "usr/local/lib",
+)
+
+_LIBPYTHON_RE = re.compile(r"^libpython(\d+\.\d+)")
+_SERIES_RE = re.compile(r"python(\d+\.\d+)")
+_STDLIB_RE = re.compile(r"^python(\d+\.\d+)$")
+
+
+def _find_library(
+    rootfs: VirtualRootfs, soname: str, search_paths: List[str], origin: str
+) -> Optional[str]:
+    """Find a shared library in rootfs as the dynamic linker would, return path to the library resolved."""
+    directories = [
+        path.replace("$ORIGIN", origin).replace("${ORIGIN}", origin)
+        for path in search_paths
+    ]
+    directories.extend(_LIBRARY_DIRECTORIES)
+    # Debian based distributions use multiarch library directories, such as usr/lib/x86_64-linux-gnu.
+    for parent in ("lib", "usr/lib"):
+        if rootfs.isdir(parent):
+            directories.extend(
+                posixpath.join(parent, name)
+                for name in rootfs.listdir(parent)
+                if name.endswith("-linux-gnu")
+            )
+
+    for directory in directories:
+        library_path = rootfs.resolve(posixpath.join(directory, soname))
+        if library_path is not None and rootfs.isfile(library_path):
+            return library_path
+
+    return None
+
+
+def get_stdlib_series(rootfs: VirtualRootfs) -> List[str]:
+    """Get versions (major.minor) of Python standard libraries present in rootfs, sorted."""
+    result = set()
+    for parent in _STDLIB_PARENT_DIRECTORIES:
+        if not rootfs.isdir(parent):
+            continue
+
+        for name in rootfs.listdir(parent):
+            match = _STDLIB_RE.match(name)
+            if match and rootfs.isfile(posixpath.join(parent, name, "os.py")):
+                result.add(match.group(1))
+
+    return sorted(
+        result, key=lambda series: tuple(int(part) for part in series.split("."))
+    )
+
+
+def _search_version(data: bytes, series: str) -> Optional[str]:
+    """Search the version of the given series stated in read-only data of an ELF file (as PY_VERSION is)."""
+    match = re.search(
+        rb"(?<![\w.])("
+        + re.escape(series.encode())
+        + rb"\.\d+(?:(?:a|b|rc)\d+)?\+?)\x00",
+        data,
+    )
+    return match.group(1).decode() if match else None
+
+
+def _read_version_data(
+    rootfs: VirtualRootfs, interpreter_path: str
+) -> Tuple[List[bytes], Optional[str]]:
+    """Read data the interpreter version can be stated in, return them with series stated by libpython linked."""
+    content = rootfs.read_bytes(interpreter_path)
+    linking_info = get_linking_info(content)
+    if linking_info is None:
+        _LOGGER.debug("Python interpreter %r is not an ELF file", interpreter_path)
+        return [], None
+
+    result = [get_read_only_data(content) or b""]
+    needed, search_paths = linking_info
+    for soname in needed:
+        match = _LIBPYTHON_RE.match(soname)
+        if not match:
+            continue
+
+        library_path = _find_library(
+            rootfs, soname, search_paths, "/" + posixpath.dirname(interpreter_path)
+        )
+        if library_path is None:
+            _LOGGER.warning(
+                "Library %r needed by Python interpreter %r not found",
+                soname,
+                interpreter_path,
+            )
+        else:
+            result.append(get_read_only_data(rootfs.read_bytes(library_path)) or b"")
+
+        return result, match.group(1)
+
+    return result, None
+
+
+def get_python_version(rootfs: VirtualRootfs, interpreter_path: str) -> Optional[str]:
+    """Get version of the given Python interpreter (path resolved in rootfs) as reported by python --version.
+
+    The version is searched in read-only data of the interpreter binary or libpython it is linked against.
+    Versions (major.minor) to be searched for are determined based on libpython linked, name of
+    the interpreter and versions of standard libraries installed, in this order.
+    """
+    try:
+        data, series = _read_version_data(rootfs, interpreter_path)
+    except (OSError, ValueError, ELFError) as exc:
+        _LOGGER.warning(
+            "Failed to read Python interpreter %r to obtain its version: %s",
+            interpreter_path,
+            str(exc),
+        )
+        return None
+
+    if not data:
+        return None
+
+    stdlib_series = get_stdlib_series(rootfs)
+    if series is not None:
+        candidates = [series]
+    else:
+        match = _SERIES_RE.search(posixpath.basename(interpreter_path))
+        candidates = [match.group(1)] if match else list(reversed(stdlib_series))
+
+    for candidate in candidates:
+        for chunk in data:
+            version = _search_version(chunk, candidate)
+            if version is not None:
+                if candidate not in stdlib_series:
+                    _LOGGER.warning(
+                        "No standard library found for Python interpreter %r in version %s",
+                        interpreter_path,
+                        version,
+                    )
+                return f"Python {version}"
+
+    _LOGGER.debug("No version stated in Python interpreter %r", interpreter_path)
+    return None
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A client pulling images from container registries implementing the Docker Registry HTTP API V2."""
+
+import base64
+import concurrent.futures
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import BlobCache
+from .exceptions import ThothPkgdepsException
+from .exceptions import TimeoutExpired
+from .profiling import count
+from .profiling import profile_phase
+
+_LOGGER = logging.getLogger(__name__)
+
+_DOCKER_HUB_NAMES = frozenset(("docker.io", "index.docker.io"))
+_DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+_MANIFEST_LIST_MEDIA_TYPES = frozenset(
+    (
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.index.v1+json",
+    )
+)
+_MANIFEST_MEDIA_TYPES = (
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    *sorted(_MANIFEST_LIST_MEDIA_TYPES),
+    "application/vnd.docker.distribution.manifest.v1+prettyjws",
+    "application/vnd.docker.distribution.manifest.v1+json",
+)
+# Architectures as reported by platform.machine() mapped to names used in manifest lists.
+_ARCHITECTURES = {
+    "x86_64": "amd64",
+    "aarch64": "arm64",
+    "armv7l": "arm",
+    "i686": "386",
+}
+_CHALLENGE_PARAMETER_RE = re.compile(r'(\w+)="([^"]*)"')
+_CHUNK_SIZE = 1024 * 1024
+_DEFAULT_WORKERS = 4
+_MAX_RETRIES = 3
+_SOCKET_TIMEOUT = 60.0
+# The version of skopeo's dir: transport layout written.
+_DIR_TRANSPORT_VERSION = "Directory Transport Version: 1.1\n"
+
+
+class RegistryError(ThothPkgdepsException):  # noqa: N818
+    """Raised if an image cannot be pulled from a registry."""
+
+
+@attr.s(slots=True, frozen=True)
+class ImageReference:
+    """A reference to an image in a registry, the reference is either a tag or a digest."""
+
+    registry = attr.ib(type=str)
+    repository = attr.ib(type=str)
+    reference = attr.ib(type=str)
+
+    @classmethod
+    def parse(cls, image_name: str) -> "ImageReference":
+        """Parse an image name, images without registry stated are pulled from Docker Hub as skopeo does."""
+        name = (
+            image_name[len("docker://") :]
+            if image_name.startswith("docker://")
+            else image_name
+        )
+        name, _, digest = name.partition("@")
+        first, _, rest = name.partition("/")
+        if rest and ("." in first or ":" in first or first == "localhost"):
+            registry, repository = first, rest
+        else:
+            registry, repository = "docker.io", name
+
+        reference = digest
+        last_component_start = repository.rfind("/") + 1
+        tag_start = repository.find(":", last_component_start)
+        if tag_start != -1:
+            # Tag is ignored if digest is stated.
+            reference = reference or repository[tag_start + 1 :]
+            repository = repository[:tag_start]
+
+        if registry in _DOCKER_HUB_NAMES:
+            registry = _DOCKER_HUB_REGISTRY
+            if "/" not in repository:
+                repository = f"library/{repository}"
+
+        if not repository or not re.fullmatch(
+            r"[a-z0-9]+(?:[._/-]+[a-z0-9]+)*", repository
+        ):
+            raise RegistryError(f"Invalid image name {image_name!r}")
+
+        return cls(
+            registry=registry, repository=repository, reference=reference or "latest"
+        )
+
+
+def _get_platform() -> Tuple[str, str]:
+    """Get operating system and architecture of images pulled from manifest lists, the host platform is used."""
+    machine = platform.machine()
+    return "linux", _ARCHITECTURES.get(machine, machine)
+
+
+def _verify_digest(digest: str, content: bytes) -> None:
+    """Verify the given content matches the given digest."""
+    algorithm, _, expected = digest.partition(":")
+    if algorithm not in hashlib.algorithms_available:
+        raise RegistryError(f"Unsupported digest algorithm in {digest!r}")
+
+    if hashlib.new(algorithm, content).hexdigest() != expected:
+        raise RegistryError(f"Content does not match digest {digest!r}")
+
+
+class RegistryClient:
+    """A client of a single repository in a registry, safe to be used from multiple threads.
+
+    Connections are pooled and kept alive for the given number of concurrent downloads. Bearer token
+    (obtained with the given credentials, if any) and basic authentication are supported, the token is
+    renewed if it expires. Registries are accessed over HTTPS unless plain HTTP is requested.
+    """
+
+    def __init__(
+        self,
+        image: ImageReference,
+        *,
+        credentials: Optional[str] = None,
+        tls_verify: bool = True,
+        plain_http: bool = False,
+        timeout: Optional[float] = None,
+        workers: int = _DEFAULT_WORKERS,
+    ) -> None:
+        """Initialize a client pulling the given image, the timeout bounds all requests done by the client."""
+        self.image = image
+        self.base_url = f"{'http' if plain_http else 'https'}://{image.registry}/v2/{image.repository}"
+        self._auth: Optional[Tuple[str, str]] = None
+        if credentials:
+            user, _, password = credentials.partition(":")
+            self._auth = (user, password)
+
+        self._deadline = time.monotonic() + timeout if timeout else None
+        self._timeout = timeout
+        self._authorization: Optional[str] = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.verify = tls_verify
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self) -> None:
+        """Close pooled connections."""
+        self._session.close()
+
+    def _get_socket_timeout(self) -> float:
+        """Get timeout of socket operations, raise TimeoutExpired if the deadline of the client passed."""
+        if self._deadline is None:
+            return _SOCKET_TIMEOUT
+
+        remaining = self._deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutExpired(
+                f"Pulling image did not finish in {self._timeout} seconds"
+            )
+
+        return min(remaining, _SOCKET_TIMEOUT)
+
+    def _authenticate(self, challenge: str, authorization: Optional[str]) -> None:
+        """Authenticate as requested by the challenge of a response refused with the given authorization."""
+        with self._lock:
+            if self._authorization != authorization:
+                # Another thread has already renewed authorization.
+                return
+
+            scheme, _, parameters_str = challenge.partition(" ")
+            parameters = dict(_CHALLENGE_PARAMETER_RE.findall(parameters_str))
+            if scheme.lower() == "basic":
+                if self._auth is None:
+                    raise RegistryError(
+                        f"Registry {self.image.registry!r} requires credentials"
+                    )
+                user_password = ":".join(self._auth).encode()
+                self._authorization = (
+                    f"Basic {base64.b64encode(user_password).decode()}"
+                )
+                return
+
+            if scheme.lower() != "bearer" or "realm" not in parameters:
+                raise RegistryError(
+                    f"Unsupported authentication challenge {challenge!r}"
+                )
+
+            params = {
+                "scope": parameters.get("scope")
+                or f"repository:{self.image.repository}:pull"
+            }
+            if "service" in parameters:
+                params["service"] = parameters["service"]
+
+            _LOGGER.debug(
+                "Obtaining token from %r for %r", parameters["realm"], params["scope"]
+            )
+            response = self._session.get(
+                parameters["realm"],
+                params=params,
+                auth=self._auth,
+                timeout=self._get_socket_timeout(),
+            )
+            if response.status_code != 200:
+                raise RegistryError(
+                    f"Failed to obtain token from {parameters['realm']!r} (status {response.status_code})"
+                )
+
+            token_response = response.json()
+            token = token_response.get("token") or token_response.get("access_token")
+            if not token:
+                raise RegistryError(f"No token obtained from {parameters['realm']!r}")
+
+            self._authorization = f"Bearer {token}"
+
+    def _request(
+        self, path: str, headers: Optional[Dict[str, str]] = None, stream: bool = False
+    ) -> requests.Response:
+        """Issue a GET request to the repository API, authenticate if requested by the registry."""
+        for _ in range(2):
+            authorization = self._authorization
+            request_headers = dict(headers or {})
+            if authorization:
+                request_headers["Authorization"] = authorization
+
+            response = self._session.get(
+                f"{self.base_url}/{path}",
+                headers=request_headers,
+                stream=stream,
+                timeout=self._get_socket_timeout(),
+            )
+            challenge = response.headers.get("WWW-Authenticate")
+            if response.status_code != 401 or not challenge:
+                break
+
+            response.close()
+            self._authenticate(challenge, authorization)
+
+        if response.status_code not in (200, 206):
+            response.close()
+            raise RegistryError(
+                f"Request for {path!r} in {self.image.registry}/{self.image.repository} "
+                f"failed with status {response.status_code}"
+            )
+
+        return response
+
+    def get_manifest(
+        self, reference: Optional[str] = None
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """Get manifest of the image (or of the given reference) as served and parsed.
+
+        Manifest lists are resolved to the manifest for the host platform. Manifests referenced by a digest are
+        verified, schema 1 manifests are signed in their content and cannot be verified by digest.
+        """
+        reference = reference or self.image.reference
+        with self._request(
+            f"manifests/{reference}",
+            headers={"Accept": ", ".join(_MANIFEST_MEDIA_TYPES)},
+        ) as response:
+            content = response.content
+            media_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+
+        manifest = json.loads(content)
+        media_type = manifest.get("mediaType") or media_type
+        if ":" in reference and manifest.get("schemaVersion") != 1:
+            _verify_digest(reference, content)
+
+        if media_type in _MANIFEST_LIST_MEDIA_TYPES or "manifests" in manifest:
+            os_name, architecture = _get_platform()
+            for entry in manifest.get("manifests", []):
+                entry_platform = entry.get("platform", {})
+                if (
+                    entry_platform.get("os") == os_name
+                    and entry_platform.get("architecture") == architecture
+                ):
+                    _LOGGER.debug(
+                        "Using manifest %r for %s/%s",
+                        entry["digest"],
+                        os_name,
+                        architecture,
+                    )
+                    return self.get_manifest(entry["digest"])
+
+            raise RegistryError(
+                f"No manifest for {os_name}/{architecture} found in the manifest list"
+            )
+
+        return content, manifest
+
+    def download_blob(self, digest: str, path: str, size: Optional[int] = None) -> int:
+        """Download a blob to the given path verifying its digest as it is streamed, return size of the blob.
+
+        Interrupted downloads are resumed from the last byte received using range requests, a download is
+        restarted if the registry does not support ranges.
+        """
+        algorithm, _, expected = digest.partition(":")
+        if algorithm not in hashlib.algorithms_available:
+            raise RegistryError(f"Unsupported digest algorithm in {digest!r}")
+
+        received = 0
+        offset = 0
+        retries = 0
+        hasher = hashlib.new(algorithm)
+        partial_path = f"{path}.partial"
+        with profile_phase("download-blob", digest), open(
+            partial_path, "wb"
+        ) as blob_file:
+            while True:
+                # Blobs are compressed already, they are stored as served.
+                headers = {"Accept-Encoding": "identity"}
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+
+                try:
+                    with self._request(
+                        f"blobs/{digest}", headers=headers, stream=True
+                    ) as response:
+                        if offset and response.status_code != 206:
+                            _LOGGER.debug(
+                                "Registry does not support ranges, restarting download of %r",
+                                digest,
+                            )
+                            blob_file.seek(0)
+                            blob_file.truncate()
+                            hasher = hashlib.new(algorithm)
+                            offset = 0
+
+                        for chunk in response.iter_content(_CHUNK_SIZE):
+                            blob_file.write(chunk)
+                            hasher.update(chunk)
+                            offset += len(chunk)
+                            received += len(chunk)
+                            self._get_socket_timeout()
+                    break
+                except (
+                    requests.ConnectionError,
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                ) as exc:
+                    retries += 1
+                    if retries > _MAX_RETRIES:
+                        raise RegistryError(
+                            f"Failed to download blob {digest!r}: {str(exc)}"
+                        ) from exc
+
+                    _LOGGER.warning(
+                        "Download of blob %r interrupted after %d bytes, resuming: %s",
+                        digest,
+                        offset,
+                        str(exc),
+                    )
+
+        count("downloaded_bytes", received)
+        if (size is not None and offset != size) or hasher.hexdigest() != expected:
+            os.remove(partial_path)
+            raise RegistryError(f"Downloaded blob does not match digest {digest!r}")
+
+        os.rename(partial_path, path)
+        return offset
+
+
+def _get_blobs(manifest: Dict[str, Any]) -> List[Tuple[str, Optional[int], bool]]:
+    """Get digests and sizes (if stated) of blobs referenced by the manifest together with a flag marking layers."""
+    if manifest.get("schemaVersion") == 1:
+        # Schema 1 manifests state layers from the top layer, the same blob can be referenced multiple times.
+        blobs = [
+            (layer_def["blobSum"], None, True)
+            for layer_def in reversed(manifest["fsLayers"])
+        ]
+    elif manifest.get("schemaVersion") == 2:
+        blobs = [(manifest["config"]["digest"], manifest["config"].get("size"), False)]
+        blobs.extend(
+            (layer_def["digest"], layer_def.get("size"), True)
+            for layer_def in manifest["layers"]
+        )
+    else:
+        raise RegistryError(
+            f"Invalid schema version in manifest: {manifest.get('schemaVersion')}"
+        )
+
+    result = []
+    seen = set()
+    for digest, size, is_layer in blobs:
+        if digest not in seen:
+            seen.add(digest)
+            result.append((digest, size, is_layer))
+
+    return result
+
+
+def _fetch_blob(
+    client: RegistryClient,
+    digest: str,
+    path: str,
+    size: Optional[int],
+    blob_cache: Optional[BlobCache],
+) -> None:
+    """Fetch a blob to the given path, the blob is taken from the blob cache or downloaded and stored there."""
+    if blob_cache is None:
+        client.download_blob(digest, path, size)
+        return
+
+    blob_name = digest.split(":", maxsplit=1)[-1]
+    # Jobs pulling the same blob concurrently wait for the first one to download it.
+    with blob_cache.lock(blob_name):
+        if blob_cache.link(blob_name, path):
+            return
+
+        client.download_blob(digest, path, size)
+        blob_cache.store(blob_name, path)
+
+
+def pull_image(
+    image_name: str,
+    dir_path: str,
+    *,
+    registry_credentials: Optional[str] = None,
+    tls_verify: bool = True,
+    plain_http: bool = False,
+    timeout: Optional[float] = None,
+    workers: Optional[int] = None,
+    skip_layer: Optional[Callable[[str], bool]] = None,
+    blob_cache: Optional[BlobCache] = None,
+) -> None:
+    """Pull an image into dir_path in the layout of skopeo's dir: transport.
+
+    Blobs are downloaded concurrently by the given number of workers. Layers for which skip_layer returns true
+    (called with the hex digest of the layer, blobs of which size is stated in the manifest) are not downloaded,
+    such as layers already present in the layer cache. Blobs are taken from the blob cache if provided, blobs
+    downloaded are stored there, so jobs sharing the cache download each blob once.
+    """
+    image = ImageReference.parse(image_name)
+    workers = workers or _DEFAULT_WORKERS
+    _LOGGER.debug("Pulling image %r from %r", image.repository, image.registry)
+    client = RegistryClient(
+        image,
+        credentials=registry_credentials,
+        tls_verify=tls_verify,
+        plain_http=plain_http,
+        timeout=timeout,
+        workers=workers,
+    )
+    try:
+        content, manifest = client.get_manifest()
+        with open(os.path.join(dir_path, "manifest.json"), "wb") as manifest_file:
+            manifest_file.write(content)
+        with open(os.path.join(dir_path, "version"), "w") as version_file:
+            version_file.write(_DIR_TRANSPORT_VERSION)
+
+        to_download = []
+        for digest, size, is_layer in _get_blobs(manifest):
+            blob_name = digest.split(":", maxsplit=1)[-1]
+            if (
+                is_layer
+                and size is not None
+                and skip_layer is not None
+                and skip_layer(blob_name)
+            ):
+                _LOGGER.debug("Skipping download of layer %r", blob_name)
+                continue
+
+            to_download.append((digest, os.path.join(dir_path, blob_name), size))
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="download"
+        ) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    _fetch_blob,
+                    client,
+                    digest,
+                    path,
+                    size,
+                    blob_cache,
+                )
+                for digest, path, size in to_download
+            ]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        client.close()
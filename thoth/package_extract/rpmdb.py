@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A reader of rpm databases (SQLite, Berkeley DB hash and NDB) found in container images."""
+
+import logging
+import os
+import sqlite3
+import struct
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+
+from .exceptions import ThothPkgdepsException
+from .layers import get_real_relative_path
+
+_LOGGER = logging.getLogger(__name__)
+
+# Directories with rpmdb, relative to rootfs, in order of preference.
+_RPMDB_PATHS = ("usr/lib/sysimage/rpm", "var/lib/rpm")
+
+_TAG_NAME = 1000
+_TAG_VERSION = 1001
+_TAG_RELEASE = 1002
+_TAG_EPOCH = 1003
+_TAG_ARCH = 1022
+_TAG_REQUIREFLAGS = 1048
+_TAG_REQUIRENAME = 1049
+_TAG_REQUIREVERSION = 1050
+
+_TYPE_INT32 = 4
+_TYPE_STRING = 6
+_TYPE_STRING_ARRAY = 8
+_TYPE_I18NSTRING = 9
+
+_RPMSENSE_LESS = 1 << 1
+_RPMSENSE_GREATER = 1 << 2
+_RPMSENSE_EQUAL = 1 << 3
+_RPMSENSE_MISSINGOK = 1 << 19
+_RPMSENSE_RPMLIB = 1 << 24
+
+_BDB_HASH_MAGIC = 0x061561
+_BDB_PAGE_HEADER_SIZE = 26
+_BDB_P_HASH_UNSORTED = 2
+_BDB_P_HASH = 13
+_BDB_H_KEYDATA = 1
+_BDB_H_OFFPAGE = 3
+_BDB_METAFLAG_CHKSUM = 0x01
+
+_NDB_HEADER_MAGIC = 0x506D7052  # "RpmP"
+_NDB_SLOT_MAGIC = 0x746F6C53  # "Slot"
+_NDB_BLOB_MAGIC = 0x53626C42  # "BlbS"
+_NDB_SLOTS_PER_PAGE = 4096 // 16
+_NDB_BLOCK_SIZE = 16
+
+
+class RpmDBError(ThothPkgdepsException):  # noqa: N818
+    """Raised on a malformed or unsupported rpm database."""
+
+
+@attr.s(slots=True)
+class RpmPackage:
+    """A package installed as recorded in rpmdb."""
+
+    name = attr.ib(type=str)
+    version = attr.ib(type=str)
+    release = attr.ib(type=str)
+    epoch = attr.ib(type=Optional[int], default=None)
+    arch = attr.ib(type=Optional[str], default=None)
+    requires = attr.ib(type=List[str], factory=list)
+
+    @property
+    def nvra(self) -> str:
+        """Get package identifier as listed by `rpm -qa'."""
+        result = f"{self.name}-{self.version}-{self.release}"
+        if self.arch:
+            result += f".{self.arch}"
+        return result
+
+    @property
+    def package_identifier(self) -> str:
+        """Get package identifier as listed by dnf, epoch is stated only if non-zero."""
+        epoch = f"{self.epoch}:" if self.epoch else ""
+        return f"{self.name}-{epoch}{self.version}-{self.release}.{self.arch}"
+
+
+def _format_dependency(name: str, flags: int, version: str) -> str:
+    """Format a dependency in the form used by dnf."""
+    operator = ""
+    if flags & _RPMSENSE_LESS:
+        operator += "<"
+    if flags & _RPMSENSE_GREATER:
+        operator += ">"
+    if flags & _RPMSENSE_EQUAL:
+        operator += "="
+
+    if not version or not operator:
+        return name
+
+    return f"{name} {operator} {version}"
+
+
+def parse_header(blob: bytes) -> Dict[int, Any]:
+    """Parse a header blob as stored in rpmdb, only tags of types used for package metadata are parsed."""
+    if len(blob) < 8:
+        raise RpmDBError("Header blob too short")
+
+    index_length, data_length = struct.unpack_from(">II", blob, 0)
+    data_start = 8 + index_length * 16
+    if data_start + data_length > len(blob):
+        raise RpmDBError("Header blob truncated")
+
+    result: Dict[int, Any] = {}
+    for idx in range(index_length):
+        tag, type_, offset, count = struct.unpack_from(">IIII", blob, 8 + idx * 16)
+        if offset >= data_length:
+            continue
+
+        offset += data_start
+        if type_ == _TYPE_INT32:
+            if offset + count * 4 > data_start + data_length:
+                raise RpmDBError(f"Header tag {tag} out of bounds")
+            result[tag] = list(struct.unpack_from(f">{count}i", blob, offset))
+        elif type_ in (_TYPE_STRING, _TYPE_STRING_ARRAY, _TYPE_I18NSTRING):
+            strings = []
+            for _ in range(count if type_ != _TYPE_STRING else 1):
+                end = blob.find(b"\0", offset, data_start + data_length)
+                if end == -1:
+                    raise RpmDBError(f"Unterminated string in header tag {tag}")
+                strings.append(blob[offset:end].decode("utf-8", errors="replace"))
+                offset = end + 1
+            result[tag] = strings if type_ == _TYPE_STRING_ARRAY else strings[0]
+
+    return result
+
+
+def _package_from_header(blob: bytes) -> RpmPackage:
+    """Construct package information from a header blob."""
+    header = parse_header(blob)
+    if _TAG_NAME not in header:
+        raise RpmDBError("No package name stated in the header")
+
+    names = header.get(_TAG_REQUIRENAME, [])
+    flags = header.get(_TAG_REQUIREFLAGS, [])
+    versions = header.get(_TAG_REQUIREVERSION, [])
+    if len(flags) != len(names) or len(versions) != len(names):
+        raise RpmDBError(
+            f"Inconsistent requirements stated in header of {header[_TAG_NAME]!r}"
+        )
+
+    requires = set()
+    for name, flag, version in zip(names, flags, versions):
+        # Weak dependencies are not requirements, rpmlib() features are not listed by repoquery.
+        if not flag & (_RPMSENSE_MISSINGOK | _RPMSENSE_RPMLIB):
+            requires.add(_format_dependency(name, flag, version))
+
+    return RpmPackage(
+        name=header[_TAG_NAME],
+        version=header.get(_TAG_VERSION, ""),
+        release=header.get(_TAG_RELEASE, ""),
+        epoch=header[_TAG_EPOCH][0] if header.get(_TAG_EPOCH) else None,
+        arch=header.get(_TAG_ARCH),
+        requires=sorted(requires),
+    )
+
+
+def _read_sqlite(db_path: str) -> List[bytes]:
+    """Read header blobs from an SQLite rpmdb."""
+    try:
+        # The database is opened as immutable, nothing is written to rootfs.
+        connection = sqlite3.connect(f"file:{db_path}?immutable=1", uri=True)
+        try:
+            return [
+                bytes(row[0])
+                for row in connection.execute("SELECT blob FROM Packages ORDER BY hnum")
+            ]
+        finally:
+            connection.close()
+    except sqlite3.Error as exc:
+        raise RpmDBError(f"Failed to read SQLite rpmdb: {str(exc)}") from exc
+
+
+def _read_bdb_overflow(
+    data: bytes, byte_order: str, page_size: int, page_number: int, length: int
+) -> bytes:
+    """Read an item stored in a chain of Berkeley DB overflow pages."""
+    result = bytearray()
+    seen = set()
+    while page_number and len(result) < length:
+        if page_number in seen or (page_number + 1) * page_size > len(data):
+            raise RpmDBError(f"Invalid overflow page {page_number} in rpmdb")
+        seen.add(page_number)
+
+        page_offset = page_number * page_size
+        next_page, used = struct.unpack_from(
+            byte_order + "I2xH", data, page_offset + 16
+        )
+        start = page_offset + _BDB_PAGE_HEADER_SIZE
+        result.extend(data[start : start + used])
+        page_number = next_page
+
+    if len(result) != length:
+        raise RpmDBError("Truncated overflow item in rpmdb")
+
+    return bytes(result)
+
+
+def _read_bdb_hash(data: bytes) -> List[bytes]:
+    """Read header blobs from a Berkeley DB hash rpmdb (the Packages file)."""
+    if len(data) < 72:
+        raise RpmDBError("Berkeley DB file too short")
+
+    for byte_order in ("<", ">"):
+        if struct.unpack_from(byte_order + "I", data, 12)[0] == _BDB_HASH_MAGIC:
+            break
+    else:
+        raise RpmDBError("Not a Berkeley DB hash database")
+
+    page_size = struct.unpack_from(byte_order + "I", data, 20)[0]
+    encrypt_alg, metaflags = data[24], data[26]
+    if encrypt_alg or metaflags & _BDB_METAFLAG_CHKSUM or page_size < 512:
+        raise RpmDBError("Unsupported Berkeley DB database settings")
+
+    records: List[Tuple[bytes, bytes]] = []
+    for page_offset in range(page_size, len(data) - page_size + 1, page_size):
+        page_type = data[page_offset + 25]
+        if page_type not in (_BDB_P_HASH, _BDB_P_HASH_UNSORTED):
+            continue
+
+        entries = struct.unpack_from(byte_order + "H", data, page_offset + 20)[0]
+        offsets = struct.unpack_from(
+            f"{byte_order}{entries}H", data, page_offset + _BDB_PAGE_HEADER_SIZE
+        )
+        items = []
+        for idx, item_offset in enumerate(offsets):
+            item_end = offsets[idx - 1] if idx else page_size
+            if not 0 < item_offset < item_end <= page_size:
+                raise RpmDBError("Invalid item offset in rpmdb hash page")
+
+            item_type = data[page_offset + item_offset]
+            if item_type == _BDB_H_KEYDATA:
+                items.append(
+                    data[page_offset + item_offset + 1 : page_offset + item_end]
+                )
+            elif item_type == _BDB_H_OFFPAGE:
+                overflow_page, length = struct.unpack_from(
+                    byte_order + "II", data, page_offset + item_offset + 4
+                )
+                items.append(
+                    _read_bdb_overflow(
+                        data, byte_order, page_size, overflow_page, length
+                    )
+                )
+            else:
+                raise RpmDBError(f"Unsupported hash item type {item_type} in rpmdb")
+
+        records.extend(zip(items[::2], items[1::2]))
+
+    result = []
+    for key, value in sorted(
+        records, key=lambda record: struct.unpack(byte_order + "I", record[0])[0]
+    ):
+        # The record with key 0 keeps the next package instance number.
+        if len(key) != 4 or not struct.unpack(byte_order + "I", key)[0]:
+            continue
+        result.append(value)
+
+    return result
+
+
+def _read_ndb(data: bytes) -> List[bytes]:
+    """Read header blobs from an NDB rpmdb (the Packages.db file)."""
+    if len(data) < 32:
+        raise RpmDBError("NDB file too short")
+
+    magic, version, _, slot_pages = struct.unpack_from("<IIII", data, 0)
+    if magic != _NDB_HEADER_MAGIC or version != 0 or not slot_pages:
+        raise RpmDBError("Not a supported NDB database")
+
+    result = []
+    # The header occupies the first two slots.
+    for idx in range(slot_pages * _NDB_SLOTS_PER_PAGE - 2):
+        slot_magic, package_index, block_offset, block_count = struct.unpack_from(
+            "<IIII", data, 32 + idx * 16
+        )
+        if slot_magic != _NDB_SLOT_MAGIC:
+            raise RpmDBError("Bad slot magic in NDB database")
+
+        if not package_index:
+            continue
+
+        blob_offset = block_offset * _NDB_BLOCK_SIZE
+        if blob_offset + 16 > len(data):
+            raise RpmDBError("NDB blob out of bounds")
+
+        blob_magic, blob_index, _, blob_length = struct.unpack_from(
+            "<IIII", data, blob_offset
+        )
+        if blob_magic != _NDB_BLOB_MAGIC or blob_index != package_index:
+            raise RpmDBError("Bad blob header in NDB database")
+
+        if 16 + blob_length > block_count * _NDB_BLOCK_SIZE:
+            raise RpmDBError("NDB blob exceeds blocks allocated")
+
+        result.append(
+            (package_index, data[blob_offset + 16 : blob_offset + 16 + blob_length])
+        )
+
+    return [blob for _, blob in sorted(result)]
+
+
+def _read_file(file_path: str) -> bytes:
+    """Read the whole database file."""
+    with open(file_path, "rb") as db_file:
+        return db_file.read()
+
+
+def _find_rpmdb(path: str) -> Optional[Tuple[str, str]]:
+    """Find rpmdb in rootfs, return its format and path to the database file."""
+    candidates = (
+        ("sqlite", "rpmdb.sqlite"),
+        ("ndb", "Packages.db"),
+        ("bdb", "Packages"),
+    )
+    for rpmdb_path in _RPMDB_PATHS:
+        real_path = get_real_relative_path(path, rpmdb_path)
+        if real_path is None:
+            continue
+
+        for db_format, file_name in candidates:
+            db_path = os.path.join(path, real_path, file_name)
+            if os.path.isfile(db_path):
+                return db_format, db_path
+
+    return None
+
+
+def read_rpmdb(path: str) -> Optional[List[RpmPackage]]:
+    """Read packages installed in the given rootfs from rpmdb, return None if no rpmdb is present."""
+    found = _find_rpmdb(path)
+    if found is None:
+        return None
+
+    db_format, db_path = found
+    _LOGGER.debug("Reading %s rpmdb from %r", db_format, db_path[len(path) :])
+    try:
+        if db_format == "sqlite":
+            blobs: Iterable[bytes] = _read_sqlite(db_path)
+        elif db_format == "ndb":
+            blobs = _read_ndb(_read_file(db_path))
+        else:
+            blobs = _read_bdb_hash(_read_file(db_path))
+    except (OSError, struct.error) as exc:
+        raise RpmDBError(f"Failed to read rpmdb {db_path!r}: {str(exc)}") from exc
+
+    try:
+        return [_package_from_header(blob) for blob in blobs]
+    except struct.error as exc:
+        raise RpmDBError(f"Failed to parse header in rpmdb: {str(exc)}") from exc
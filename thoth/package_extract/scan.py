@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A single traversal of rootfs feeding visitors, so analyzers walking rootfs share one pass over it."""
+
+import abc
+import logging
+import posixpath
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+import attr
+
+from .profiling import count
+from .profiling import profile_phase
+from .pydist import LIBRARY_DIRECTORIES
+from .vfs import VirtualRootfs
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Visitor(abc.ABC):
+    """A visitor of directories found when scanning rootfs, results are available once the scan finishes."""
+
+    @abc.abstractmethod
+    def visit(
+        self,
+        rootfs: VirtualRootfs,
+        dir_path: str,
+        dir_names: List[str],
+        file_names: List[str],
+    ) -> bool:
+        """Visit a directory with the given entries (symlinks are listed as files), return False to skip its subtree."""
+
+    @abc.abstractmethod
+    def get_result(self) -> Any:
+        """Get result collected by the visitor."""
+
+
+@attr.s(slots=True)
+class PythonFileCollector(Visitor):
+    """Collect paths of Python files, symlinks to files are reported as well."""
+
+    file_paths = attr.ib(type=List[str], factory=list)
+
+    def visit(
+        self,
+        rootfs: VirtualRootfs,
+        dir_path: str,
+        dir_names: List[str],
+        file_names: List[str],
+    ) -> bool:
+        """Record Python files in the directory."""
+        for file_name in file_names:
+            if file_name.endswith(".py"):
+                file_path = posixpath.join(dir_path, file_name)
+                if rootfs.isfile(file_path):
+                    self.file_paths.append(file_path)
+
+        return True
+
+    def get_result(self) -> List[str]:
+        """Get sorted paths of Python files found."""
+        return sorted(self.file_paths)
+
+
+@attr.s(slots=True)
+class LibraryDirectoryCollector(Visitor):
+    """Collect directories Python distributions are installed into, their content is not visited."""
+
+    locations = attr.ib(type=List[str], factory=list)
+
+    def visit(
+        self,
+        rootfs: VirtualRootfs,
+        dir_path: str,
+        dir_names: List[str],
+        file_names: List[str],
+    ) -> bool:
+        """Record the directory if it is a library directory."""
+        if posixpath.basename(dir_path) in LIBRARY_DIRECTORIES:
+            self.locations.append(dir_path)
+            return False
+
+        return True
+
+    def get_result(self) -> List[str]:
+        """Get paths of library directories found."""
+        return self.locations
+
+
+# Visitors analyzers can request by name, see Analyzer.visitors.
+VISITORS: Dict[str, Callable[[], Visitor]] = {
+    "python-files": PythonFileCollector,
+    "library-directories": LibraryDirectoryCollector,
+}
+
+
+def scan(rootfs: VirtualRootfs, visitors: Iterable[str]) -> Dict[str, Any]:
+    """Walk rootfs once feeding all the given visitors, return their results keyed by visitor name.
+
+    Subtrees are walked only while at least one of the visitors is interested in them.
+    """
+    instances = {name: VISITORS[name]() for name in visitors}
+    if not instances:
+        return {}
+
+    _LOGGER.debug("Scanning rootfs with visitors %s", ", ".join(instances))
+    # Visitors still interested in directories to be walked, all visitors are interested by default.
+    active: Dict[str, List[Visitor]] = {}
+    visited = 0
+    with profile_phase("scan-rootfs"):
+        for dir_path, dir_names, file_names in rootfs.walk():
+            visited += 1
+            interested = [
+                visitor
+                for visitor in active.pop(dir_path, list(instances.values()))
+                if visitor.visit(rootfs, dir_path, dir_names, file_names)
+            ]
+            if not interested:
+                dir_names.clear()
+                continue
+
+            for dir_name in dir_names:
+                active[posixpath.join(dir_path, dir_name)] = interested
+
+    count("scanned_directories", visited)
+    return {name: visitor.get_result() for name, visitor in instances.items()}
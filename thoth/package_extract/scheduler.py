@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Concurrent execution of tasks respecting dependencies between them."""
+
+import concurrent.futures
+import contextvars
+import functools
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import attr
+
+from .exceptions import CommandError
+from .exceptions import TimeoutExpired
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@attr.s(slots=True)
+class Task:
+    """A named unit of work run once all tasks it depends on finished."""
+
+    name = attr.ib(type=str)
+    func = attr.ib(type=Callable[[], Any])
+    dependencies = attr.ib(type=Tuple[str, ...], default=())
+
+
+def _kill(process: subprocess.Popen) -> None:
+    """Kill the process group of a process started by run_task_command."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+@attr.s(slots=True)
+class _TaskState:
+    """Processes run by a task, they are killed once the task is cancelled."""
+
+    processes = attr.ib(type=Set[subprocess.Popen], factory=set)
+    cancelled = attr.ib(type=bool, default=False)
+    _lock = attr.ib(type=threading.Lock, factory=threading.Lock, repr=False)
+
+    def add(self, process: subprocess.Popen) -> None:
+        """Track a process started by the task, it is killed right away if the task was cancelled."""
+        with self._lock:
+            if not self.cancelled:
+                self.processes.add(process)
+                return
+
+        _kill(process)
+
+    def discard(self, process: subprocess.Popen) -> None:
+        """Stop tracking a finished process."""
+        with self._lock:
+            self.processes.discard(process)
+
+    def cancel(self) -> None:
+        """Cancel the task, processes it runs are killed."""
+        with self._lock:
+            self.cancelled = True
+            processes = list(self.processes)
+
+        for process in processes:
+            _kill(process)
+
+
+_CURRENT_TASK: contextvars.ContextVar[Optional[_TaskState]] = contextvars.ContextVar(
+    "current_task", default=None
+)
+
+
+def _run_task(state: _TaskState, func: Callable[[], Any]) -> Any:
+    """Run a task in the current context, processes it starts by run_task_command are tracked in its state."""
+    _CURRENT_TASK.set(state)
+    return func()
+
+
+def run_task_command(
+    cmd: str, timeout: Optional[float] = None, raise_on_error: bool = True
+) -> subprocess.CompletedProcess:
+    """Run a shell command on behalf of the current task, block until it finishes and return its (text) output.
+
+    The command is run in its own process group, the whole group is killed if the command does not finish
+    within the timeout (in seconds, TimeoutExpired is raised then) or if the task running it is cancelled.
+    CommandError is raised if the command exits with non-zero status code, unless turned off.
+    """
+    _LOGGER.debug("Running command %r", cmd)
+    process = subprocess.Popen(
+        cmd,
+        shell=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        start_new_session=True,
+    )
+    task = _CURRENT_TASK.get()
+    if task is not None:
+        task.add(process)
+
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(process)
+        process.communicate()
+        raise TimeoutExpired(f"Command {cmd!r} did not finish in {timeout} seconds")
+    except BaseException:
+        _kill(process)
+        process.wait()
+        raise
+    finally:
+        if task is not None:
+            task.discard(process)
+
+    if process.returncode != 0 and raise_on_error:
+        raise CommandError(
+            f"Command exited with non-zero status code ({process.returncode}): {stderr}"
+        )
+
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+def _skip_dependents(pending: Dict[str, Task], results: Dict[str, Any]) -> None:
+    """Do not run pending tasks depending on tasks which did not finish in time, they time out as well."""
+    skipped = True
+    while skipped:
+        skipped = False
+        for name, task in list(pending.items()):
+            for dependency in task.dependencies:
+                if isinstance(results.get(dependency), TimeoutExpired):
+                    _LOGGER.warning(
+                        "Task %r is not run, task %r it depends on did not finish in time",
+                        name,
+                        dependency,
+                    )
+                    del pending[name]
+                    results[name] = TimeoutExpired(
+                        f"Task {name!r} was not run, task {dependency!r} it depends on did not finish in time"
+                    )
+                    skipped = True
+                    break
+
+
+def run_tasks(
+    tasks: List[Task],
+    *,
+    workers: Optional[int] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Run tasks concurrently on a thread pool respecting their dependencies, results are keyed by task names.
+
+    Each task has to finish within the given timeout (in seconds) once it started. A task which did not finish
+    in time is cancelled - processes it runs by run_task_command are killed - and gets TimeoutExpired as its result,
+    tasks depending on it are not run and get TimeoutExpired as well. If a task fails, its exception is raised
+    once running tasks are cancelled. Threads cannot be interrupted, all threads are waited for before
+    returning so no task outlives the call. Tasks are run in copies of the caller's context, results are
+    ordered as tasks were given.
+    """
+    pending = {task.name: task for task in tasks}
+    for task in tasks:
+        for dependency in task.dependencies:
+            if dependency not in pending:
+                raise ValueError(
+                    f"Task {task.name!r} depends on an unknown task {dependency!r}"
+                )
+
+    results: Dict[str, Any] = {}
+    states: Dict[str, _TaskState] = {}
+    running: Dict[concurrent.futures.Future, Tuple[str, float]] = {}
+    max_workers = workers or len(tasks) or 1
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while pending or running:
+            _skip_dependents(pending, results)
+            for name, task in list(pending.items()):
+                # Tasks are submitted only to free workers so they start right away, time spent waiting
+                # in the executor queue does not count towards the timeout.
+                if len(running) >= max_workers:
+                    break
+
+                if all(dependency in results for dependency in task.dependencies):
+                    _LOGGER.debug("Starting task %r", name)
+                    del pending[name]
+                    states[name] = _TaskState()
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        functools.partial(_run_task, states[name], task.func),
+                    )
+                    running[future] = (name, time.monotonic())
+
+            if not running:
+                if pending:
+                    raise ValueError(
+                        f"Tasks with cyclic dependencies cannot be run: {sorted(pending)}"
+                    )
+                break
+
+            wait_timeout = None
+            if timeout is not None:
+                first_deadline = min(start for _, start in running.values()) + timeout
+                wait_timeout = max(first_deadline - time.monotonic(), 0)
+
+            done, _ = concurrent.futures.wait(
+                running,
+                timeout=wait_timeout,
+                return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                name, start = running.pop(future)
+                results[name] = future.result()
+                _LOGGER.debug(
+                    "Task %r finished in %.3f seconds", name, time.monotonic() - start
+                )
+
+            if timeout is not None:
+                now = time.monotonic()
+                for future, (name, start) in list(running.items()):
+                    if now - start >= timeout:
+                        _LOGGER.warning(
+                            "Task %r did not finish in %s seconds, cancelling it",
+                            name,
+                            timeout,
+                        )
+                        del running[future]
+                        states[name].cancel()
+                        results[name] = TimeoutExpired(
+                            f"Task {name!r} did not finish in {timeout} seconds"
+                        )
+    finally:
+        for future, (name, _) in running.items():
+            future.cancel()
+            states[name].cancel()
+        # Threads of cancelled tasks are waited for, they could still use resources owned by the caller.
+        executor.shutdown(wait=True)
+
+    return {task.name: results[task.name] for task in tasks}
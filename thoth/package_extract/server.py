@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A long-running service accepting extraction jobs over HTTP."""
+
+import collections
+import concurrent.futures
+import http.server
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import attr
+from thoth.common import SafeJSONEncoder
+
+from .analyzers import get_analyzers
+from .core import extract_image
+from .exceptions import NotSupported
+from .exceptions import ThothPkgdepsException
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAX_REQUEST_SIZE = 64 * 1024
+_MAX_WAIT = 300.0
+# Options of extract_image which can be set per job, values are checked to be of the stated type.
+_JOB_OPTIONS = {
+    "registry_credentials": str,
+    "tls_verify": bool,
+    "plain_http": bool,
+    "timeout": int,
+    "analyzers": list,
+    "skip": list,
+    "profile": bool,
+}
+
+
+class JobQueueFull(ThothPkgdepsException):  # noqa: N818
+    """Raised when no more jobs can be accepted."""
+
+
+@attr.s(slots=True)
+class Job:
+    """An extraction job with its state, the result is kept once the job finishes."""
+
+    id = attr.ib(type=str)
+    image = attr.ib(type=str)
+    options = attr.ib(type=Dict[str, Any], factory=dict)
+    status = attr.ib(type=str, default="queued")
+    result = attr.ib(type=Optional[Dict[str, Any]], default=None)
+    error = attr.ib(type=Optional[str], default=None)
+    created = attr.ib(type=float, factory=time.time)
+    finished = attr.ib(type=Optional[float], default=None)
+    done = attr.ib(type=threading.Event, factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job into a JSON serializable form."""
+        result = {
+            "id": self.id,
+            "image": self.image,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+        }
+        if self.status == "finished":
+            result["result"] = self.result
+        elif self.status == "failed":
+            result["error"] = self.error
+
+        return result
+
+
+class JobQueue:
+    """Jobs run by a bounded pool of workers, keyword arguments (such as caches) are shared by all jobs.
+
+    At most max_pending jobs can wait for a worker, the last max_finished finished jobs are kept to be queried.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        max_pending: int = 100,
+        max_finished: int = 1000,
+        **extract_kwargs: Any,
+    ) -> None:
+        """Initialize the job queue and start its workers."""
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._extract_kwargs = extract_kwargs
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="job"
+        )
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._finished: collections.deque = collections.deque()
+        self._pending = 0
+        self._running = 0
+
+    def submit(self, image: str, options: Optional[Dict[str, Any]] = None) -> Job:
+        """Submit a job extracting the given image, raise JobQueueFull if too many jobs are waiting."""
+        job = Job(id=uuid.uuid4().hex, image=image, options=dict(options or {}))
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(
+                    f"Too many jobs waiting for a worker ({self._pending})"
+                )
+
+            self._pending += 1
+            self._jobs[job.id] = job
+
+        self._executor.submit(self._run, job)
+        _LOGGER.info("Job %r extracting image %r was queued", job.id, image)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Get the job with the given id, return None if there is no such job (or it was already dropped)."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Get number of jobs in each state."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._pending,
+                "running": self._running,
+                "finished": len(self._finished),
+            }
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs and wait for running jobs to finish."""
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: Job) -> None:
+        """Run the given job in a worker."""
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        job.status = "running"
+        _LOGGER.info("Running job %r extracting image %r", job.id, job.image)
+
+        options = dict(job.options)
+        skip = options.pop("skip", None)
+        analyzers = options.pop("analyzers", None)
+        try:
+            if analyzers is not None or skip is not None:
+                analyzers = [a.name for a in get_analyzers(analyzers, skip or ())]
+
+            job.result = extract_image(
+                job.image,
+                options.pop("timeout", None),
+                analyzers=analyzers,
+                include_profile=options.pop("profile", False),
+                **options,
+                **self._extract_kwargs,
+            )
+            job.status = "finished"
+        except Exception as exc:
+            _LOGGER.exception("Job %r extracting image %r failed", job.id, job.image)
+            job.error = str(exc)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._running -= 1
+                self._finished.append(job.id)
+                while len(self._finished) > self.max_finished:
+                    self._jobs.pop(self._finished.popleft(), None)
+            job.done.set()
+
+
+def _parse_job_request(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate options of a job request, raise ValueError if the request is not valid."""
+    if not isinstance(body, dict) or not isinstance(body.get("image"), str):
+        raise ValueError("Image to be extracted has to be stated as a string")
+
+    options = {}
+    for name, value in body.items():
+        if name == "image" or value is None:
+            continue
+
+        if name not in _JOB_OPTIONS:
+            raise ValueError(f"Unknown job option {name!r}")
+
+        if not isinstance(value, _JOB_OPTIONS[name]) or (
+            _JOB_OPTIONS[name] is int and isinstance(value, bool)
+        ):
+            raise ValueError(f"Invalid value of job option {name!r}: {value!r}")
+
+        options[name] = value
+
+    return options
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Handler of the job API."""
+
+    server: Any
+
+    def address_string(self) -> str:
+        """Get client address for logging, clients connected via Unix sockets have no address."""
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests served."""
+        _LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body: Dict[str, Any]) -> None:
+        """Send a JSON response, values not serializable by default (such as datetime) are encoded as by the CLI."""
+        content = json.dumps(body, cls=SafeJSONEncoder).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Get state of a job (waiting for it to finish if requested) or health of the service."""
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/health":
+            self._send(200, {"status": "ok", **self.server.job_queue.stats()})
+            return
+
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "jobs":
+            self._send(404, {"error": "Not found"})
+            return
+
+        job = self.server.job_queue.get(parts[1])
+        if job is None:
+            self._send(404, {"error": f"No job {parts[1]!r} found"})
+            return
+
+        query = urllib.parse.parse_qs(url.query)
+        if "wait" in query:
+            try:
+                wait = min(float(query["wait"][0]), _MAX_WAIT)
+            except ValueError:
+                self._send(400, {"error": "Time to wait has to be stated in seconds"})
+                return
+            job.done.wait(wait)
+
+        self._send(200, job.to_dict())
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Submit a job."""
+        if urllib.parse.urlsplit(self.path).path.rstrip("/") != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > _MAX_REQUEST_SIZE:
+            self._send(413, {"error": "Request too large"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(length) or b"null")
+            options = _parse_job_request(body)
+            if "analyzers" in options or "skip" in options:
+                get_analyzers(options.get("analyzers"), options.get("skip", ()))
+        except (ValueError, NotSupported) as exc:
+            self._send(400, {"error": str(exc)})
+            return
+
+        try:
+            job = self.server.job_queue.submit(body["image"], options)
+        except JobQueueFull as exc:
+            self._send(503, {"error": str(exc)})
+            return
+
+        self._send(202, job.to_dict())
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    """HTTP server listening on a TCP socket."""
+
+    daemon_threads = True
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+
+    daemon_threads = True
+
+
+def serve(
+    job_queue: JobQueue,
+    *,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Optional[str] = None,
+) -> None:
+    """Serve the job API on the given TCP address or Unix socket until interrupted.
+
+    Jobs are submitted by POST /jobs with a JSON body stating the image and job options (registry_credentials,
+    tls_verify, plain_http, timeout, analyzers, skip and profile). Their state is obtained by GET /jobs/<id>, pass wait
+    query parameter to wait (up to the given number of seconds) for the job to finish. GET /health reports
+    number of jobs in each state.
+    """
+    server: socketserver.BaseServer
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, _RequestHandler)
+        _LOGGER.info("Serving extraction jobs on Unix socket %r", unix_socket)
+    else:
+        server = _HTTPServer((host, port), _RequestHandler)
+        _LOGGER.info("Serving extraction jobs on %s:%d", host, port)
+
+    server.job_queue = job_queue  # type: ignore
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        _LOGGER.info("Shutting down, waiting for running jobs to finish")
+    finally:
+        server.server_close()
+        job_queue.shutdown()
+        if unix_socket:
+            try:
+                os.remove(unix_socket)
+            except OSError:
+                pass
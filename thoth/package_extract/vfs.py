@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# thoth-package-extract
+# Copyright(C) 2018, 2019, 2020 Fridolin Pokorny
+#
+# This program is free software: you can redistribute it and / or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""A virtual root filesystem indexing content of image layers without extracting them."""
+
+import io
+import logging
+import os
+import posixpath
+import shutil
+import tarfile
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import Generator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import attr
+
+from .layers import LayerChanges
+from .layers import compile_path_patterns
+from .layers import normalize_member_name
+
+_LOGGER = logging.getLogger(__name__)
+
+_MAX_SYMLINKS = 40
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+FILE = "file"
+DIRECTORY = "directory"
+SYMLINK = "symlink"
+OTHER = "other"
+
+
+@attr.s(slots=True, frozen=True)
+class VirtualEntry:
+    """An entry of virtual rootfs together with the layer which wrote it.
+
+    Content of regular files is stored in the source file - either at the given offset of an uncompressed layer
+    tarball, or in a file of an extracted layer tree if no offset is stated (size is not known upfront then).
+    """
+
+    type = attr.ib(type=str)
+    mode = attr.ib(type=int, default=0o644)
+    size = attr.ib(type=Optional[int], default=0)
+    link_target = attr.ib(type=Optional[str], default=None)
+    source = attr.ib(type=Optional[str], default=None)
+    offset = attr.ib(type=Optional[int], default=None)
+    layer = attr.ib(type=Optional[str], default=None)
+
+
+class _MemberFile(io.RawIOBase):
+    """A read-only view of a member stored at the given offset of an uncompressed tarball."""
+
+    def __init__(self, path: str, offset: int, size: int) -> None:
+        """Open the tarball."""
+        super().__init__()
+        self._file = open(path, "rb")
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        """Member files are readable."""
+        return True
+
+    def seekable(self) -> bool:
+        """Member files are seekable."""
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        """Read content of the member into the given buffer."""
+        size = min(len(buffer), self._size - self._position)
+        if size <= 0:
+            return 0
+
+        self._file.seek(self._offset + self._position)
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._position += read
+        return read
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Change position in the member."""
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        """Get position in the member."""
+        return self._position
+
+    def close(self) -> None:
+        """Close the tarball."""
+        self._file.close()
+        super().close()
+
+
+class VirtualRootfs:
+    """A root filesystem constructed by indexing layers in the layer order, no file content is written.
+
+    Paths are relative to rootfs (a leading slash is ignored). Whiteouts are applied when layers are indexed,
+    whited-out entries are not present in the index. Like os.path functions, queries follow symlinks
+    (resolved relative to rootfs, never escaping it) unless stated otherwise.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty rootfs."""
+        self._entries: Dict[str, VirtualEntry] = {"": VirtualEntry(DIRECTORY, 0o755)}
+        self._children: Dict[str, Set[str]] = {"": set()}
+
+    @classmethod
+    def from_directory(cls, path: str) -> "VirtualRootfs":
+        """Index a root filesystem stored in a directory."""
+        rootfs = cls()
+        rootfs.add_tree(path)
+        return rootfs
+
+    def _remove(self, path: str) -> None:
+        """Remove an entry, directories are removed with their content."""
+        if self._entries.pop(path, None) is None:
+            return
+
+        for name in self._children.pop(path, ()):
+            self._remove(posixpath.join(path, name))
+
+        # Parents of nested entries are removed first.
+        siblings = self._children.get(posixpath.dirname(path)) if path else None
+        if siblings is not None:
+            siblings.discard(posixpath.basename(path))
+
+    def _get_directory(self, path: str) -> str:
+        """Get path to a directory where entries of the given directory are stored, create it if missing.
+
+        Directories stated by layers can go through symlinks to directories, their entries are stored in the
+        directory the symlink points to as if the layer was extracted.
+        """
+        resolved = self.resolve(path)
+        if resolved is not None and resolved in self._children:
+            return resolved
+
+        parent = posixpath.dirname(path) if path else ""
+        parent_path = self._get_directory(parent) if path else ""
+        path = posixpath.join(parent_path, posixpath.basename(path))
+        if path not in self._children:
+            self._remove(path)
+            self._entries[path] = VirtualEntry(DIRECTORY, 0o755)
+            self._children[path] = set()
+            self._children[parent_path].add(posixpath.basename(path))
+
+        return path
+
+    def _add(self, path: str, entry: VirtualEntry) -> None:
+        """Add an entry, directories are merged with directories present."""
+        if not path:
+            return
+
+        parent = self._get_directory(posixpath.dirname(path))
+        name = posixpath.basename(path)
+        path = posixpath.join(parent, name)
+        if entry.type == DIRECTORY and path in self._children:
+            self._entries[path] = entry
+            return
+
+        if entry.type == DIRECTORY and self.isdir(path):
+            # Directories are merged with symlinks to directories present in lower layers.
+            return
+
+        self._remove(path)
+        self._entries[path] = entry
+        self._children[parent].add(name)
+        if entry.type == DIRECTORY:
+            self._children[path] = set()
+
+    def apply_whiteouts(self, changes: LayerChanges) -> None:
+        """Remove entries whited-out by a layer, this needs to be done before the layer content is added."""
+        for path in changes.removed:
+            parent = self.resolve(posixpath.dirname(path))
+            if parent is not None:
+                self._remove(posixpath.join(parent, posixpath.basename(path)))
+
+        for dir_path in changes.opaque:
+            resolved = self.resolve(dir_path)
+            for name in list(self._children.get(resolved, ())):  # type: ignore
+                self._remove(posixpath.join(resolved, name))  # type: ignore
+
+    def add_member(
+        self, tar_path: str, member: tarfile.TarInfo, layer: Optional[str] = None
+    ) -> None:
+        """Add a member of an uncompressed layer tarball, hardlinks refer to content of their targets."""
+        path = normalize_member_name(member.name)
+        if member.isdir():
+            entry = VirtualEntry(DIRECTORY, member.mode, layer=layer)
+        elif member.issym():
+            entry = VirtualEntry(
+                SYMLINK, member.mode, link_target=member.linkname, layer=layer
+            )
+        elif member.islnk():
+            target = self._entries.get(normalize_member_name(member.linkname))
+            if target is None or target.type != FILE:
+                _LOGGER.debug(
+                    "Skipping hardlink %r to %r, target not found",
+                    member.name,
+                    member.linkname,
+                )
+                return
+            entry = attr.evolve(target, mode=member.mode, layer=layer)
+        elif member.isreg():
+            entry = VirtualEntry(
+                FILE,
+                member.mode,
+                size=member.size,
+                source=tar_path,
+                offset=member.offset_data,
+                layer=layer,
+            )
+        else:
+            entry = VirtualEntry(OTHER, member.mode, layer=layer)
+
+        self._add(path, entry)
+
+    def add_tree(self, tree_path: str, layer: Optional[str] = None) -> None:
+        """Add content of an extracted layer tree (or of a whole root filesystem)."""
+        stack = [""]
+        while stack:
+            relative_path = stack.pop()
+            with os.scandir(os.path.join(tree_path, relative_path)) as entries:
+                for dir_entry in entries:
+                    entry_path = posixpath.join(relative_path, dir_entry.name)
+                    try:
+                        if dir_entry.is_symlink():
+                            entry = VirtualEntry(
+                                SYMLINK,
+                                0o777,
+                                link_target=os.readlink(dir_entry.path),
+                                layer=layer,
+                            )
+                        elif dir_entry.is_dir(follow_symlinks=False):
+                            entry = VirtualEntry(DIRECTORY, 0o755, layer=layer)
+                            stack.append(entry_path)
+                        elif dir_entry.is_file(follow_symlinks=False):
+                            entry = VirtualEntry(
+                                FILE, size=None, source=dir_entry.path, layer=layer
+                            )
+                        else:
+                            entry = VirtualEntry(OTHER, layer=layer)
+                    except OSError as exc:
+                        _LOGGER.warning(
+                            "Failed to index %r, exception is not fatal: %s",
+                            entry_path,
+                            str(exc),
+                        )
+                        continue
+
+                    self._add(entry_path, entry)
+
+    def resolve(self, path: str) -> Optional[str]:
+        """Resolve symlinks in the given path, None is returned if too many symlinks are encountered.
+
+        The resolved path does not need to exist, like with os.path.realpath.
+        """
+        resolved: List[str] = []
+        pending = list(reversed(path.split("/")))
+        followed = 0
+        while pending:
+            part = pending.pop()
+            if not part or part == ".":
+                continue
+
+            if part == "..":
+                if resolved:
+                    resolved.pop()
+                continue
+
+            entry = self._entries.get("/".join(resolved + [part]))
+            if entry is None or entry.type != SYMLINK:
+                resolved.append(part)
+                continue
+
+            followed += 1
+            if followed > _MAX_SYMLINKS:
+                return None
+
+            if entry.link_target.startswith("/"):  # type: ignore
+                resolved = []
+            pending.extend(reversed(entry.link_target.split("/")))  # type: ignore
+
+        return "/".join(resolved)
+
+    def get_sources(self) -> Set[str]:
+        """Get files content of regular files in rootfs is read from."""
+        return {
+            entry.source  # type: ignore
+            for entry in self._entries.values()
+            if entry.type == FILE
+        }
+
+    def lstat(self, path: str) -> Optional[VirtualEntry]:
+        """Get the entry stored at the given path, symlinks in the last component are not followed."""
+        path = normalize_member_name(path)
+        parent = self.resolve(posixpath.dirname(path))
+        if parent is None:
+            return None
+        return self._entries.get(posixpath.join(parent, posixpath.basename(path)))
+
+    def stat(self, path: str) -> Optional[VirtualEntry]:
+        """Get the entry the given path points to, return None if it does not exist."""
+        resolved = self.resolve(normalize_member_name(path))
+        if resolved is None:
+            return None
+        return self._entries.get(resolved)
+
+    def exists(self, path: str) -> bool:
+        """Check whether the given path exists, broken symlinks do not exist."""
+        return self.stat(path) is not None
+
+    def isfile(self, path: str) -> bool:
+        """Check whether the given path is a regular file."""
+        entry = self.stat(path)
+        return entry is not None and entry.type == FILE
+
+    def isdir(self, path: str) -> bool:
+        """Check whether the given path is a directory."""
+        entry = self.stat(path)
+        return entry is not None and entry.type == DIRECTORY
+
+    def islink(self, path: str) -> bool:
+        """Check whether the given path is a symlink."""
+        entry = self.lstat(path)
+        return entry is not None and entry.type == SYMLINK
+
+    def readlink(self, path: str) -> str:
+        """Get target of the given symlink."""
+        entry = self.lstat(path)
+        if entry is None or entry.type != SYMLINK:
+            raise OSError(f"Not a symlink: {path!r}")
+        return entry.link_target  # type: ignore
+
+    def getsize(self, path: str) -> int:
+        """Get size of the given file."""
+        entry = self.stat(path)
+        if entry is None or entry.type != FILE:
+            raise FileNotFoundError(f"No such file: {path!r}")
+
+        if entry.size is None:
+            return os.stat(entry.source).st_size  # type: ignore
+        return entry.size
+
+    def listdir(self, path: str = "") -> List[str]:
+        """List names of entries in the given directory, sorted."""
+        resolved = self.resolve(normalize_member_name(path))
+        if resolved is None or resolved not in self._children:
+            raise NotADirectoryError(f"Not a directory: {path!r}")
+        return sorted(self._children[resolved])
+
+    def walk(
+        self, top: str = ""
+    ) -> Generator[Tuple[str, List[str], List[str]], None, None]:
+        """Walk the directory tree top-down like os.walk, symlinks to directories are listed as files."""
+        stack = [normalize_member_name(top)]
+        while stack:
+            dir_path = stack.pop()
+            dir_names = []
+            file_names = []
+            for name in sorted(self._children.get(dir_path, ())):
+                if posixpath.join(dir_path, name) in self._children:
+                    dir_names.append(name)
+                else:
+                    file_names.append(name)
+
+            yield dir_path, dir_names, file_names
+            stack.extend(posixpath.join(dir_path, name) for name in reversed(dir_names))
+
+    def glob(self, pattern: str) -> List[str]:
+        """Get paths of entries matching the given pattern (see compile_path_patterns), symlinks are not followed."""
+        regex = compile_path_patterns([normalize_member_name(pattern)])
+        return sorted(path for path in self._entries if path and regex.match(path))
+
+    def open(self, path: str) -> BinaryIO:
+        """Open the given file for reading in binary mode."""
+        entry = self.stat(path)
+        if entry is None or entry.type != FILE:
+            raise FileNotFoundError(f"No such file: {path!r}")
+
+        if entry.offset is None:
+            return open(entry.source, "rb")  # type: ignore
+        return io.BufferedReader(_MemberFile(entry.source, entry.offset, entry.size))  # type: ignore
+
+    def read_bytes(self, path: str) -> bytes:
+        """Read content of the given file."""
+        with self.open(path) as file_:
+            return file_.read()
+
+    def read_text(
+        self, path: str, encoding: str = "utf-8", errors: str = "strict"
+    ) -> str:
+        """Read content of the given file as text."""
+        return self.read_bytes(path).decode(encoding, errors)
+
+    def materialize(
+        self, target_path: str, path_filter: Optional[Callable[[str], bool]] = None
+    ) -> int:
+        """Write the root filesystem into a directory, return number of bytes of files written.
+
+        Directories and symlinks are always written, if a filter is provided only files accepted by the filter
+        are written. Files from extracted layer trees are hardlinked if possible.
+        """
+        written = 0
+        os.makedirs(target_path, exist_ok=True)
+        for path, dir_names, file_names in self.walk():
+            for name in dir_names:
+                os.makedirs(os.path.join(target_path, path, name), exist_ok=True)
+
+            for name in file_names:
+                entry_path = posixpath.join(path, name)
+                entry = self._entries[entry_path]
+                member_target_path = os.path.join(target_path, entry_path)
+                try:
+                    if entry.type == SYMLINK:
+                        os.symlink(entry.link_target, member_target_path)  # type: ignore
+                    elif entry.type != FILE or (
+                        path_filter is not None and not path_filter(entry_path)
+                    ):
+                        continue
+                    elif entry.offset is None:
+                        try:
+                            os.link(entry.source, member_target_path)  # type: ignore
+                        except OSError:
+                            shutil.copyfile(entry.source, member_target_path)  # type: ignore
+                    else:
+                        with self.open(entry_path) as source_file, open(
+                            member_target_path, "wb"
+                        ) as target_file:
+                            shutil.copyfileobj(
+                                source_file, target_file, _COPY_BUFFER_SIZE
+                            )
+                        written += entry.size  # type: ignore
+                except OSError as exc:
+                    _LOGGER.warning(
+                        "Failed to materialize %r, exception is not fatal: %s",
+                        entry_path,
+                        str(exc),
+                    )
+
+        return written